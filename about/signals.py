@@ -0,0 +1,15 @@
+"""Keep the pre-rendered about page (config.prerender) current."""
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from config import prerender
+from .models import AboutData
+
+
+@receiver(post_save, sender=AboutData)
+@receiver(post_delete, sender=AboutData)
+@receiver(m2m_changed, sender=AboutData.featured_artworks.through)
+def prerender_about(sender, **kwargs):
+    prerender.schedule(reverse('about:about'))
@@ -31,7 +31,7 @@ def about_view(request):
             Painting.objects
             .filter(is_published=True)
             .order_by('-date_created')
-            .only('id', 'slug', 'title', 'cover_image')[:12]
+            .only('id', 'slug', 'title', 'cover_image', 'metadata')[:12]
         )
 
     context = {
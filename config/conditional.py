@@ -0,0 +1,88 @@
+"""Conditional GET (ETag / Last-Modified) for public pages.
+
+A page's validators come from a cheap version lookup (typically one
+``MAX(updated_at)`` query) instead of the rendered body, so a revalidating
+visitor whose copy is current gets a 304 without the view querying or
+rendering anything.
+
+The ETag also covers who is viewing (pages render the navbar for the
+signed-in user) and the deployed release (templates change on deploy).
+Requests carrying pending flash messages always render, since the
+messages must be shown and consumed.
+
+Responses are marked ``Cache-Control: no-cache, max-age=0``: browsers
+revalidate every time, and the site-wide page cache (CacheMiddleware,
+which would otherwise keep the page for ``CACHE_MIDDLEWARE_SECONDS``
+and answer before the validators run) leaves them alone. Revalidating
+costs the version lookup, not a render.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+
+def conditional_page(version_func):
+    """Decorate a view with validators derived from `version_func`.
+
+    `version_func(request, *args, **kwargs)` returns ``(last_modified,
+    token)``, where `token` is any repr-able value that changes whenever
+    the page would and `last_modified` is a datetime or ``None`` if no
+    single timestamp covers every change. Returning ``None`` instead
+    skips validation (the view then runs and handles e.g. a 404 itself).
+    It is called at most once per request.
+    """
+    def validators(request, *args, **kwargs):
+        if not hasattr(request, '_page_validators'):
+            request._page_validators = _page_validators(
+                request, version_func(request, *args, **kwargs)
+            )
+        return request._page_validators
+
+    def etag(request, *args, **kwargs):
+        return validators(request, *args, **kwargs)[0]
+
+    def last_modified(request, *args, **kwargs):
+        return validators(request, *args, **kwargs)[1]
+
+    def decorator(view):
+        conditional_view = condition(
+            etag_func=etag, last_modified_func=last_modified
+        )(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or len(
+                get_messages(request)
+            ):
+                response = view(request, *args, **kwargs)
+            else:
+                response = conditional_view(request, *args, **kwargs)
+            patch_cache_control(response, no_cache=True, max_age=0)
+            return response
+
+        # Also used by config.prerender to spot pages that need rebuilding
+        wrapper.page_version = version_func
+        return wrapper
+
+    return decorator
+
+
+def _page_validators(request, version):
+    if version is None:
+        return None, None
+    last_modified, token = version
+    user_id = request.user.pk if request.user.is_authenticated else None
+    digest = hashlib.md5(
+        repr((settings.RELEASE_VERSION, user_id, token)).encode(),
+        usedforsecurity=False,
+    ).hexdigest()
+    # Last-Modified cannot tell users apart, so only anonymous pages
+    # (the ones crawlers see) advertise it.
+    if user_id is not None:
+        last_modified = None
+    return digest, last_modified
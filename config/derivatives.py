@@ -0,0 +1,233 @@
+"""Locally generated responsive image derivatives.
+
+Every source image (a static file or a Cloudinary-stored painting
+image) is resized with Pillow into AVIF and WebP variants at each width
+in `WIDTHS` below its own width. Variants are content-addressed: they
+are named after a hash of the source bytes, so identical sources share
+files and a changed source never serves stale variants. They are
+written under ``DERIVATIVE_ROOT/variants`` and served by
+`DerivativeFilesMiddleware` with far-future cache headers.
+
+A small JSON index per source (keyed by `source_key`) records its hash,
+intrinsic size and generated widths, which is all templates need to
+emit a ``srcset`` (see gallery.templatetags.image_tags). Generation
+never happens during a page request: it runs when an upload is
+processed (dashboard.uploads) and in ``manage.py
+build_image_derivatives``. Until a source has derivatives, templates
+fall back to Cloudinary's own resizing, or to the original static file.
+Once it has them, pages no longer depend on Cloudinary being up.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from PIL import Image, ImageOps
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+WIDTHS = (320, 640, 960, 1280, 1920)
+# Preferred format first; browsers pick the first <source> they support
+FORMATS = (
+    ('avif', 'image/avif', {'quality': 50}),
+    ('webp', 'image/webp', {'quality': 78, 'method': 6}),
+)
+STATIC_IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+FETCH_TIMEOUT = 20
+# How long a source without derivatives is remembered as such
+MISSING_TTL = 60
+
+_lock = threading.Lock()
+_entries = {}
+
+
+def derivative_root():
+    return Path(settings.DERIVATIVE_ROOT)
+
+
+def variants_root():
+    return derivative_root() / 'variants'
+
+
+def source_key(image):
+    """Identify a static path or a CloudinaryField value."""
+    if isinstance(image, str):
+        return f"static:{image}"
+    public_id = getattr(image, 'public_id', None) or str(image)
+    return f"cloudinary:{public_id}"
+
+
+def _index_file(key):
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return derivative_root() / 'index' / digest[:2] / f"{digest}.json"
+
+
+def variant_name(digest, width, extension):
+    return f"{digest[:2]}/{digest}-{width}.{extension}"
+
+
+def variant_url(digest, width, extension):
+    return settings.DERIVATIVE_URL + variant_name(digest, width, extension)
+
+
+def lookup(key):
+    """Return the index entry for `key`, or ``None`` if not built yet.
+
+    Entries are cached per process; a missing one is re-checked after
+    `MISSING_TTL` seconds so newly built derivatives are picked up.
+    """
+    now = time.monotonic()
+    with _lock:
+        cached = _entries.get(key)
+    if cached is not None and (cached[0] is not None or now < cached[1]):
+        return cached[0]
+    try:
+        with open(_index_file(key)) as fh:
+            entry = json.load(fh)
+    except (OSError, ValueError):
+        entry = None
+    with _lock:
+        _entries[key] = (entry, now + MISSING_TTL)
+    return entry
+
+
+def clear_lookup_cache():
+    with _lock:
+        _entries.clear()
+
+
+def build(key, data):
+    """Generate the derivatives of `data` (the source bytes) for `key`.
+
+    Variants that already exist for the same content are reused.
+    Returns the index entry.
+    """
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+    width, height = image.size
+    # Every bucket narrower than the source, plus the source width itself
+    # when it is within the largest bucket
+    widths = [w for w in WIDTHS if w < width]
+    if width <= WIDTHS[-1]:
+        widths.append(width)
+
+    for target in widths:
+        resized = image
+        if target != width:
+            resized = image.resize(
+                (target, max(1, round(height * target / width))),
+                Image.LANCZOS,
+            )
+        for extension, _, options in FORMATS:
+            path = variants_root() / variant_name(digest, target, extension)
+            if not path.exists():
+                _write(path, lambda fh: resized.save(
+                    fh, format=extension.upper(), **options
+                ))
+
+    entry = {
+        'hash': digest, 'width': width, 'height': height, 'widths': widths,
+    }
+    _write(_index_file(key), lambda fh: fh.write(json.dumps(entry).encode()))
+    with _lock:
+        _entries[key] = (entry, 0)
+    return entry
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def _write(path, writer):
+    # Written to a temporary name first: a concurrent reader never sees
+    # a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            writer(fh)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def build_static(path, force=False):
+    """Build derivatives for a static file path; returns the entry."""
+    key = source_key(path)
+    found = finders.find(path) or os.path.join(settings.STATIC_ROOT, path)
+    with open(found, 'rb') as fh:
+        data = fh.read()
+    entry = lookup(key)
+    if (not force and entry is not None
+            and entry['hash'] == hashlib.sha256(data).hexdigest()[:32]):
+        return entry
+    return build(key, data)
+
+
+def build_cloudinary(image, data=None, force=False):
+    """Build derivatives for a CloudinaryField value.
+
+    `data` avoids a download when the bytes are at hand (e.g. a staged
+    upload); otherwise the original is fetched from Cloudinary.
+    """
+    key = source_key(image)
+    if not force and data is None and lookup(key) is not None:
+        return lookup(key)
+    return build(key, fetch(image) if data is None else data)
+
+
+def fetch(image):
+    """Download the original of a CloudinaryField value."""
+    with urllib.request.urlopen(image.url, timeout=FETCH_TIMEOUT) as r:
+        return r.read()
+
+
+def static_image_paths():
+    """Every image under ``images/`` the staticfiles finders know."""
+    paths = set()
+    for finder in finders.get_finders():
+        for path, _ in finder.list([]):
+            path = path.replace(os.sep, '/')
+            if (path.startswith('images/')
+                    and path.lower().endswith(STATIC_IMAGE_SUFFIXES)):
+                paths.add(path)
+    return sorted(paths)
+
+
+class DerivativeFilesMiddleware:
+    """Serve generated variants under ``DERIVATIVE_URL``.
+
+    File names are content hashes, so they are cached as immutable.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.files = WhiteNoise(
+            None,
+            root=variants_root(),
+            prefix=settings.DERIVATIVE_URL,
+            autorefresh=True,
+            max_age=WhiteNoise.FOREVER,
+            immutable_file_test=lambda path, url: True,
+        )
+
+    def __call__(self, request):
+        if (request.method in ('GET', 'HEAD')
+                and request.path_info.startswith(settings.DERIVATIVE_URL)):
+            found = self.files.find_file(request.path_info)
+            if found is not None:
+                return WhiteNoiseMiddleware.serve(found, request)
+        return self.get_response(request)
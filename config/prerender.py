@@ -0,0 +1,289 @@
+"""Static pre-rendering of the public catalogue pages.
+
+The home, collection, about and events pages and every published
+painting's detail page are rendered as an anonymous visitor would see
+them and written to ``PRERENDER_ROOT/pages/<path>/index.html``.
+`PrerenderedPageMiddleware` serves those files through WhiteNoise to
+visitors without a session, so their requests never reach a view or the
+ORM.
+
+Pages are kept fresh two ways:
+
+* Model signals call `schedule()` with the paths a change affects. Once
+  the transaction commits their files are removed, which is cheap, so
+  visitors fall through to the live view; nothing is rendered inside
+  the request (or webhook) that made the change.
+* ``manage.py prerender_pages``, run every few minutes (e.g. from cron),
+  compares each page's version (the same cheap lookup its conditional
+  GET validators use, see config.conditional) with the one it was last
+  rendered at and re-renders only the pages that differ or are missing.
+
+Pages that change with the date alone (`daily_paths`, e.g. the events
+page, which drops past events) are not served once the day they were
+rendered on is over, until the command renders them again.
+
+Rendering is opt-in via ``PRERENDER_PAGES``. The files live on the local
+filesystem, so on hosts with an ephemeral disk run the command when a
+worker boots.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import transaction
+from django.http import Http404, HttpRequest
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+logger = logging.getLogger(__name__)
+
+PAGES_DIRNAME = 'pages'
+MANIFEST_NAME = 'manifest.json'
+
+_pending = threading.local()
+
+
+def pages_root():
+    return Path(settings.PRERENDER_ROOT) / PAGES_DIRNAME
+
+
+def page_file(path):
+    return pages_root() / path.lstrip('/') / 'index.html'
+
+
+def public_paths():
+    """Every pre-rendered URL path."""
+    from gallery.models import Painting
+
+    paths = [
+        reverse('index'),
+        reverse('gallery:collection'),
+        reverse('about:about'),
+        reverse('events:events'),
+    ]
+    paths.extend(
+        painting_path(slug) for slug in Painting.objects.filter(
+            is_published=True
+        ).values_list('slug', flat=True)
+    )
+    return paths
+
+
+def daily_paths():
+    """Pre-rendered URL paths whose content changes with the date."""
+    return {reverse('events:events')}
+
+
+def painting_path(slug):
+    return reverse('gallery:painting_detail', args=[slug])
+
+
+def _anonymous_request(path):
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = path
+    request.META = {'SERVER_NAME': 'localhost', 'SERVER_PORT': '80'}
+    request.user = AnonymousUser()
+    return request
+
+
+def page_version(path):
+    """Digest of the page's version, or ``None`` if it has none (such
+    pages are re-rendered on every run)."""
+    match = resolve(path)
+    version_func = getattr(match.func, 'page_version', None)
+    if version_func is None:
+        return None
+    version = version_func(
+        _anonymous_request(path), *match.args, **match.kwargs
+    )
+    if version is None:
+        return None
+    return hashlib.md5(
+        repr((settings.RELEASE_VERSION, version[1])).encode(),
+        usedforsecurity=False,
+    ).hexdigest()
+
+
+def render_page(path):
+    """Render `path` anonymously and write it out; returns the status.
+
+    A page that no longer renders with a 200 (e.g. an unpublished or
+    renamed painting) has its file removed so requests fall through to
+    the live view.
+    """
+    target = page_file(path)
+    try:
+        match = resolve(path)
+        response = match.func(
+            _anonymous_request(path), *match.args, **match.kwargs
+        )
+        if hasattr(response, 'render'):
+            response.render()
+        status = response.status_code
+    except Http404:
+        status = 404
+    except Exception:
+        logger.exception("Pre-rendering %s failed", path)
+        status = 500
+
+    if status == 200:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomic(target, response.content)
+    else:
+        target.unlink(missing_ok=True)
+    return status
+
+
+def prerender(paths=None, force=False):
+    """Re-render `paths` (default: every public page) whose version moved.
+
+    Returns the list of paths rendered. With `force`, versions are
+    ignored and every page is rendered.
+    """
+    manifest = _read_manifest()
+    if paths is None:
+        paths = public_paths()
+        # Drop pages that are no longer public
+        for stale in set(manifest) - set(paths):
+            page_file(stale).unlink(missing_ok=True)
+            del manifest[stale]
+
+    rendered = []
+    for path in paths:
+        try:
+            version = page_version(path)
+        except Resolver404:
+            version = None
+        if (
+            not force and version is not None
+            and manifest.get(path) == version and not _outdated(path)
+            and page_file(path).exists()
+        ):
+            continue
+        if render_page(path) == 200 and version is not None:
+            manifest[path] = version
+        else:
+            manifest.pop(path, None)
+        rendered.append(path)
+
+    _write_manifest(manifest)
+    return rendered
+
+
+def schedule(*paths):
+    """Take `paths` out of service after the current transaction commits.
+
+    ``manage.py prerender_pages`` renders them again. Paths scheduled
+    within one transaction are handled together, once: the first callback
+    to run takes every pending path and the rest find nothing left to do.
+    """
+    if not settings.PRERENDER_PAGES:
+        return
+    if not hasattr(_pending, 'paths'):
+        _pending.paths = set()
+    _pending.paths.update(paths)
+    transaction.on_commit(_flush)
+
+
+def discard(*paths):
+    """Remove the files of `paths` (pages that changed or are no longer
+    public); visitors fall through to the live view."""
+    if not settings.PRERENDER_PAGES:
+        return
+    for path in paths:
+        page_file(path).unlink(missing_ok=True)
+
+
+def _flush():
+    paths, _pending.paths = getattr(_pending, 'paths', set()), set()
+    discard(*paths)
+
+
+def _read_manifest():
+    try:
+        with open(Path(settings.PRERENDER_ROOT) / MANIFEST_NAME) as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_manifest(manifest):
+    # Concurrent writers may drop each other's entries; the only cost is
+    # that those pages are re-rendered on the next run.
+    root = Path(settings.PRERENDER_ROOT)
+    root.mkdir(parents=True, exist_ok=True)
+    _write_atomic(
+        root / MANIFEST_NAME, json.dumps(manifest, sort_keys=True).encode()
+    )
+
+
+def _write_atomic(target, content):
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(content)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, target)
+
+
+class PrerenderedPageMiddleware:
+    """Serve pre-rendered pages to visitors without a session.
+
+    Only plain GET/HEAD requests qualify: no query string (filters and
+    cursors stay dynamic), no session cookie (signed-in users and guests
+    with a cart see personalised pages) and no pending flash messages.
+    Everyone else falls through to the live view, as do requests for a
+    daily page rendered on an earlier day.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PRERENDER_PAGES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # Autorefresh looks files up per request, so pages rewritten while
+        # the process runs are picked up. max_age=0 makes browsers
+        # revalidate against WhiteNoise's Last-Modified/ETag.
+        self.pages = WhiteNoise(
+            None,
+            root=pages_root(),
+            autorefresh=True,
+            max_age=0,
+            allow_all_origins=False,
+            index_file=True,
+        )
+
+    def __call__(self, request):
+        if (
+            request.method in ('GET', 'HEAD')
+            and not request.META.get('QUERY_STRING')
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and CookieStorage.cookie_name not in request.COOKIES
+        ):
+            page = self.pages.find_file(request.path_info)
+            if page is not None and not _outdated(request.path_info):
+                return WhiteNoiseMiddleware.serve(page, request)
+        return self.get_response(request)
+
+
+def _outdated(path):
+    """Whether `path` is a daily page rendered before today."""
+    if path not in daily_paths():
+        return False
+    try:
+        mtime = page_file(path).stat().st_mtime
+    except FileNotFoundError:
+        return True
+    rendered = datetime.fromtimestamp(mtime, tz=dt_timezone.utc)
+    return timezone.localdate(rendered) != timezone.localdate()
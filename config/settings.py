@@ -80,12 +80,16 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'csp.middleware.CSPMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'config.derivatives.DerivativeFilesMiddleware',
+    'config.prerender.PrerenderedPageMiddleware',
     'django.middleware.cache.CacheMiddleware',  # Add cache middleware
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'orders.cart_count.CartCountMiddleware',
     'django.middleware.common.CommonMiddleware',
     'orders.middleware.RequireJSONForOrdersCreate',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'orders.carts.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "allauth.account.middleware.AccountMiddleware",
@@ -118,13 +122,50 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Mixed into page ETags (config.conditional) so a deploy, which may change
+# templates, invalidates every browser's cached copy. Heroku sets this when
+# dyno metadata is enabled.
+RELEASE_VERSION = os.environ.get("HEROKU_RELEASE_VERSION", "")
+
+# Static pre-rendered public pages (config.prerender), served to visitors
+# without a session. Run `manage.py prerender_pages` after enabling, then
+# every few minutes: saves only remove the pages they change.
+PRERENDER_PAGES = os.environ.get("PRERENDER_PAGES", "False") == "True"
+PRERENDER_ROOT = BASE_DIR / 'prerendered'
+
+# Dashboard image uploads are staged here and pushed to storage by a
+# background thread pool (dashboard.uploads).
+UPLOAD_STAGING_ROOT = BASE_DIR / 'upload-staging'
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "2"))
+
+# Responsive image variants built with Pillow (config.derivatives) and
+# served by config.derivatives.DerivativeFilesMiddleware.
+DERIVATIVE_ROOT = BASE_DIR / 'derivatives'
+DERIVATIVE_URL = '/derivatives/'
+
 # Cache configuration
+# Pages with ETags (config.conditional) and the catalogue API opt out
 CACHE_MIDDLEWARE_SECONDS = 15778463  # Cache pages for 6 months
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+    },
+    # Rendered painting cards (gallery.fragments). Kept separate so the
+    # whole catalogue fits without LocMemCache's default 300-entry cull
+    # evicting cards or cached pages.
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'painting-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    # Painting view beacon throttling (gallery.popularity), kept apart so
+    # a burst of beacons cannot evict cached pages.
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'view-throttle',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
 }
 
 # For production with Redis (uncomment and install django-redis)
@@ -203,6 +244,9 @@ AUTHENTICATION_BACKENDS = [
 # Stripe settings
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.environ.get("STRIPE_PUBLISHABLE_KEY")
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
+# Where orders.stripe_client sends API calls, e.g. a local fake in tests
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE", "https://api.stripe.com")
 
 
 # Internationalization
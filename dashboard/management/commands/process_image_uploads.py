@@ -0,0 +1,26 @@
+"""Push staged dashboard image uploads to storage (see dashboard.uploads).
+
+Usage: python manage.py process_image_uploads [--retry-failed]
+
+Uploads are normally processed by the web process right after they are
+staged; this picks up any it did not finish, e.g. after a restart.
+"""
+
+from django.core.management.base import BaseCommand
+
+from dashboard.uploads import process_pending
+
+
+class Command(BaseCommand):
+    help = "Process pending (and optionally failed) artwork image uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help="Also retry uploads that failed before",
+        )
+
+    def handle(self, *args, **options):
+        done, failed = process_pending(retry_failed=options['retry_failed'])
+        style = self.style.WARNING if failed else self.style.SUCCESS
+        self.stdout.write(style(f"{done} uploaded, {failed} failed"))
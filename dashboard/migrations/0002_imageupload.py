@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-16 22:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_initial'),
+        ('gallery', '0010_relatedpainting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(choices=[('cover', 'Cover image'), ('image', 'Additional image')], max_length=10)),
+                ('staged_file', models.CharField(max_length=255)),
+                ('original_name', models.CharField(max_length=255)),
+                ('alt_text', models.CharField(blank=True, max_length=255)),
+                ('caption', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gallery.paintingimage')),
+                ('painting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_uploads', to='gallery.painting')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='dashboard_i_status_2e44ff_idx')],
+            },
+        ),
+    ]
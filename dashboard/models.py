@@ -54,5 +54,64 @@ class ActivityLog(models.Model):
         )
 
 
+class ImageUpload(models.Model):
+    """An artwork image staged on local disk until it is in storage.
+
+    Dashboard uploads are saved here and acknowledged at once; the
+    worker in dashboard.uploads pushes the file to the configured
+    storage and attaches it to the painting.
+    """
+
+    TARGET_CHOICES = [
+        ('cover', 'Cover image'),
+        ('image', 'Additional image'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    painting = models.ForeignKey(
+        'gallery.Painting',
+        on_delete=models.CASCADE,
+        related_name='image_uploads',
+    )
+    target = models.CharField(max_length=10, choices=TARGET_CHOICES)
+    # Relative to settings.UPLOAD_STAGING_ROOT
+    staged_file = models.CharField(max_length=255)
+    original_name = models.CharField(max_length=255)
+    alt_text = models.CharField(max_length=255, blank=True)
+    caption = models.CharField(max_length=255, blank=True)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default='pending'
+    )
+    error = models.TextField(blank=True)
+    # The PaintingImage created for an 'image' upload
+    image = models.ForeignKey(
+        'gallery.PaintingImage',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.get_target_display()} for {self.painting_id} "
+            f"({self.status})"
+        )
+
+
 # No models are defined here - this app provides views and templates
 # for managing models from other Django apps in the project.
@@ -0,0 +1,13 @@
+"""Clean up staged dashboard uploads (dashboard.uploads)."""
+
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import ImageUpload
+from .uploads import discard_staged_file
+
+
+@receiver(post_delete, sender=ImageUpload)
+def remove_staged_file(sender, instance, **kwargs):
+    # Deleting a painting also drops its unfinished uploads
+    discard_staged_file(instance)
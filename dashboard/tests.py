@@ -1,3 +1,160 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import cloudinary
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import storages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from config import derivatives
+from gallery.models import Painting
+from gallery.placeholders import get_image_info
+from .models import ImageUpload
+from .uploads import process_pending, process_upload
+
+
+TEST_STORAGES = {**getattr(settings, "STORAGES", {})}
+TEST_STORAGES["staticfiles"] = {
+    "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+}
+
+
+class BackgroundImageUploadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.staging = os.path.join(tmp, "staging")
+        storage_settings = {
+            **TEST_STORAGES,
+            "default": {
+                "BACKEND": "django.core.files.storage.FileSystemStorage",
+                "OPTIONS": {"location": os.path.join(tmp, "media")},
+            },
+        }
+        overrides = override_settings(
+            STORAGES=storage_settings,
+            UPLOAD_STAGING_ROOT=self.staging,
+            DERIVATIVE_ROOT=os.path.join(tmp, "derivatives"),
+            SECURE_SSL_REDIRECT=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        derivatives.clear_lookup_cache()
+        self.addCleanup(derivatives.clear_lookup_cache)
+        patcher = mock.patch.object(cloudinary.config(), "cloud_name", "test")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client.force_login(get_user_model().objects.create_user(
+            "staff", password="pw", is_staff=True
+        ))
+        self.painting = Painting.objects.create(
+            title="Dawn", slug="dawn", price=Decimal("10"),
+            date_created=timezone.now(),
+        )
+
+    def image(self, name="view.jpg"):
+        data = io.BytesIO()
+        Image.new("RGB", (400, 300), "teal").save(data, "JPEG")
+        return SimpleUploadedFile(name, data.getvalue(), "image/jpeg")
+
+    def add_image(self, **data):
+        return self.client.post(
+            reverse("dashboard:add_artwork_image", args=[self.painting.pk]),
+            {"image": self.image(), "alt_text": "Detail", **data},
+        )
+
+    def test_request_only_stages_the_image(self):
+        with mock.patch.object(storages["default"], "save") as save:
+            resp = self.add_image(caption="Close up")
+        self.assertEqual(resp.status_code, 302)
+        save.assert_not_called()
+        upload = ImageUpload.objects.get()
+        self.assertEqual(
+            (upload.status, upload.target, upload.caption),
+            ("pending", "image", "Close up"),
+        )
+        self.assertTrue(
+            os.path.exists(os.path.join(self.staging, upload.staged_file))
+        )
+        self.assertFalse(self.painting.images.exists())
+
+    def test_worker_attaches_additional_images_in_order(self):
+        self.add_image()
+        self.add_image(alt_text="Second")
+        first, second = ImageUpload.objects.all()
+        self.assertTrue(process_upload(first.pk))
+        self.assertTrue(process_upload(second.pk))
+        # Already claimed: not processed twice
+        self.assertFalse(process_upload(first.pk))
+
+        images = list(self.painting.images.all())
+        self.assertEqual([i.alt_text for i in images], ["Detail", "Second"])
+        self.assertEqual([i.display_order for i in images], [1, 2])
+        self.painting.refresh_from_db()
+        self.assertEqual(self.painting.primary_image_id, images[0].pk)
+        # Variants are built from the staged file, before it is removed
+        self.assertIsNotNone(derivatives.lookup(
+            derivatives.source_key(images[0].image)
+        ))
+        first.refresh_from_db()
+        self.assertEqual(first.status, "done")
+        self.assertEqual(first.image_id, images[0].pk)
+        self.assertEqual(os.listdir(self.staging), [])
+
+    def test_cover_image_is_attached_by_the_command(self):
+        resp = self.client.post(reverse("dashboard:upload_artwork"), {
+            "title": "Dusk", "description": "", "price": "20",
+            "status": "available",
+            "cover_image": self.image("cover.jpg"),
+        })
+        self.assertEqual(resp.status_code, 302)
+        painting = Painting.objects.get(slug="dusk")
+        self.assertFalse(painting.cover_image)
+
+        call_command("process_image_uploads", stdout=open(os.devnull, "w"))
+        painting.refresh_from_db()
+        self.assertTrue(painting.cover_image)
+        info = get_image_info(painting, painting.cover_image)
+        self.assertEqual((info["width"], info["height"]), (400, 300))
+        self.assertEqual(ImageUpload.objects.get().status, "done")
+
+    def test_failed_upload_is_reported_and_retried(self):
+        self.add_image()
+        upload = ImageUpload.objects.get()
+        with mock.patch.object(
+            storages["default"], "save", side_effect=OSError("timed out")
+        ):
+            self.assertFalse(process_upload(upload.pk))
+        resp = self.client.get(
+            reverse("dashboard:artwork_upload_status", args=[self.painting.pk])
+        )
+        self.assertEqual(
+            [(u["status"], u["error"]) for u in resp.json()["uploads"]],
+            [("failed", "timed out")],
+        )
+
+        self.assertEqual(process_pending(), (0, 0))
+        self.assertEqual(process_pending(retry_failed=True), (1, 0))
+        self.assertEqual(self.painting.images.count(), 1)
+        resp = self.client.get(
+            reverse("dashboard:artwork_upload_status", args=[self.painting.pk])
+        )
+        self.assertEqual(resp.json()["uploads"], [])
+
+    def test_deleting_the_painting_removes_staged_files(self):
+        self.add_image()
+        self.painting.delete()
+        self.assertEqual(os.listdir(self.staging), [])
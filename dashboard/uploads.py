@@ -0,0 +1,208 @@
+"""Background upload of dashboard artwork images.
+
+A request only stages the file on local disk and records an
+`ImageUpload`; once its transaction commits, the upload is handed to a
+small in-process thread pool that pushes the file to the configured
+storage (Cloudinary in production) and attaches it to the painting's
+cover or to a new `PaintingImage`. A slow upload therefore no longer
+holds a web worker.
+
+Uploads left behind by a restarted process, or failed ones, are picked
+up by ``manage.py process_image_uploads``.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from config import derivatives
+from gallery.models import Painting, PaintingImage
+from gallery.placeholders import (
+    image_info, record_image_info, set_image_info,
+)
+from .models import ImageUpload
+
+
+logger = logging.getLogger(__name__)
+
+# An upload still 'processing' after this long lost its worker
+STALE_AFTER = timedelta(minutes=15)
+
+_lock = threading.Lock()
+_executor = None
+
+
+def staging_root():
+    return Path(settings.UPLOAD_STAGING_ROOT)
+
+
+def stage_upload(painting, uploaded_file, target, **fields):
+    """Save `uploaded_file` to the staging area and queue its upload.
+
+    `fields` are extra `ImageUpload` values (alt text, caption).
+    """
+    suffix = Path(uploaded_file.name).suffix.lower()
+    staged_file = f"{uuid.uuid4().hex}{suffix}"
+    root = staging_root()
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / staged_file, 'wb') as fh:
+        for chunk in uploaded_file.chunks():
+            fh.write(chunk)
+
+    upload = ImageUpload.objects.create(
+        painting=painting,
+        target=target,
+        staged_file=staged_file,
+        original_name=os.path.basename(uploaded_file.name)[:255],
+        **fields,
+    )
+    transaction.on_commit(lambda: _submit(upload.pk))
+    return upload
+
+
+def _submit(upload_id):
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.UPLOAD_WORKERS,
+                thread_name_prefix='image-upload',
+            )
+    _executor.submit(_run, upload_id)
+
+
+def _run(upload_id):
+    try:
+        process_upload(upload_id)
+    except Exception:
+        logger.exception("Image upload %s crashed", upload_id)
+    finally:
+        close_old_connections()
+
+
+def process_upload(upload_id):
+    """Upload and attach one staged image; returns True if it did.
+
+    Claiming the upload is a conditional UPDATE, so a pool thread and
+    the management command never process the same upload twice.
+    """
+    claimed = ImageUpload.objects.filter(
+        pk=upload_id, status='pending'
+    ).update(status='processing', updated_at=timezone.now())
+    if not claimed:
+        return False
+    upload = ImageUpload.objects.select_related('painting').get(pk=upload_id)
+
+    try:
+        path = staging_root() / upload.staged_file
+        with open(path, 'rb') as fh:
+            name = storages['default'].save(
+                f"paintings/{upload.original_name}",
+                File(fh, name=upload.original_name),
+            )
+        image = PaintingImage._meta.get_field('image').to_python(name)
+        info = _prepare(image, path.read_bytes())
+        with transaction.atomic():
+            _attach(upload, name, image, info)
+            upload.status = 'done'
+            upload.error = ''
+            upload.save(update_fields=['status', 'error', 'image',
+                                       'updated_at'])
+    except Exception as e:
+        logger.warning("Image upload %s failed: %s", upload_id, e)
+        # The staged file is kept, so the upload can be retried
+        ImageUpload.objects.filter(pk=upload_id).update(
+            status='failed', error=str(e) or type(e).__name__,
+            updated_at=timezone.now(),
+        )
+        return False
+
+    path.unlink(missing_ok=True)
+    return True
+
+
+def _prepare(image, data):
+    """Build the image's variants and placeholder from the staged bytes.
+
+    Done before the image is attached, so pages show the local variants
+    and the placeholder straight away. Neither is essential: on failure
+    pages fall back to Cloudinary and no placeholder.
+    """
+    try:
+        derivatives.build_cloudinary(image, data=data)
+    except Exception:
+        logger.exception("Image derivatives for %s failed", image)
+    try:
+        return image_info(data)
+    except Exception:
+        logger.exception("Image placeholder for %s failed", image)
+        return None
+
+
+def _attach(upload, name, image, info):
+    painting = upload.painting
+    # Locks the painting, so concurrent uploads get distinct orders and
+    # do not overwrite each other's metadata
+    painting.metadata = Painting.objects.select_for_update().values_list(
+        'metadata', flat=True
+    ).get(pk=painting.pk)
+    if upload.target == 'cover':
+        painting.cover_image = name
+        if info:
+            set_image_info(painting, image, info)
+        # Saved (not updated) so the card and page caches follow along
+        painting.save(
+            update_fields=['cover_image', 'metadata', 'updated_at']
+        )
+        return
+
+    if info:
+        record_image_info(painting.pk, image, info)
+    max_order = painting.images.aggregate(
+        Max('display_order'))['display_order__max'] or 0
+    upload.image = PaintingImage.objects.create(
+        painting=painting,
+        image=name,
+        alt_text=upload.alt_text or painting.title,
+        caption=upload.caption,
+        display_order=max_order + 1,
+    )
+
+
+def process_pending(retry_failed=False):
+    """Process queued, stalled (and optionally failed) uploads.
+
+    Returns ``(done, failed)`` counts.
+    """
+    stale = timezone.now() - STALE_AFTER
+    ImageUpload.objects.filter(
+        status='processing', updated_at__lt=stale
+    ).update(status='pending')
+    if retry_failed:
+        ImageUpload.objects.filter(status='failed').update(status='pending')
+
+    done = failed = 0
+    pending = ImageUpload.objects.filter(status='pending')
+    for upload_id in pending.values_list('pk', flat=True):
+        if process_upload(upload_id):
+            done += 1
+        elif ImageUpload.objects.filter(
+            pk=upload_id, status='failed'
+        ).exists():
+            failed += 1
+    return done, failed
+
+
+def discard_staged_file(upload):
+    (staging_root() / upload.staged_file).unlink(missing_ok=True)
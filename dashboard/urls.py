@@ -13,6 +13,8 @@ urlpatterns = [
          views.delete_artwork, name='delete_artwork'),
     path('gallery/<int:artwork_id>/add-image/',
          views.add_artwork_image, name='add_artwork_image'),
+    path('gallery/<int:artwork_id>/uploads/',
+         views.artwork_upload_status, name='artwork_upload_status'),
     path('gallery/image/<int:image_id>/delete/',
          views.delete_artwork_image, name='delete_artwork_image'),
     path('events/', views.events_management, name='events_management'),
@@ -58,17 +58,19 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.http import JsonResponse
+from django.views.decorators.cache import never_cache
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 from django.db.models import Max
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 
 
 from gallery.models import Painting, Category, Artist, PaintingImage
 from events.models import Event
 from orders.models import Order
-from .models import ActivityLog
+from .models import ActivityLog, ImageUpload
+from .uploads import stage_upload
 from about.models import AboutData
 
 
@@ -225,18 +227,21 @@ def upload_artwork(request):
         slug = generate_unique_slug(title)
 
         try:
-            painting = Painting.objects.create(
-                title=title,
-                slug=slug,
-                description=description,
-                price=price,
-                status=status,
-                cover_image=cover_image,
-                date_created=timezone.now(),
-            )
+            with transaction.atomic():
+                painting = Painting.objects.create(
+                    title=title,
+                    slug=slug,
+                    description=description,
+                    price=price,
+                    status=status,
+                    date_created=timezone.now(),
+                )
+                if cover_image:
+                    stage_upload(painting, cover_image, 'cover')
             messages.success(
                 request,
                 f'Artwork "{painting.title}" uploaded successfully!'
+                + (' The image is being processed.' if cover_image else '')
             )
             # Log the activity
             log_activity(
@@ -265,6 +270,8 @@ def upload_artwork(request):
     return render(request, 'dashboard/upload_artwork.html', context)
 
 
+# Not page-cached: it shows the live upload processing state
+@never_cache
 @login_required
 @user_passes_test(is_staff_or_superuser)
 def edit_artwork(request, artwork_id):
@@ -302,11 +309,13 @@ def edit_artwork(request, artwork_id):
         if new_title != original_title:
             painting.slug = generate_unique_slug(new_title, painting.id)
 
-        if 'cover_image' in request.FILES:
-            painting.cover_image = request.FILES['cover_image']
-
         try:
-            painting.save()
+            with transaction.atomic():
+                painting.save()
+                if 'cover_image' in request.FILES:
+                    stage_upload(
+                        painting, request.FILES['cover_image'], 'cover'
+                    )
             # More specific success message based on what changed
             old_status = request.POST.get('old_status')
             if old_status and painting.status != old_status:
@@ -344,6 +353,7 @@ def edit_artwork(request, artwork_id):
     context = {
         'painting': painting,
         'additional_images': additional_images,
+        'image_uploads': painting.image_uploads.exclude(status='done'),
     }
 
     return render(request, 'dashboard/edit_artwork.html', context)
@@ -383,26 +393,43 @@ def add_artwork_image(request, artwork_id):
         alt_text = request.POST.get('alt_text', '')
         caption = request.POST.get('caption', '')
 
-        # Get the next display order
-        max_order = painting.images.aggregate(
-            Max('display_order'))['display_order__max'] or 0
-        display_order = max_order + 1
-
         try:
-            PaintingImage.objects.create(
-                painting=painting,
-                image=image_file,
-                alt_text=alt_text,
-                caption=caption,
-                display_order=display_order,
+            # The display order is assigned once the upload is attached
+            stage_upload(
+                painting, image_file, 'image',
+                alt_text=alt_text, caption=caption,
+            )
+            messages.success(
+                request, 'Image received, it will appear once processed.'
             )
-            messages.success(request, 'Additional image added successfully!')
         except Exception as e:
             messages.error(request, f'Error adding image: {str(e)}')
 
     return redirect('dashboard:edit_artwork', artwork_id=artwork_id)
 
 
+@never_cache
+@login_required
+@user_passes_test(is_staff_or_superuser)
+def artwork_upload_status(request, artwork_id):
+    """Processing state of an artwork's unfinished image uploads"""
+    uploads = ImageUpload.objects.filter(
+        painting_id=artwork_id
+    ).exclude(status='done')
+    return JsonResponse({
+        'uploads': [
+            {
+                'id': upload.id,
+                'target': upload.target,
+                'name': upload.original_name,
+                'status': upload.status,
+                'error': upload.error,
+            }
+            for upload in uploads
+        ],
+    })
+
+
 @login_required
 @user_passes_test(is_staff_or_superuser)
 @require_POST
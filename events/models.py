@@ -37,6 +37,9 @@ class Event(models.Model):
         blank=True,
         help_text="Optional: Upload an event poster."
     )
+
+    # Version for the events page's conditional GET validators
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.event_name} on {self.event_date}"
\ No newline at end of file
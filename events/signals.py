@@ -0,0 +1,14 @@
+"""Keep the pre-rendered events page (config.prerender) current."""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from config import prerender
+from .models import Event
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def prerender_events(sender, **kwargs):
+    prerender.schedule(reverse('events:events'))
@@ -1,7 +1,9 @@
 from datetime import date, timedelta
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.messages import get_messages
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, override_settings
@@ -293,3 +295,38 @@ class EventMutationViewTests(TestCase):
 		self.assertRedirects(resp, self.list_url)
 		self.assertFalse(Event.objects.filter(pk=self.event.pk).exists())
 
+
+TEST_STORAGES = {**getattr(settings, "STORAGES", {})}
+TEST_STORAGES["staticfiles"] = {
+	"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+}
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class EventListConditionalGetTests(TestCase):
+	def setUp(self):
+		self.url = reverse("events:events")
+		self.event = Event.objects.create(
+			event_name="Opening",
+			location="Hall",
+			event_date=timezone.localdate(),
+		)
+
+	def revalidate(self, etag):
+		return self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+	def test_unchanged_list_returns_304_after_one_query(self):
+		cache.clear()
+		etag = self.client.get(self.url)["ETag"]
+		with self.assertNumQueries(1):
+			resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 304)
+
+	def test_edit_changes_the_etag(self):
+		cache.clear()
+		etag = self.client.get(self.url)["ETag"]
+		self.event.location = "Garden"
+		self.event.save()
+		resp = self.revalidate(etag)
+		self.assertEqual(resp.status_code, 200)
+		self.assertContains(resp, "Garden")
@@ -1,16 +1,28 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 
+from config.conditional import conditional_page
 from .models import Event
 from .forms import EventForm
 
 
+from django.db.models import Count, Max
 from django.utils import timezone
 from django.core.paginator import Paginator
 
 # Create your views here.
 
 
+def _event_list_version(request):
+    """Latest edit and count of events, plus today's date (past events
+    drop off the list at midnight without any row changing)."""
+    events = Event.objects.aggregate(
+        latest=Max('updated_at'), count=Count('id')
+    )
+    return None, (events['latest'], events['count'], timezone.localdate())
+
+
+@conditional_page(_event_list_version)
 def event_list_view(request):
     """
     Displays a list of events with dates that are
@@ -1,6 +1,9 @@
 from django.contrib import admin
 from .models import StockItem
-from .models import Artist, Category, Painting, PaintingImage
+from .models import (
+    Artist, Category, Painting, PaintingImage, PaintingViewCount,
+    RelatedPainting,
+)
 
 
 @admin.register(StockItem)
@@ -15,3 +18,11 @@ admin.site.register(Artist)
 admin.site.register(Category)
 admin.site.register(Painting)
 admin.site.register(PaintingImage)
+admin.site.register(RelatedPainting)
+
+
+@admin.register(PaintingViewCount)
+class PaintingViewCountAdmin(admin.ModelAdmin):
+    list_display = ("painting", "views", "updated_at")
+    ordering = ("-views",)
+    readonly_fields = ("painting", "views", "updated_at")
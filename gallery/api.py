@@ -0,0 +1,150 @@
+"""Read-only JSON catalogue API.
+
+``GET api/paintings/`` pages through published paintings with the same
+keyset cursor and filters as the HTML grid (see gallery.pagination).
+``?fields=id,title,price`` limits the payload to those fields, and the
+query is narrowed to match: only the columns, joins and prefetches those
+fields need are fetched. ``?ids=1,2`` or ``?slugs=a,b`` fetch up to
+`MAX_BULK_FETCH` paintings in one query, in the order requested.
+Responses are never cached, so edits show on the next request.
+"""
+
+from django.db.models import Prefetch
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from rest_framework import status, views
+from rest_framework.response import Response
+
+from .models import Category
+from .pagination import InvalidCursor, paginate_paintings
+from .serializers import PaintingSerializer
+from .views import filtered_paintings
+
+
+MAX_BULK_FETCH = 100
+
+# API field -> (columns for only(), select_related, prefetch_related)
+FIELD_QUERY_PLAN = {
+    'url': (('slug',), (), ()),
+    'artist': (('artist__name',), ('artist',), ()),
+    'image': (
+        ('title', 'cover_image', 'primary_image__image',
+         'primary_image__alt_text'),
+        ('primary_image',),
+        (),
+    ),
+    'categories': (
+        (), (),
+        (Prefetch('categories', queryset=Category.objects.only('slug')),),
+    ),
+}
+# Always loaded: the keyset cursor and bulk lookups read these
+BASE_COLUMNS = ('id', 'slug', 'date_created')
+
+
+def parse_fields(value):
+    """Return the requested field names, or ``None`` for all of them.
+
+    Raises ``ValueError`` naming any unknown field.
+    """
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = set(fields) - set(PaintingSerializer.Meta.fields)
+    if unknown:
+        raise ValueError(', '.join(sorted(unknown)))
+    return fields
+
+
+def narrow_queryset(queryset, fields):
+    """Size `queryset` to what serializing `fields` reads."""
+    fields = fields or PaintingSerializer.Meta.fields
+    columns, joins, prefetches = set(BASE_COLUMNS), set(), []
+    for name in fields:
+        plan_columns, plan_joins, plan_prefetches = FIELD_QUERY_PLAN.get(
+            name, ((name,), (), ())
+        )
+        columns.update(plan_columns)
+        joins.update(plan_joins)
+        prefetches.extend(plan_prefetches)
+    return (
+        queryset.select_related(None).select_related(*joins)
+        .prefetch_related(*prefetches).only(*columns)
+    )
+
+
+@method_decorator(never_cache, name="dispatch")
+class PaintingListView(views.APIView):
+    """List published paintings, or fetch a batch by id or slug."""
+
+    def get(self, request):
+        try:
+            fields = parse_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return Response(
+                {"detail": f"Unknown fields: {e}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        paintings = narrow_queryset(filtered_paintings(request), fields)
+        ids = request.query_params.get('ids')
+        slugs = request.query_params.get('slugs')
+        if ids or slugs:
+            return self._bulk_fetch(paintings, fields, ids, slugs)
+
+        try:
+            page, next_cursor = paginate_paintings(
+                paintings, cursor=request.query_params.get('cursor')
+            )
+        except InvalidCursor:
+            return Response(
+                {"detail": "Invalid cursor"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        next_url = None
+        if next_cursor:
+            params = request.query_params.copy()
+            params['cursor'] = next_cursor
+            next_url = request.build_absolute_uri(
+                f"{request.path}?{params.urlencode()}"
+            )
+        return Response({
+            "next": next_url,
+            "results": PaintingSerializer(
+                page, many=True, fields=fields
+            ).data,
+        })
+
+    def _bulk_fetch(self, paintings, fields, ids, slugs):
+        if ids:
+            try:
+                keys = [int(pk) for pk in ids.split(',') if pk.strip()]
+            except ValueError:
+                return Response(
+                    {"detail": "ids must be a comma-separated list of "
+                               "integers"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            lookup = 'pk'
+        else:
+            keys = [slug.strip() for slug in slugs.split(',') if slug.strip()]
+            lookup = 'slug'
+
+        if len(keys) > MAX_BULK_FETCH:
+            return Response(
+                {"detail": f"At most {MAX_BULK_FETCH} paintings per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        found = {
+            getattr(painting, lookup): painting
+            for painting in paintings.filter(**{f"{lookup}__in": keys})
+        }
+        # Missing or unpublished keys are simply left out
+        results = [found[key] for key in dict.fromkeys(keys) if key in found]
+        return Response({
+            "results": PaintingSerializer(
+                results, many=True, fields=fields
+            ).data,
+        })
@@ -0,0 +1,94 @@
+"""Primary-artist resolution for new paintings.
+
+Paintings saved without an artist are credited to the primary artist.
+Its id is cached per process, so a dashboard upload or a bulk import
+does not pay a query per painting, inside a transaction or not.
+gallery.signals drops the cache whenever an artist is saved or deleted
+(and again once that transaction commits, so a concurrent reader cannot
+re-cache the old value). Until then, the transaction that wrote the
+artist neither reads nor fills the cache, as what it sees may yet be
+rolled back.
+"""
+
+import threading
+import time
+
+from django.db import transaction
+
+
+# Upper bound on staleness when another process changes the primary
+# artist, or when it is changed with a queryset update (no signals).
+PRIMARY_ARTIST_CACHE_SECONDS = 60
+
+_UNSET = object()
+_lock = threading.Lock()
+_cached = {'artist_id': _UNSET, 'expires': 0.0}
+
+
+def primary_artist_id():
+    """Return the primary artist's id, or ``None`` if there is none."""
+    uncommitted = _artist_written()
+    if not uncommitted:
+        with _lock:
+            artist_id, expires = _cached['artist_id'], _cached['expires']
+        if artist_id is not _UNSET and time.monotonic() < expires:
+            return artist_id
+
+    from .models import Artist
+
+    artist_id = (
+        Artist.objects.filter(is_primary=True)
+        .values_list('pk', flat=True).first()
+    )
+    if not uncommitted:
+        with _lock:
+            _cached['artist_id'] = artist_id
+            _cached['expires'] = (
+                time.monotonic() + PRIMARY_ARTIST_CACHE_SECONDS
+            )
+    return artist_id
+
+
+def _artist_written():
+    """Whether the current transaction has saved or deleted an artist.
+
+    Such a transaction has `_forget` pending on commit (see
+    `invalidate_primary_artist`); Django drops it again if the writing
+    transaction or savepoint is rolled back.
+    """
+    connection = transaction.get_connection()
+    return connection.in_atomic_block and any(
+        hook[1] is _forget for hook in connection.run_on_commit
+    )
+
+
+def invalidate_primary_artist():
+    with _lock:
+        _cached['artist_id'] = _UNSET
+    transaction.on_commit(_forget)
+
+
+def _forget():
+    with _lock:
+        _cached['artist_id'] = _UNSET
+
+
+def bulk_create_paintings(paintings, batch_size=500):
+    """`bulk_create` paintings, crediting the primary artist once.
+
+    `Painting.save` is skipped, so the primary artist is resolved once
+    for the whole batch and the search documents are refreshed in one
+    statement afterwards. Returns the created paintings.
+    """
+    from .models import Painting
+    from .search import update_search_document
+
+    artist_id = primary_artist_id()
+    for painting in paintings:
+        if painting.artist_id is None:
+            painting.artist_id = artist_id
+    created = Painting.objects.bulk_create(paintings, batch_size=batch_size)
+    update_search_document(
+        Painting.objects.filter(pk__in=[p.pk for p in created])
+    )
+    return created
@@ -0,0 +1,50 @@
+"""Category tree helpers built on `Category.path`.
+
+Every helper here costs a single query regardless of tree depth.
+"""
+
+from collections import defaultdict
+
+from django.db.models import Q, Subquery
+
+from .models import Category, Painting
+
+
+def in_category_tree(slug):
+    """`Q` matching paintings in the category `slug` or any descendant."""
+    root_path = Category.objects.filter(slug=slug).values('path')[:1]
+    links = Painting.categories.through.objects.filter(
+        category__path__startswith=Subquery(root_path)
+    )
+    return Q(pk__in=links.values('painting_id'))
+
+
+def category_tree():
+    """All categories in menu order: depth first, siblings by name."""
+    children = defaultdict(list)
+    for category in Category.objects.order_by('name'):
+        children[category.parent_id].append(category)
+
+    ordered = []
+    stack = list(reversed(children[None]))
+    while stack:
+        category = stack.pop()
+        ordered.append(category)
+        stack.extend(reversed(children[category.pk]))
+    return ordered
+
+
+def subtree_painting_counts(published_only=True):
+    """Map category id to the number of distinct paintings in its subtree."""
+    links = Painting.categories.through.objects.all()
+    if published_only:
+        links = links.filter(painting__is_published=True)
+
+    members = defaultdict(set)
+    for painting_id, path in links.values_list(
+        'painting_id', 'category__path'
+    ):
+        for ancestor in path.split('/'):
+            if ancestor:
+                members[int(ancestor)].add(painting_id)
+    return {pk: len(paintings) for pk, paintings in members.items()}
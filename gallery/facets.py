@@ -0,0 +1,129 @@
+"""Facet counts for the collection page filters.
+
+All per-painting facets (status, medium, decade, price band) come from a
+single grouped query over the published catalogue; category counts are
+rolled up over each category's subtree from one scan of the category
+links. The result is cached and dropped by gallery.signals whenever a
+painting, its categories or a category changes, so a page view normally
+costs no facet queries at all.
+"""
+
+from collections import Counter
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+from .categories import category_tree, subtree_painting_counts
+from .models import Painting
+
+
+FACETS_CACHE_KEY = 'gallery:facets'
+# Upper bound on staleness for caches that are not shared between
+# workers (e.g. LocMemCache), where another process's invalidation
+# cannot reach us.
+FACETS_CACHE_SECONDS = 60 * 10
+
+# (key, label, lower bound inclusive, upper bound exclusive or None)
+PRICE_BUCKETS = [
+    ('0-250', 'Under £250', Decimal('0'), Decimal('250')),
+    ('250-500', '£250 – £500', Decimal('250'), Decimal('500')),
+    ('500-1000', '£500 – £1,000', Decimal('500'), Decimal('1000')),
+    ('1000-2500', '£1,000 – £2,500', Decimal('1000'), Decimal('2500')),
+    ('2500-', '£2,500+', Decimal('2500'), None),
+]
+
+
+def price_bucket_filter(key):
+    """Return the price `Q` for a bucket key, or ``None`` if unknown."""
+    for bucket_key, _, lower, upper in PRICE_BUCKETS:
+        if bucket_key == key:
+            condition = Q(price__gte=lower)
+            if upper is not None:
+                condition &= Q(price__lt=upper)
+            return condition
+    return None
+
+
+def decade_filter(value):
+    """Return the year `Q` for a decade such as ``"1990"``, or ``None``."""
+    try:
+        decade = int(value)
+    except (TypeError, ValueError):
+        return None
+    return Q(year__gte=decade, year__lt=decade + 10)
+
+
+def get_facets():
+    """Return cached facet counts, computing them on a miss."""
+    facets = cache.get(FACETS_CACHE_KEY)
+    if facets is None:
+        facets = compute_facets()
+        cache.set(FACETS_CACHE_KEY, facets, FACETS_CACHE_SECONDS)
+    return facets
+
+
+def invalidate_facets():
+    cache.delete(FACETS_CACHE_KEY)
+
+
+def compute_facets():
+    """Compute every facet's counts over published paintings."""
+    price_bucket = Case(
+        *(
+            When(price_bucket_filter(key), then=Value(key))
+            for key, _, _, _ in PRICE_BUCKETS
+        ),
+        output_field=CharField(),
+    )
+    rows = (
+        Painting.objects.filter(is_published=True)
+        .annotate(price_bucket=price_bucket)
+        .values('status', 'medium', 'year', 'price_bucket')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+    statuses, mediums, decades, prices = (
+        Counter(), Counter(), Counter(), Counter()
+    )
+    for row in rows:
+        count = row['count']
+        statuses[row['status']] += count
+        if row['medium']:
+            mediums[row['medium']] += count
+        if row['year']:
+            decades[row['year'] // 10 * 10] += count
+        if row['price_bucket']:
+            prices[row['price_bucket']] += count
+
+    category_counts = subtree_painting_counts()
+
+    return {
+        'categories': [
+            {
+                'value': category.slug,
+                'label': f"{'— ' * category.depth}{category.name}",
+                'count': category_counts.get(category.pk, 0),
+            }
+            for category in category_tree()
+        ],
+        'statuses': [
+            {'value': value, 'label': label, 'count': statuses[value]}
+            for value, label in Painting.STATUS_CHOICES
+            if statuses[value]
+        ],
+        'mediums': [
+            {'value': medium, 'label': medium, 'count': count}
+            for medium, count in sorted(mediums.items())
+        ],
+        'decades': [
+            {'value': str(decade), 'label': f'{decade}s', 'count': count}
+            for decade, count in sorted(decades.items(), reverse=True)
+        ],
+        'prices': [
+            {'value': key, 'label': label, 'count': prices[key]}
+            for key, label, _, _ in PRICE_BUCKETS
+            if prices[key]
+        ],
+    }
@@ -0,0 +1,71 @@
+"""Cache of rendered painting card fragments.
+
+Each card is cached under a key built from the painting's id and its
+`updated_at` version, so an edit (or a change to a related image, category
+or artist, which bumps `updated_at`) simply makes the old entry unreachable.
+A page of cards is fetched with one `get_many` and only the misses are
+rendered and written back with one `set_many`.
+
+Whether a painting can still be bought also depends on checkout
+reservations, which leave the painting untouched, so the key also
+carries whether a checkout holds the painting (orders.availability): a
+card rendered while the painting was held is not served once it is
+released, and vice versa. Listings annotated with `with_held` carry
+this already; for other paintings it is read for the whole page at once.
+"""
+
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from orders.availability import sellable
+
+
+CARD_CACHE_ALIAS = 'fragments'
+CARD_TEMPLATE = 'gallery/_painting_card.html'
+# Bump when the card template changes so stale markup is not served.
+CARD_CACHE_PREFIX = 'painting-card:v4'
+CARD_CACHE_SECONDS = 60 * 60 * 24
+
+
+def card_cache_key(painting, held=False):
+    return (
+        f'{CARD_CACHE_PREFIX}:{painting.pk}:'
+        f'{painting.updated_at.timestamp()}:{int(held)}'
+    )
+
+
+def _held(paintings):
+    """Whether a checkout holds each painting, in order."""
+    unknown = [p.sku for p in paintings if not hasattr(p, 'held')]
+    availability = sellable(unknown) if unknown else {}
+    return [
+        painting.held > 0 if hasattr(painting, 'held') else (
+            painting.status == 'available'
+            and availability.get(painting.sku) == 0
+        )
+        for painting in paintings
+    ]
+
+
+def render_painting_cards(paintings):
+    """Return the rendered card HTML for each painting, in order."""
+    cache = caches[CARD_CACHE_ALIAS]
+    held = _held(paintings)
+    keys = [
+        card_cache_key(painting, is_held)
+        for painting, is_held in zip(paintings, held)
+    ]
+    cached = cache.get_many(keys)
+
+    missing = {}
+    for key, painting, is_held in zip(keys, paintings, held):
+        if key not in cached:
+            missing[key] = render_to_string(
+                CARD_TEMPLATE, {'painting': painting, 'held': is_held}
+            )
+    if missing:
+        cache.set_many(missing, CARD_CACHE_SECONDS)
+        cached.update(missing)
+
+    return [mark_safe(cached[key]) for key in keys]
@@ -0,0 +1,362 @@
+"""Bulk catalogue import from CSV or JSON Lines.
+
+Rows are processed in batches. Each batch's images are uploaded through
+a Django storage (Cloudinary in production, any local storage in tests)
+by a bounded thread pool. After that, its paintings, images and category
+links are written in a single transaction with `bulk_create`: a few
+statements per batch instead of several per row.
+
+An import can be resumed. A JSON state file next to the input records
+which rows are done and where each image was stored. Re-running the
+same import skips finished rows and never re-uploads an image. A row
+whose images failed to upload is left out of its batch and is retried
+on the next run. Each painting also records its import and row in its
+``metadata`` (`IMPORT_KEY`), written in the batch's transaction, so rows
+committed just before a crash, and not yet in the state file, are not
+imported twice. A row whose ``slug`` is already taken fails.
+
+Row fields are the `Painting` columns (``title`` and ``price`` are
+required), plus:
+
+* ``categories``: category slugs or names. In CSV, separate them with
+  ``|``. Unknown categories are created.
+* ``images``: image file paths, relative to the image root. In CSV,
+  separate them with ``|``. They become `PaintingImage` rows in order,
+  and the first one is the primary image. Their placeholders and sizes
+  (gallery.placeholders) are computed from the local files.
+"""
+
+import csv
+import json
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from .artists import bulk_create_paintings
+from .facets import invalidate_facets
+from .models import Category, Painting, PaintingImage
+from .placeholders import METADATA_KEY, image_info, image_key
+
+
+LIST_SEPARATOR = '|'
+TEXT_FIELDS = (
+    'description', 'medium', 'materials', 'dimensions', 'provenance',
+    'exhibition_history', 'meta_title', 'meta_description',
+)
+STATUSES = {value for value, _ in Painting.STATUS_CHOICES}
+IMAGE_FIELD = PaintingImage._meta.get_field('image')
+# Painting.metadata key holding ``{"id": <import id>, "row": <row key>}``
+IMPORT_KEY = 'import'
+
+
+class RowError(ValueError):
+    """A row that cannot be imported as given."""
+
+
+def read_rows(path, format=None):
+    """Yield ``(line_number, dict)`` for each row of a CSV/JSONL file.
+
+    The format defaults to JSON Lines for ``.jsonl`` files, else CSV.
+    """
+    format = format or ('jsonl' if Path(path).suffix == '.jsonl' else 'csv')
+    with open(path, newline='', encoding='utf-8') as fh:
+        if format == 'csv':
+            reader = csv.DictReader(fh)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for number, line in enumerate(fh, start=1):
+                if line.strip():
+                    yield number, json.loads(line)
+
+
+def _as_list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(LIST_SEPARATOR) if v.strip()]
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+def parse_row(row, now):
+    """Validate a raw row into Painting field values, categories and
+    image sources. Raises `RowError`."""
+    title = (row.get('title') or '').strip()
+    if not title:
+        raise RowError("title is required")
+    try:
+        price = Decimal(str(row.get('price', '')).strip())
+    except InvalidOperation:
+        raise RowError(f"invalid price {row.get('price')!r}")
+    if price < 0:
+        raise RowError("price must not be negative")
+
+    fields = {
+        'title': title,
+        'slug': slugify(row.get('slug') or '') or None,
+        'price': price,
+        'status': (row.get('status') or 'available').strip(),
+        'is_published': str(row.get('is_published', 'true')).strip().lower()
+        not in ('0', 'false', 'no'),
+        'date_created': now,
+    }
+    if fields['status'] not in STATUSES:
+        raise RowError(f"unknown status {fields['status']!r}")
+    if row.get('date_created'):
+        created = parse_datetime(str(row['date_created']))
+        if created is None:
+            raise RowError(f"invalid date_created {row['date_created']!r}")
+        if timezone.is_naive(created):
+            created = timezone.make_aware(created)
+        fields['date_created'] = created
+    if row.get('year'):
+        try:
+            fields['year'] = int(row['year'])
+        except (TypeError, ValueError):
+            raise RowError(f"invalid year {row['year']!r}")
+    for name in TEXT_FIELDS:
+        if row.get(name):
+            fields[name] = str(row[name]).strip()
+
+    return fields, _as_list(row.get('categories')), _as_list(row.get('images'))
+
+
+class PaintingImporter:
+    """Import rows into the catalogue; see the module docstring.
+
+    `report` is called with a progress dict after every batch.
+    """
+
+    def __init__(self, storage, image_root='.', state_path=None,
+                 batch_size=500, workers=8, report=None):
+        self.storage = storage
+        self.image_root = Path(image_root)
+        self.state_path = Path(state_path) if state_path else None
+        self.batch_size = batch_size
+        self.workers = workers
+        self.report = report or (lambda progress: None)
+        self.state = self._load_state()
+        self.stats = {
+            'rows': 0, 'created': 0, 'skipped': 0, 'failed': 0,
+            'uploaded': 0, 'errors': [],
+        }
+
+    def run(self, rows):
+        started = time.monotonic()
+        self._slugs = set(Painting.objects.values_list('slug', flat=True))
+        self.state['done'].update(self._imported_rows())
+        self._categories = {}
+        for category in Category.objects.only('id', 'slug', 'name'):
+            self._categories[category.slug] = category.pk
+            self._categories.setdefault(category.name.lower(), category.pk)
+
+        now = timezone.now()
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            self._pool = pool
+            for number, row in rows:
+                self.stats['rows'] += 1
+                key = str(number)
+                if key in self.state['done']:
+                    self.stats['skipped'] += 1
+                    continue
+                try:
+                    batch.append((key, *parse_row(row, now)))
+                except RowError as e:
+                    self._fail(key, str(e))
+                    continue
+                if len(batch) >= self.batch_size:
+                    self._import_batch(batch, started)
+                    batch = []
+            if batch:
+                self._import_batch(batch, started)
+
+        if self.stats['created']:
+            invalidate_facets()
+        return self.stats
+
+    def _fail(self, key, message):
+        self.stats['failed'] += 1
+        self.stats['errors'].append(f"row {key}: {message}")
+
+    def _imported_rows(self):
+        """Keys of the rows this import has committed, per the paintings
+        themselves (the state file may lag behind after a crash)."""
+        rows = Painting.objects.filter(
+            **{f'metadata__{IMPORT_KEY}__id': self.state['id']}
+        ).values_list(f'metadata__{IMPORT_KEY}__row', flat=True)
+        # Some backends hand numeric-looking strings back as numbers
+        return {str(row) for row in rows}
+
+    def _import_batch(self, batch, started):
+        pending = []
+        for row in batch:
+            if row[1]['slug'] in self._slugs:
+                self._fail(row[0], f"slug {row[1]['slug']!r} is taken")
+            else:
+                pending.append(row)
+        uploads = self._upload_images(
+            {source for *_, sources in pending for source in sources}
+        )
+
+        rows = []
+        for key, fields, categories, sources in pending:
+            failed = [s for s in sources if s not in uploads]
+            if failed:
+                self._fail(key, f"image upload failed: {', '.join(failed)}")
+                continue
+            base = fields['slug'] or fields['title']
+            fields['slug'] = self._unique_slug(base)
+            # Placeholders and sizes, as gallery.placeholders stores them
+            images = {
+                image_key(IMAGE_FIELD.to_python(uploads[source])):
+                    self.state['info'][source]
+                for source in sources if source in self.state['info']
+            }
+            fields['metadata'] = {
+                IMPORT_KEY: {'id': self.state['id'], 'row': key},
+            }
+            if images:
+                fields['metadata'][METADATA_KEY] = images
+            rows.append((key, fields, categories, sources))
+
+        with transaction.atomic():
+            paintings = bulk_create_paintings(
+                [Painting(**fields) for _, fields, _, _ in rows],
+                batch_size=self.batch_size,
+            )
+            self._create_images(paintings, rows, uploads)
+            self._link_categories(paintings, rows)
+
+        self.state['done'].update(key for key, *_ in rows)
+        self._save_state()
+        self.stats['created'] += len(paintings)
+        self.report({
+            **self.stats,
+            'elapsed': time.monotonic() - started,
+        })
+
+    def _upload_images(self, sources):
+        """Upload `sources` not stored yet; returns source -> stored name
+        for every source that is available."""
+        uploads = self.state['uploads']
+        pending = sorted(s for s in sources if s not in uploads)
+        for source, (name, info, error) in zip(
+            pending, self._pool.map(self._upload, pending)
+        ):
+            if error is None:
+                uploads[source] = name
+                if info:
+                    self.state['info'][source] = info
+                self.stats['uploaded'] += 1
+            else:
+                self.stats['errors'].append(f"image {source}: {error}")
+        # Recorded before the rows are written, so a crash below never
+        # costs a re-upload
+        self._save_state()
+        return {s: uploads[s] for s in sources if s in uploads}
+
+    def _upload(self, source):
+        """Runs on a pool thread; returns ``(stored_name, info, error)``,
+        `info` being the image's placeholder and size, if readable."""
+        path = self.image_root / source
+        try:
+            with open(path, 'rb') as fh:
+                name = self.storage.save(
+                    f"paintings/{path.name}", File(fh, name=path.name)
+                )
+        except Exception as e:
+            return None, None, str(e) or type(e).__name__
+        try:
+            info = image_info(path.read_bytes())
+        except Exception:
+            info = None
+        return name, info, None
+
+    def _unique_slug(self, value):
+        base = slugify(value)[:240] or 'painting'
+        slug, counter = base, 1
+        while slug in self._slugs:
+            slug = f"{base}-{counter}"
+            counter += 1
+        self._slugs.add(slug)
+        return slug
+
+    def _create_images(self, paintings, rows, uploads):
+        images = [
+            PaintingImage(
+                painting=painting,
+                image=uploads[source],
+                alt_text=painting.title,
+                display_order=order,
+            )
+            for painting, (_, _, _, sources) in zip(paintings, rows)
+            for order, source in enumerate(sources)
+        ]
+        images = PaintingImage.objects.bulk_create(
+            images, batch_size=self.batch_size
+        )
+        # bulk_create skips the signal that keeps primary_image current
+        primary = {}
+        for image in images:
+            primary.setdefault(image.painting_id, image.pk)
+        for painting in paintings:
+            painting.primary_image_id = primary.get(painting.pk)
+        Painting.objects.bulk_update(
+            [p for p in paintings if p.primary_image_id],
+            ['primary_image'], batch_size=self.batch_size,
+        )
+
+    def _link_categories(self, paintings, rows):
+        Link = Painting.categories.through
+        links = []
+        for painting, (_, _, categories, _) in zip(paintings, rows):
+            category_ids = {self._category_id(value) for value in categories}
+            links.extend(
+                Link(painting_id=painting.pk, category_id=category_id)
+                for category_id in category_ids
+            )
+        Link.objects.bulk_create(links, batch_size=self.batch_size)
+
+    def _category_id(self, value):
+        category_id = (
+            self._categories.get(slugify(value))
+            or self._categories.get(value.lower())
+        )
+        if category_id is None:
+            # Rare, so created one at a time to keep Category.save's
+            # materialized path logic
+            category = Category.objects.create(name=value, slug=slugify(value))
+            category_id = self._categories[category.slug] = category.pk
+            self._categories[value.lower()] = category.pk
+        return category_id
+
+    def _load_state(self):
+        if self.state_path and self.state_path.exists():
+            with open(self.state_path) as fh:
+                state = json.load(fh)
+            state['done'] = set(state['done'])
+            state.setdefault('info', {})
+            state.setdefault('id', uuid.uuid4().hex)
+            return state
+        return {
+            'id': uuid.uuid4().hex, 'done': set(), 'uploads': {}, 'info': {},
+        }
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.state_path.parent)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump({**self.state, 'done': sorted(self.state['done'])}, fh)
+        os.replace(tmp, self.state_path)
@@ -0,0 +1,36 @@
+"""Shared helpers for the gallery benchmark commands."""
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from gallery.models import Painting
+
+
+def build_paintings(count):
+    """Return `count` unsaved paintings, as the grid and the API see them.
+
+    They are built in memory only, so a benchmark needs no fixture data
+    and measures rendering, not the database.
+    """
+    now = timezone.now()
+    paintings = [
+        Painting(
+            pk=i,
+            title=f"Benchmark Painting {i}",
+            slug=f"benchmark-painting-{i}",
+            description="Oil on linen, layered glazes. " * 5,
+            price=Decimal('450.00'),
+            medium="Oil",
+            dimensions="40 x 50 cm",
+            year=2024,
+            date_created=now - timedelta(minutes=i),
+            updated_at=now,
+        )
+        for i in range(1, count + 1)
+    ]
+    for painting in paintings:
+        # As annotated by orders.availability.with_held
+        painting.held = 0
+    return paintings
@@ -0,0 +1,50 @@
+"""Compare painting grid render time with a cold and a warm card cache.
+
+Usage: python manage.py benchmark_card_cache [--cards 1000] [--repeat 5]
+
+Paintings are built in memory only, so the benchmark needs no fixture
+data and measures template rendering and cache lookups, not the database.
+"""
+
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+
+from gallery.fragments import CARD_CACHE_ALIAS, card_cache_key
+from gallery.management.benchmarks import build_paintings
+
+
+class Command(BaseCommand):
+    help = "Benchmark grid rendering with a cold vs warm card fragment cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        paintings = build_paintings(options['cards'])
+        keys = [card_cache_key(painting) for painting in paintings]
+        context = {'paintings': paintings}
+        cache = caches[CARD_CACHE_ALIAS]
+
+        cold, warm = [], []
+        for _ in range(options['repeat']):
+            cache.delete_many(keys)
+            cold.append(self._time_render(context))
+            warm.append(self._time_render(context))
+        cache.delete_many(keys)
+
+        best_cold, best_warm = min(cold), min(warm)
+        self.stdout.write(
+            f"{len(paintings)} cards, best of {options['repeat']}:\n"
+            f"  cold cache: {best_cold * 1000:8.1f} ms\n"
+            f"  warm cache: {best_warm * 1000:8.1f} ms\n"
+            f"  speedup:    {best_cold / best_warm:8.1f}x"
+        )
+
+    def _time_render(self, context):
+        start = time.perf_counter()
+        render_to_string('gallery/_paintings_grid.html', context)
+        return time.perf_counter() - start
@@ -0,0 +1,76 @@
+"""Compare one page of the HTML grid with the JSON catalogue API.
+
+Usage: python manage.py benchmark_catalogue_api [--cards 12] [--repeat 50]
+
+Like benchmark_card_cache, paintings are built in memory, so this
+measures rendering/serialization cost and payload size, not the
+database. The HTML grid is rendered with a cold card cache (its worst
+case); categories are left out of the JSON as they need a query.
+"""
+
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from rest_framework.renderers import JSONRenderer
+
+from gallery.fragments import CARD_CACHE_ALIAS, card_cache_key
+from gallery.management.benchmarks import build_paintings
+from gallery.pagination import PAINTINGS_PER_PAGE
+from gallery.serializers import PaintingSerializer
+
+
+FULL_FIELDS = [
+    name for name in PaintingSerializer.Meta.fields if name != 'categories'
+]
+SPARSE_FIELDS = ['id', 'title', 'url', 'price', 'image']
+
+
+class Command(BaseCommand):
+    help = "Benchmark the HTML painting grid against the JSON API"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=PAINTINGS_PER_PAGE)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        paintings = build_paintings(options['cards'])
+        keys = [card_cache_key(painting) for painting in paintings]
+        cache = caches[CARD_CACHE_ALIAS]
+
+        def html():
+            cache.delete_many(keys)
+            return render_to_string(
+                'gallery/_paintings_grid.html', {'paintings': paintings}
+            ).encode()
+
+        def api(fields):
+            data = PaintingSerializer(
+                paintings, many=True, fields=fields
+            ).data
+            return JSONRenderer().render({'next': None, 'results': data})
+
+        rows = [
+            ("HTML grid", html),
+            ("JSON, all fields", lambda: api(FULL_FIELDS)),
+            ("JSON, ?fields=" + ",".join(SPARSE_FIELDS),
+             lambda: api(SPARSE_FIELDS)),
+        ]
+        self.stdout.write(
+            f"{len(paintings)} paintings, best of {options['repeat']}:"
+        )
+        for label, produce in rows:
+            body, best = self._time(produce, options['repeat'])
+            self.stdout.write(
+                f"  {label:<40} {best * 1000:7.2f} ms  {len(body):7d} bytes"
+            )
+        cache.delete_many(keys)
+
+    def _time(self, produce, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body = produce()
+            timings.append(time.perf_counter() - start)
+        return body, min(timings)
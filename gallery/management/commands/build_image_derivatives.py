@@ -0,0 +1,104 @@
+"""Build responsive image variants (see config.derivatives) and the
+placeholders of painting images (see gallery.placeholders).
+
+Usage: python manage.py build_image_derivatives [--static | --paintings]
+           [--force]
+
+Static images are rebuilt only when their content changed; painting
+images only when they have no variants or placeholder yet (their
+originals are fetched from Cloudinary). Dashboard uploads and imports
+get theirs when processed, so this is for static images after a deploy
+and for older painting images.
+Pages cached before a build keep their Cloudinary URLs until re-rendered.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from config import derivatives
+from gallery.models import Painting, PaintingImage
+from gallery.placeholders import (
+    METADATA_KEY, image_info, image_key, record_image_info,
+)
+
+
+class Command(BaseCommand):
+    help = "Generate AVIF/WebP width variants of static and painting images"
+
+    def add_arguments(self, parser):
+        only = parser.add_mutually_exclusive_group()
+        only.add_argument('--static', action='store_true',
+                          help="Only static images")
+        only.add_argument('--paintings', action='store_true',
+                          help="Only painting images")
+        parser.add_argument('--force', action='store_true',
+                            help="Rebuild even up-to-date variants")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        force = options['force']
+        built = failed = 0
+
+        sources = []
+        if not options['paintings']:
+            sources.extend(
+                (path, lambda path=path: derivatives.build_static(
+                    path, force=force
+                ))
+                for path in derivatives.static_image_paths()
+            )
+        if not options['static']:
+            images = [
+                (painting.pk, painting.cover_image, painting.metadata)
+                for painting in Painting.objects.exclude(
+                    cover_image__isnull=True
+                ).exclude(cover_image='').only('cover_image', 'metadata')
+            ]
+            images.extend(
+                PaintingImage.objects.values_list(
+                    'painting_id', 'image', 'painting__metadata'
+                )
+            )
+            sources.extend(
+                (str(image), lambda args=(pk, image, metadata): (
+                    self._build_painting_image(*args, force=force)
+                ))
+                for pk, image, metadata in images
+            )
+
+        for label, build in sources:
+            try:
+                entry = build()
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"  {label}: {e}")
+                continue
+            built += 1
+            self.stdout.write(
+                f"  {label}: {entry['width']}x{entry['height']}, "
+                f"widths {', '.join(map(str, entry['widths']))}"
+            )
+
+        style = self.style.WARNING if failed else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{built} images ready, {failed} failed in "
+            f"{time.perf_counter() - start:.1f} s"
+        ))
+
+    def _build_painting_image(self, painting_id, image, metadata, force):
+        """Variants and placeholder (gallery.placeholders) of one image,
+        downloading the original only if either is missing."""
+        key = derivatives.source_key(image)
+        has_info = (metadata or {}).get(METADATA_KEY, {}).get(
+            image_key(image)
+        ) is not None
+        entry = derivatives.lookup(key)
+        if entry is not None and has_info and not force:
+            return entry
+        data = derivatives.fetch(image)
+        if entry is None or force:
+            entry = derivatives.build(key, data)
+        if not has_info or force:
+            record_image_info(painting_id, image, image_info(data))
+        return entry
@@ -0,0 +1,87 @@
+"""Import paintings from a CSV or JSON Lines file (see gallery.importer).
+
+Usage: python manage.py import_paintings FILE [--images DIR]
+           [--format csv|jsonl] [--batch-size 500] [--workers 8]
+           [--storage default] [--state FILE]
+
+Re-run the same command to resume an interrupted or partly failed
+import. Afterwards, run refresh_related_paintings (and prerender_pages,
+if enabled) to bring the derived data up to date.
+"""
+
+import os
+
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand, CommandError
+
+from gallery.importer import PaintingImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk import paintings, their images and categories"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--images', default=None,
+            help="Directory image paths are relative to "
+                 "(default: the input file's directory)",
+        )
+        parser.add_argument('--format', choices=('csv', 'jsonl'))
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help="Concurrent image uploads",
+        )
+        parser.add_argument(
+            '--storage', default='default',
+            help="STORAGES alias images are uploaded to",
+        )
+        parser.add_argument(
+            '--state', default=None,
+            help="Resume state file (default: <path>.import-state.json)",
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            storage = storages[options['storage']]
+        except Exception as e:
+            raise CommandError(f"Unknown storage: {e}")
+
+        importer = PaintingImporter(
+            storage,
+            image_root=(
+                options['images']
+                or os.path.dirname(os.path.abspath(path))
+            ),
+            state_path=options['state'] or f"{path}.import-state.json",
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            report=self._report,
+        )
+        try:
+            stats = importer.run(read_rows(path, options['format']))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Import stopped: {e}. Re-run to resume.")
+
+        for error in stats['errors']:
+            self.stderr.write(f"  {error}")
+        style = self.style.WARNING if stats['failed'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{stats['created']} created, {stats['skipped']} already "
+            f"imported, {stats['failed']} failed of {stats['rows']} rows; "
+            f"{stats['uploaded']} images uploaded"
+        ))
+        if stats['failed']:
+            self.stdout.write("Fix the failed rows and re-run to resume.")
+
+    def _report(self, progress):
+        elapsed = progress['elapsed']
+        rate = progress['created'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"  {progress['rows']} rows read, {progress['created']} created, "
+            f"{progress['uploaded']} images uploaded, {progress['failed']} "
+            f"failed ({rate:.0f} paintings/s)"
+        )
+
@@ -0,0 +1,41 @@
+"""Pre-render the public pages to static HTML (see config.prerender).
+
+Usage: python manage.py prerender_pages [--force] [path ...]
+
+Without paths every public page is considered, and only those whose
+version changed since they were last rendered, or that a change took out
+of service, are rebuilt. Run it every few minutes (e.g. from cron):
+saves only remove the pages they affect.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from config.prerender import prerender
+
+
+class Command(BaseCommand):
+    help = "Pre-render public pages whose content changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help="URL paths to consider (default: every public page)",
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Re-render even pages whose version is unchanged",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rendered = prerender(
+            options['paths'] or None, force=options['force']
+        )
+        for path in rendered:
+            self.stdout.write(f"  {path}", self.style.HTTP_INFO)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {len(rendered)} pages in "
+            f"{(time.perf_counter() - start) * 1000:.0f} ms"
+        ))
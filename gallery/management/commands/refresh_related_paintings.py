@@ -0,0 +1,45 @@
+"""Recompute the precomputed "you may also like" neighbours.
+
+Usage: python manage.py refresh_related_paintings [--all] [--top-k 6]
+
+By default only paintings changed since their neighbours were computed
+(and the lists those changes can affect) are re-scored, so the command is
+cheap enough to run from cron every few minutes.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from gallery.recommendations import (
+    TOP_K,
+    refresh_related_paintings,
+    stale_painting_ids,
+)
+
+
+class Command(BaseCommand):
+    help = "Refresh precomputed related paintings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Re-score every published painting",
+        )
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['all']:
+            changed = None
+        else:
+            changed = stale_painting_ids()
+            if not changed:
+                self.stdout.write("Related paintings are up to date.")
+                return
+
+        refreshed = refresh_related_paintings(changed, top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-scored {refreshed} paintings in "
+            f"{(time.perf_counter() - start) * 1000:.0f} ms"
+        ))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-16 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0004_alter_stockitem_is_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='painting',
+            index=models.Index(fields=['is_published', '-date_created', '-id'], name='gallery_pai_is_publ_84203a_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-16 22:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_primary_image(apps, schema_editor):
+    Painting = apps.get_model('gallery', 'Painting')
+    PaintingImage = apps.get_model('gallery', 'PaintingImage')
+    first_by_painting = {}
+    for painting_id, image_id in (
+        PaintingImage.objects.order_by('-display_order', '-id')
+        .values_list('painting_id', 'id')
+    ):
+        # Iterating in reverse order leaves the lowest display_order last
+        first_by_painting[painting_id] = image_id
+    for painting_id, image_id in first_by_painting.items():
+        Painting.objects.filter(pk=painting_id).update(
+            primary_image_id=image_id
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0005_painting_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='painting',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gallery.paintingimage'),
+        ),
+        migrations.RunPython(
+            backfill_primary_image, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2 on 2026-10-16 22:35
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+# GIN index and backfill only apply on PostgreSQL; SQLite keeps the
+# column empty and searches with the icontains fallback.
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS gallery_painting_search_gin '
+        'ON gallery_painting USING gin (search_document)'
+    )
+    Painting = apps.get_model('gallery', 'Painting')
+    Painting.objects.update(
+        search_document=(
+            SearchVector('title', weight='A', config='english') +
+            SearchVector(
+                'medium', 'materials', weight='B', config='english'
+            ) +
+            SearchVector('description', weight='C', config='english') +
+            SearchVector(
+                'provenance', 'exhibition_history',
+                weight='D', config='english'
+            )
+        )
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS gallery_painting_search_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0006_painting_primary_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='painting',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model('gallery', 'Category')
+    parents = dict(Category.objects.values_list('pk', 'parent_id'))
+
+    def path_for(pk):
+        ids = []
+        while pk is not None and pk not in ids:
+            ids.append(pk)
+            pk = parents.get(pk)
+        return ''.join(f'{ancestor}/' for ancestor in reversed(ids))
+
+    for pk in parents:
+        path = path_for(pk)
+        Category.objects.filter(pk=pk).update(
+            path=path, depth=path.count('/') - 1
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0008_painting_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-16 22:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0009_category_materialized_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedPainting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('painting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='gallery.painting')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='gallery.painting')),
+            ],
+            options={
+                'ordering': ['painting', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('painting', 'rank'), name='unique_related_painting_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-16 23:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0010_relatedpainting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaintingViewCount',
+            fields=[
+                ('painting', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='view_count', serialize=False, to='gallery.painting')),
+                ('views', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-views'], name='paintingviews_views_idx')],
+            },
+        ),
+    ]
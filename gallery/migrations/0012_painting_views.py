@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-17 00:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_views(apps, schema_editor):
+    Painting = apps.get_model('gallery', 'Painting')
+    PaintingViewCount = apps.get_model('gallery', 'PaintingViewCount')
+    Painting.objects.filter(
+        pk__in=PaintingViewCount.objects.values('painting_id')
+    ).update(views=Subquery(
+        PaintingViewCount.objects.filter(
+            painting_id=OuterRef('pk')
+        ).values('views')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0011_paintingviewcount'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paintingviewcount',
+            name='paintingviews_views_idx',
+        ),
+        migrations.AddField(
+            model_name='painting',
+            name='views',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='painting',
+            index=models.Index(fields=['is_published', '-views', '-id'], name='gallery_pai_is_publ_1c8a63_idx'),
+        ),
+        migrations.RunPython(backfill_views, migrations.RunPython.noop),
+    ]
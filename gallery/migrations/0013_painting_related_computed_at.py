@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-17 00:07
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def backfill_related_computed_at(apps, schema_editor):
+    Painting = apps.get_model('gallery', 'Painting')
+    RelatedPainting = apps.get_model('gallery', 'RelatedPainting')
+    Painting.objects.filter(
+        pk__in=RelatedPainting.objects.values('painting_id')
+    ).update(related_computed_at=Subquery(
+        RelatedPainting.objects.filter(painting_id=OuterRef('pk'))
+        .values('painting_id')
+        .annotate(computed=Max('computed_at'))
+        .values('computed')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0012_painting_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='painting',
+            name='related_computed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(
+            backfill_related_computed_at, migrations.RunPython.noop
+        ),
+    ]
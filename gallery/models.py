@@ -1,10 +1,17 @@
-from django.db import models
-from django.db.models import Q
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
+from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 # from taggit.managers import TaggableManager  # pip install django-taggit
 from cloudinary.models import CloudinaryField
 
+from .artists import primary_artist_id
+from .search import SEARCH_FIELDS, update_search_document
+
 
 class StockItem(models.Model):
     """Simple stock/variant model used by orders to decrement inventory
@@ -89,6 +96,16 @@ class Category(models.Model):
         on_delete=models.CASCADE,
         related_name='children',
     )
+    # Materialized path of ancestor ids including our own, e.g. "3/7/12/".
+    # Descendants are the rows whose path starts with ours; maintained by
+    # save(), which rewrites the whole subtree in one UPDATE on a move.
+    path = models.CharField(
+        max_length=255,
+        blank=True,
+        editable=False,
+        db_index=True,
+    )
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)  # Optional timestamp
 
     class Meta:
@@ -101,6 +118,68 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('gallery:category_detail', kwargs={'slug': self.slug})
 
+    @property
+    def ancestor_ids(self):
+        """Ids from the root down to (and including) this category."""
+        return [int(pk) for pk in self.path.split('/') if pk]
+
+    def ancestors(self):
+        """This category and its ancestors, root first, in one query."""
+        by_id = Category.objects.in_bulk(self.ancestor_ids)
+        return [by_id[pk] for pk in self.ancestor_ids if pk in by_id]
+
+    def clean(self):
+        super().clean()
+        if self.pk and self.parent_id:
+            parent_path = self.parent.path
+            if f'/{self.pk}/' in f'/{parent_path}':
+                raise ValidationError(
+                    {'parent': 'A category cannot be moved under itself.'}
+                )
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # Read the stored paths rather than trusting this instance, which
+            # may predate a move of one of its ancestors.
+            stored = dict(
+                Category.objects.filter(
+                    pk__in=[pk for pk in (self.pk, self.parent_id) if pk]
+                ).values_list('pk', 'path')
+            )
+            old_path = stored.get(self.pk, '') if self.pk else ''
+            parent_path = stored.get(self.parent_id, '')
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError(
+                    f'Cannot move category {self.pk} under its own subtree.'
+                )
+
+            super().save(*args, **kwargs)
+
+            new_path = f'{parent_path}{self.pk}/'
+            if new_path != old_path:
+                self._move_subtree(old_path, new_path)
+
+    def _move_subtree(self, old_path, new_path):
+        new_depth = new_path.count('/') - 1
+        old_depth = old_path.count('/') - 1
+        Category.objects.filter(pk=self.pk).update(
+            path=new_path, depth=new_depth
+        )
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(
+                pk=self.pk
+            ).update(
+                path=Concat(
+                    Value(new_path), Substr('path', len(old_path) + 1)
+                ),
+                depth=F('depth') + (new_depth - old_depth),
+            )
+        self.path, self.depth = new_path, new_depth
+
+
+# Paintings are one-of-a-kind; cart and order lines refer to them by SKU
+PAINTING_SKU_PREFIX = 'painting-'
+
 
 class Painting(models.Model):
     STATUS_CHOICES = [
@@ -155,6 +234,36 @@ class Painting(models.Model):
     # Flexible extra attributes
     metadata = models.JSONField(blank=True, null=True)
 
+    # Bumped on every save and whenever a related image, category or artist
+    # changes (see gallery.signals); rendered card fragments are keyed on it.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Denormalized lowest-`display_order` PaintingImage, kept current by
+    # gallery.signals so listings can select_related it instead of running
+    # `images.first` once per card.
+    primary_image = models.ForeignKey(
+        'PaintingImage',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    # When gallery.recommendations last scored the painting's neighbours,
+    # kept here so a painting with none is not re-scored on every run.
+    related_computed_at = models.DateTimeField(
+        null=True, blank=True, editable=False
+    )
+
+    # Denormalized PaintingViewCount.views, copied by gallery.popularity
+    # so the "most viewed" grid can be read from an index.
+    views = models.PositiveBigIntegerField(default=0, editable=False)
+
+    # Weighted full-text document, maintained on save (see gallery.search).
+    # Only populated on PostgreSQL, where it is GIN indexed.
+    search_document = SearchVectorField(null=True, editable=False)
+
     # SEO
     meta_title = models.CharField(max_length=60, blank=True)
     meta_description = models.CharField(max_length=160, blank=True)
@@ -173,6 +282,9 @@ class Painting(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['is_published']),
             models.Index(fields=['-date_created']),
+            # Keyset pagination of the public grid (see gallery.pagination)
+            models.Index(fields=['is_published', '-date_created', '-id']),
+            models.Index(fields=['is_published', '-views', '-id']),
         ]
 
     def __str__(self):
@@ -181,15 +293,38 @@ class Painting(models.Model):
     def get_absolute_url(self):
         return reverse('gallery:painting_detail', kwargs={'slug': self.slug})
 
+    @property
+    def sku(self):
+        """The SKU of the painting on cart and order lines."""
+        return f'{PAINTING_SKU_PREFIX}{self.pk}'
+
+    def refresh_primary_image(self):
+        """Recompute `primary_image` from the current PaintingImage rows.
+
+        Also bumps `updated_at`, since any image change can alter the card.
+        """
+        first_id = (
+            PaintingImage.objects.filter(painting_id=self.pk)
+            .order_by('display_order', 'id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        Painting.objects.filter(pk=self.pk).update(
+            primary_image_id=first_id, updated_at=timezone.now()
+        )
+        self.primary_image_id = first_id
+
     def save(self, *args, **kwargs):
         # Auto-assign the primary artist if none provided
-        if self.artist is None:
-            try:
-                self.artist = Artist.objects.get(is_primary=True)
-            except Artist.DoesNotExist:
-                pass
+        if self.artist_id is None:
+            self.artist_id = primary_artist_id()
         super().save(*args, **kwargs)
 
+        # Keep the search document in step with the searchable fields
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & set(SEARCH_FIELDS):
+            update_search_document(Painting.objects.filter(pk=self.pk))
+
 
 class PaintingImage(models.Model):
     painting = models.ForeignKey(
@@ -219,3 +354,55 @@ class PaintingImage(models.Model):
 
     def __str__(self):
         return f"Image for {self.painting.title} ({self.display_order})"
+
+
+class RelatedPainting(models.Model):
+    """Precomputed "you may also like" neighbour of a painting.
+
+    Rows are written in bulk by gallery.recommendations; the detail page
+    reads a painting's neighbours with one indexed lookup.
+    """
+    painting = models.ForeignKey(
+        Painting,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+    )
+    related = models.ForeignKey(
+        Painting,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['painting', 'rank']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['painting', 'rank'],
+                name='unique_related_painting_rank'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.painting_id} -> {self.related_id} ({self.score:.2f})"
+
+
+class PaintingViewCount(models.Model):
+    """Detail page views of a painting.
+
+    Written only by gallery.popularity, which buffers views in memory and
+    adds them here in batches, copying the totals to `Painting.views`.
+    """
+    painting = models.OneToOneField(
+        Painting,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='view_count',
+    )
+    views = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.painting_id}: {self.views} views"
@@ -0,0 +1,85 @@
+"""Keyset (cursor) pagination for the public painting grid.
+
+Pages are addressed by an opaque cursor that encodes the sort key of the
+last painting already shown, so fetching page N is a single indexed range
+scan on ``(-date_created, -id)`` instead of an ``OFFSET`` that grows with N.
+
+The grid can also be sorted by popularity (``sort=popular``), keyed on
+``(-views, -id)``, the view count denormalized onto the painting (see
+gallery.popularity) so the same kind of index serves it. View counts
+move while a visitor scrolls, so a painting may then occasionally
+appear twice or be skipped.
+"""
+
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+PAINTINGS_PER_PAGE = 12
+
+# Sort name -> field pages are ordered on (descending); `id` always
+# follows to break ties, so the ordering is stable.
+SORTS = {
+    'newest': 'date_created',
+    'popular': 'views',
+}
+DEFAULT_SORT = 'newest'
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue."""
+
+
+def encode_cursor(painting, sort=DEFAULT_SORT):
+    """Return an opaque, URL-safe cursor pointing just after `painting`."""
+    field = SORTS[sort]
+    value = getattr(painting, field)
+    if field == 'date_created':
+        value = value.isoformat()
+    raw = json.dumps([value, painting.pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort=DEFAULT_SORT):
+    """Decode a cursor into its ``(sort value, id)`` key."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(padded))
+        if sort == 'popular':
+            value = int(value)
+        else:
+            value = parse_datetime(value)
+        pk = int(pk)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if value is None:
+        raise InvalidCursor(cursor)
+    return value, pk
+
+
+def paginate_paintings(queryset, cursor=None, page_size=PAINTINGS_PER_PAGE,
+                       sort=DEFAULT_SORT):
+    """Return ``(paintings, next_cursor)`` for one keyset page.
+
+    `next_cursor` is ``None`` when there are no further paintings. One
+    extra row is fetched to detect the end of the result set without a
+    separate ``COUNT`` query.
+    """
+    field = SORTS[sort]
+    queryset = queryset.order_by(f'-{field}', '-id')
+    if cursor:
+        value, pk = decode_cursor(cursor, sort)
+        queryset = queryset.filter(
+            Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk})
+        )
+
+    paintings = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(paintings) > page_size:
+        paintings = paintings[:page_size]
+        next_cursor = encode_cursor(paintings[-1], sort)
+    return paintings, next_cursor
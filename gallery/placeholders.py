@@ -0,0 +1,84 @@
+"""Low-quality image placeholders and intrinsic sizes.
+
+For each painting image (its cover and its `PaintingImage` rows) a tiny
+blurred WebP thumbnail, inlined as a data URI of a few hundred bytes,
+and the image's intrinsic width and height are computed once, when the
+image bytes are at hand. That happens when a dashboard upload is
+processed (dashboard.uploads), when a painting is imported
+(gallery.importer) and in ``manage.py build_image_derivatives`` for older
+images. The result is kept in ``Painting.metadata["images"]``, keyed by
+the image's public id, so grid templates can render the placeholder and
+size the image box without extra queries or downloads.
+"""
+
+import base64
+import io
+
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageFilter, ImageOps
+
+
+PLACEHOLDER_SIZE = 20
+METADATA_KEY = 'images'
+
+
+def image_info(data):
+    """Return ``{'width', 'height', 'placeholder'}`` for image bytes."""
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        width, height = image.size
+        image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        thumbnail = image.convert('RGB')
+    buffer = io.BytesIO()
+    thumbnail.filter(ImageFilter.GaussianBlur(1)).save(
+        buffer, format='WEBP', quality=40
+    )
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return {
+        'width': width,
+        'height': height,
+        'placeholder': f"data:image/webp;base64,{encoded}",
+    }
+
+
+def image_key(image):
+    """The metadata key of a CloudinaryField value or stored name."""
+    return getattr(image, 'public_id', None) or str(image)
+
+
+def get_image_info(painting, image):
+    """The stored info for `image` of `painting`, or ``None``."""
+    if not image:
+        return None
+    return (painting.metadata or {}).get(METADATA_KEY, {}).get(
+        image_key(image)
+    )
+
+
+def set_image_info(painting, image, info):
+    """Store `info` on the unsaved `painting` instance."""
+    metadata = dict(painting.metadata or {})
+    metadata[METADATA_KEY] = {
+        **metadata.get(METADATA_KEY, {}), image_key(image): info,
+    }
+    painting.metadata = metadata
+
+
+def record_image_info(painting_id, image, info):
+    """Store `info` on a saved painting.
+
+    A queryset update, so no signals run; `updated_at` is bumped so the
+    painting's cached card picks the placeholder up.
+    """
+    from .models import Painting
+
+    with transaction.atomic():
+        painting = (
+            Painting.objects.select_for_update().only('pk', 'metadata')
+            .get(pk=painting_id)
+        )
+        set_image_info(painting, image, info)
+        Painting.objects.filter(pk=painting_id).update(
+            metadata=painting.metadata, updated_at=timezone.now()
+        )
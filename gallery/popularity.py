@@ -0,0 +1,147 @@
+"""Buffered painting view counts.
+
+Detail pages report a view with a beacon (see `views.record_painting_view`)
+rather than in the view itself, so views served from the page cache or
+the pre-rendered pages count too. Each process adds views to an
+in-memory buffer and writes them to `PaintingViewCount` with a single
+upsert statement once `FLUSH_EVENTS` views have accumulated, on the
+first view `FLUSH_SECONDS` after the last write, and when it exits.
+A process killed outright loses at most `FLUSH_EVENTS` views (up to
+`MAX_BUFFERED` while writes are failing).
+
+Each flush also copies the new totals to `Painting.views`, so the
+"most viewed" grid is an indexed scan of the paintings table rather
+than a sort over a join. Copying totals rather than adding the new
+views means a painting saved with a stale count is put right by its
+next flush.
+
+The beacon needs no CSRF token or login, so a client (its session, or
+its address without one) counts once per painting per
+`VIEW_WINDOW_SECONDS` (`first_view`).
+"""
+
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import caches
+from django.db import DatabaseError, connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH_EVENTS = 200
+FLUSH_SECONDS = 30
+# Views kept across failed flushes (e.g. the database is down) at most
+MAX_BUFFERED = FLUSH_EVENTS * 10
+VIEW_WINDOW_SECONDS = 30 * 60
+THROTTLE_CACHE_ALIAS = 'throttle'
+
+_lock = threading.Lock()
+_pending = Counter()
+_state = {'events': 0, 'flushed_at': time.monotonic()}
+
+
+def client_key(request):
+    """Who sent `request`: its session, or else its address."""
+    session_key = getattr(request, 'session', None) and (
+        request.session.session_key
+    )
+    if session_key:
+        return f'session:{session_key}'
+    # The last hop is the one our proxy (e.g. Heroku's router) added;
+    # earlier ones are whatever the client claimed
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    address = forwarded.split(',')[-1].strip() or request.META.get(
+        'REMOTE_ADDR', ''
+    )
+    return f'address:{address}'
+
+
+def first_view(painting_id, client):
+    """Whether `client` (see `client_key`) has not viewed `painting_id`
+    within `VIEW_WINDOW_SECONDS`; records that it now has."""
+    digest = hashlib.md5(
+        f'{painting_id}:{client}'.encode(), usedforsecurity=False
+    ).hexdigest()
+    return caches[THROTTLE_CACHE_ALIAS].add(
+        f'painting-view:{digest}', True, VIEW_WINDOW_SECONDS
+    )
+
+
+def record_view(painting_id):
+    """Count one view of `painting_id`, flushing the buffer when due."""
+    with _lock:
+        _pending[painting_id] += 1
+        _state['events'] += 1
+        due = (
+            _state['events'] >= FLUSH_EVENTS
+            or time.monotonic() - _state['flushed_at'] >= FLUSH_SECONDS
+        )
+    if due:
+        flush()
+
+
+def flush():
+    """Write the buffered views; returns how many were written."""
+    with _lock:
+        counts = dict(_pending)
+        _pending.clear()
+        _state['events'] = 0
+        _state['flushed_at'] = time.monotonic()
+    if not counts:
+        return 0
+    try:
+        _add_views(counts)
+    except DatabaseError:
+        logger.exception("Flushing %d painting views failed", len(counts))
+        with _lock:
+            if _state['events'] + sum(counts.values()) <= MAX_BUFFERED:
+                _pending.update(counts)
+                _state['events'] += sum(counts.values())
+        return 0
+    return sum(counts.values())
+
+
+def _add_views(counts):
+    """Add `counts` to the counters in one statement, then copy the
+    totals to the paintings in another.
+
+    Ids of paintings that no longer exist are dropped by the join.
+    """
+    from .models import Painting, PaintingViewCount
+
+    table = connection.ops.quote_name(PaintingViewCount._meta.db_table)
+    painting_table = connection.ops.quote_name(Painting._meta.db_table)
+    rows = ', '.join(['(%s, %s)'] * len(counts))
+    params = [timezone.now()]
+    for painting_id, views in counts.items():
+        params.extend([int(painting_id), views])
+    # "WHERE true" keeps SQLite from reading ON CONFLICT as a join clause
+    sql = (
+        f"INSERT INTO {table} (painting_id, views, updated_at) "
+        f"SELECT p.id, v.column2, %s FROM {painting_table} p "
+        f"JOIN (VALUES {rows}) AS v ON p.id = v.column1 "
+        f"WHERE true "
+        f"ON CONFLICT (painting_id) DO UPDATE SET "
+        f"views = {table}.views + excluded.views, "
+        f"updated_at = excluded.updated_at"
+    )
+    totals = PaintingViewCount.objects.filter(
+        painting=OuterRef('pk')
+    ).values('views')
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+        # update() leaves `updated_at`, so cached cards stay valid
+        Painting.objects.filter(pk__in=[int(pk) for pk in counts]).update(
+            views=Subquery(totals)
+        )
+
+
+atexit.register(flush)
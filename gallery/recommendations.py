@@ -0,0 +1,224 @@
+"""Offline "you may also like" recommendations.
+
+Every published painting is encoded as a weighted feature vector (its
+categories and their ancestors, medium, price band and decade), rows are
+L2-normalised, and cosine similarity for a block of paintings against the
+whole catalogue is a single matrix product. The top `TOP_K` neighbours per
+painting are stored in `RelatedPainting`.
+
+Refreshes are incremental: only paintings changed since their neighbours
+were computed (`Painting.related_computed_at`, set even when none were
+found) are re-scored, together with the paintings whose stored neighbour
+lists those changes can affect.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .facets import PRICE_BUCKETS
+from .models import Painting, RelatedPainting
+
+
+TOP_K = 6
+# Rows scored per matrix product; bounds memory at BLOCK_SIZE x catalogue.
+BLOCK_SIZE = 1024
+
+CATEGORY_WEIGHT = 1.0
+MEDIUM_WEIGHT = 0.8
+PRICE_WEIGHT = 0.5
+DECADE_WEIGHT = 0.5
+
+
+def _price_bucket(price):
+    for key, _, lower, upper in PRICE_BUCKETS:
+        if price >= lower and (upper is None or price < upper):
+            return key
+    return None
+
+
+def build_features(paintings, category_paths):
+    """Return the normalised feature matrix for `paintings`.
+
+    `category_paths` maps painting id to the materialized paths of its
+    categories.
+    """
+    columns = {}
+    entries = []  # (row, column, weight)
+
+    def add(row, feature, weight):
+        column = columns.setdefault(feature, len(columns))
+        entries.append((row, column, weight))
+
+    for row, painting in enumerate(paintings):
+        ancestors = {
+            ancestor
+            for path in category_paths.get(painting.pk, ())
+            for ancestor in path.split('/') if ancestor
+        }
+        for category_id in ancestors:
+            add(row, ('category', category_id), CATEGORY_WEIGHT)
+        if painting.medium:
+            add(row, ('medium', painting.medium.lower()), MEDIUM_WEIGHT)
+        bucket = _price_bucket(painting.price)
+        if bucket:
+            add(row, ('price', bucket), PRICE_WEIGHT)
+        if painting.year:
+            add(row, ('decade', painting.year // 10), DECADE_WEIGHT)
+
+    features = np.zeros((len(paintings), max(len(columns), 1)), np.float32)
+    if entries:
+        rows, cols, weights = zip(*entries)
+        features[list(rows), list(cols)] = weights
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return features / norms
+
+
+def _top_neighbours(features, rows, top_k):
+    """Yield ``(row, [(neighbour_row, score), ...])`` for `rows`."""
+    k = min(top_k, len(features) - 1)
+    if k <= 0:
+        for row in rows:
+            yield row, []
+        return
+
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = np.asarray(rows[start:start + BLOCK_SIZE])
+        scores = features[block] @ features.T
+        scores[np.arange(len(block)), block] = -np.inf  # never yourself
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        for row, neighbours, row_scores in zip(block, top, top_scores):
+            yield int(row), [
+                (int(n), float(s))
+                for n, s in zip(neighbours, row_scores) if s > 0
+            ]
+
+
+def stale_painting_ids():
+    """Ids of published paintings changed since their neighbours were
+    computed (or never computed)."""
+    return set(
+        Painting.objects.filter(is_published=True)
+        .filter(
+            Q(related_computed_at__isnull=True)
+            | Q(updated_at__gt=F('related_computed_at'))
+        )
+        .values_list('pk', flat=True)
+    )
+
+
+def refresh_related_paintings(painting_ids=None, top_k=TOP_K):
+    """Recompute stored neighbours; returns the number of paintings
+    re-scored.
+
+    With `painting_ids` of ``None`` every published painting is
+    re-scored. Otherwise the given paintings are re-scored together with
+    any painting whose stored list points at one of them, or whose list
+    one of them now outscores.
+    """
+    paintings = list(
+        Painting.objects.filter(is_published=True)
+        .only('pk', 'medium', 'price', 'year')
+        .order_by('pk')
+    )
+    if not paintings:
+        RelatedPainting.objects.all().delete()
+        return 0
+
+    category_paths = defaultdict(list)
+    for painting_id, path in (
+        Painting.categories.through.objects
+        .filter(painting__is_published=True)
+        .values_list('painting_id', 'category__path')
+    ):
+        category_paths[painting_id].append(path)
+
+    features = build_features(paintings, category_paths)
+    row_of = {painting.pk: row for row, painting in enumerate(paintings)}
+
+    if painting_ids is None:
+        targets = set(row_of)
+    else:
+        targets = _affected_painting_ids(
+            set(painting_ids), features, row_of, top_k
+        )
+
+    rows = sorted(row_of[pk] for pk in targets if pk in row_of)
+    now = timezone.now()
+    new_rows = [
+        RelatedPainting(
+            painting_id=paintings[row].pk,
+            related_id=paintings[neighbour].pk,
+            rank=rank,
+            score=score,
+            computed_at=now,
+        )
+        for row, neighbours in _top_neighbours(features, rows, top_k)
+        for rank, (neighbour, score) in enumerate(neighbours, start=1)
+    ]
+
+    stale = RelatedPainting.objects.all()
+    if painting_ids is not None:
+        stale = stale.filter(
+            Q(painting_id__in=targets) | Q(painting__is_published=False)
+        )
+    with transaction.atomic():
+        stale.delete()
+        RelatedPainting.objects.bulk_create(new_rows, batch_size=1000)
+        scored = Painting.objects.filter(is_published=True)
+        if painting_ids is not None:
+            scored = scored.filter(pk__in=[paintings[row].pk for row in rows])
+        # update() leaves `updated_at`, which this is compared against
+        scored.update(related_computed_at=now)
+    return len(rows)
+
+
+def _affected_painting_ids(changed_ids, features, row_of, top_k):
+    affected = set(changed_ids)
+
+    # Lists that mention a changed or since unpublished painting
+    affected.update(
+        RelatedPainting.objects.filter(
+            Q(related_id__in=changed_ids) | Q(related__is_published=False)
+        ).values_list('painting_id', flat=True)
+    )
+
+    changed_rows = [row_of[pk] for pk in changed_ids if pk in row_of]
+    if not changed_rows:
+        return affected
+
+    # Lists a changed painting would now break into: its similarity
+    # beats the weakest stored neighbour, or the list is not yet full.
+    weakest = np.zeros(len(features), np.float32)
+    counts = np.zeros(len(features), np.int32)
+    for painting_id, lowest, count in _stored_list_stats():
+        row = row_of.get(painting_id)
+        if row is not None:
+            weakest[row], counts[row] = lowest, count
+    best_new = np.zeros(len(features), np.float32)
+    for start in range(0, len(changed_rows), BLOCK_SIZE):
+        block = changed_rows[start:start + BLOCK_SIZE]
+        scores = features[block] @ features.T
+        scores[np.arange(len(block)), block] = 0
+        best_new = np.maximum(best_new, scores.max(axis=0))
+    beaten = (best_new > weakest) | ((counts < top_k) & (best_new > 0))
+    ids_by_row = {row: pk for pk, row in row_of.items()}
+    affected.update(ids_by_row[row] for row in np.flatnonzero(beaten))
+    return affected
+
+
+def _stored_list_stats():
+    return (
+        RelatedPainting.objects.values('painting_id')
+        .annotate(lowest=Min('score'), count=Count('id'))
+        .values_list('painting_id', 'lowest', 'count')
+        .order_by()
+    )
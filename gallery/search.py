@@ -0,0 +1,102 @@
+"""Ranked full-text search over paintings.
+
+On PostgreSQL every painting carries a weighted ``search_document``
+tsvector (GIN indexed, refreshed by `Painting.save`), so a search is one
+index lookup plus ``ts_rank``. Other backends (SQLite for local runs) fall
+back to ``icontains`` matching scored with the same per-field weights.
+"""
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connections
+from django.db.models import Case, F, FloatField, Q, Value, When
+
+
+SEARCH_CONFIG = 'english'
+SEARCH_RESULTS_LIMIT = 48
+# Longer queries are truncated to keep the fallback's WHERE clause bounded
+MAX_FALLBACK_TERMS = 8
+
+# Field weights, highest first; values mirror PostgreSQL's default
+# ts_rank weights for A/B/C/D so both backends order results alike.
+SEARCH_WEIGHTS = (
+    ('A', 1.0, ('title',)),
+    ('B', 0.4, ('medium', 'materials')),
+    ('C', 0.2, ('description',)),
+    ('D', 0.1, ('provenance', 'exhibition_history')),
+)
+SEARCH_FIELDS = tuple(
+    field for _, _, fields in SEARCH_WEIGHTS for field in fields
+)
+
+
+def uses_postgres_search(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def search_vector():
+    """The weighted tsvector expression stored in `search_document`."""
+    vector = None
+    for weight, _, fields in SEARCH_WEIGHTS:
+        part = SearchVector(*fields, weight=weight, config=SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def update_search_document(queryset):
+    """Recompute the stored search document for every row in `queryset`.
+
+    A no-op on backends without tsvector support.
+    """
+    if uses_postgres_search(queryset.db):
+        queryset.update(search_document=search_vector())
+
+
+def search_paintings(queryset, query):
+    """Filter `queryset` to paintings matching `query`, best match first.
+
+    Each result is annotated with a float `rank`.
+    """
+    if uses_postgres_search(queryset.db):
+        search_query = SearchQuery(
+            query, search_type='websearch', config=SEARCH_CONFIG
+        )
+        return (
+            queryset.filter(search_document=search_query)
+            .annotate(rank=SearchRank(F('search_document'), search_query))
+            .order_by('-rank', '-date_created', '-id')
+        )
+    return _fallback_search(queryset, query)
+
+
+def _fallback_search(queryset, query):
+    terms = query.split()[:MAX_FALLBACK_TERMS]
+    if not terms:
+        return queryset.none()
+
+    rank = Value(0.0, output_field=FloatField())
+    for term in terms:
+        # Every term must match somewhere...
+        queryset = queryset.filter(_any_field_contains(SEARCH_FIELDS, term))
+        # ...and scores by the best-weighted field it matched in.
+        rank = rank + Case(
+            *(
+                When(_any_field_contains(fields, term), then=Value(weight))
+                for _, weight, fields in SEARCH_WEIGHTS
+            ),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    return queryset.annotate(rank=rank).order_by(
+        '-rank', '-date_created', '-id'
+    )
+
+
+def _any_field_contains(fields, term):
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f'{field}__icontains': term})
+    return condition
@@ -0,0 +1,49 @@
+from rest_framework import serializers
+
+from .models import Painting
+
+
+class PaintingSerializer(serializers.ModelSerializer):
+    """Catalogue representation of a painting.
+
+    Pass ``fields`` to serialize only a subset (sparse fieldsets); the
+    queryset should be narrowed to match, see gallery.api.
+    """
+
+    url = serializers.SerializerMethodField()
+    artist = serializers.SerializerMethodField()
+    image = serializers.SerializerMethodField()
+    categories = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field='slug'
+    )
+
+    class Meta:
+        model = Painting
+        fields = (
+            "id", "slug", "title", "url", "artist", "price", "status",
+            "medium", "dimensions", "year", "description", "image",
+            "categories", "date_created",
+        )
+        read_only_fields = fields
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_url(self, painting):
+        return painting.get_absolute_url()
+
+    def get_artist(self, painting):
+        return painting.artist.name if painting.artist else None
+
+    def get_image(self, painting):
+        if painting.cover_image:
+            return {"url": painting.cover_image.url, "alt": painting.title}
+        if painting.primary_image:
+            return {
+                "url": painting.primary_image.image.url,
+                "alt": painting.primary_image.alt_text,
+            }
+        return None
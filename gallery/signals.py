@@ -0,0 +1,134 @@
+"""Signal handlers keeping denormalized gallery data in sync."""
+
+from django.conf import settings
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.urls import reverse
+from django.utils import timezone
+
+from config import prerender
+from .artists import invalidate_primary_artist
+from .facets import invalidate_facets
+from .models import Artist, Category, Painting, PaintingImage, RelatedPainting
+
+
+def touch_paintings(queryset):
+    """Bump `updated_at` so cached renderings of these paintings expire."""
+    queryset.update(updated_at=timezone.now())
+    prerender_paintings(queryset)
+
+
+def prerender_paintings(queryset):
+    """Schedule the pre-rendered pages showing these paintings: their
+    detail pages, those listing them as related, and the collection."""
+    if not settings.PRERENDER_PAGES:
+        return
+    slugs = set()
+    for slug, is_published in queryset.values_list('slug', 'is_published'):
+        if is_published:
+            slugs.add(slug)
+        else:
+            prerender.discard(prerender.painting_path(slug))
+    slugs.update(
+        RelatedPainting.objects.filter(
+            related__in=queryset, painting__is_published=True
+        ).values_list('painting__slug', flat=True)
+    )
+    prerender.schedule(
+        reverse('gallery:collection'),
+        reverse('about:about'),
+        *(prerender.painting_path(slug) for slug in slugs),
+    )
+
+
+@receiver(post_save, sender=PaintingImage)
+@receiver(post_delete, sender=PaintingImage)
+def update_primary_image(sender, instance, **kwargs):
+    """Re-resolve the owning painting's primary image when its images
+    are added, reordered or deleted."""
+    Painting(pk=instance.painting_id).refresh_primary_image()
+    prerender_paintings(Painting.objects.filter(pk=instance.painting_id))
+
+
+@receiver(post_save, sender=Painting)
+@receiver(post_delete, sender=Painting)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Painting.categories.through)
+def clear_facet_cache(sender, **kwargs):
+    """Drop cached facet counts whenever the counted data changes."""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_facets()
+
+
+@receiver(m2m_changed, sender=Painting.categories.through)
+def touch_recategorised_paintings(sender, instance, action, reverse,
+                                  pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        if reverse:
+            touch_paintings(Painting.objects.filter(pk__in=pk_set))
+        else:
+            touch_paintings(Painting.objects.filter(pk=instance.pk))
+    elif action == 'pre_clear' and reverse:
+        # The links are gone by post_clear, so touch while we can see them
+        touch_paintings(instance.paintings.all())
+    elif action == 'post_clear' and not reverse:
+        touch_paintings(Painting.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def touch_category_paintings(sender, instance, **kwargs):
+    if not kwargs.get('created'):
+        touch_paintings(Painting.objects.filter(categories=instance))
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+def clear_primary_artist_cache(sender, **kwargs):
+    invalidate_primary_artist()
+
+
+@receiver(post_save, sender=Artist)
+def touch_artist_paintings(sender, instance, created, **kwargs):
+    if not created:
+        touch_paintings(Painting.objects.filter(artist=instance))
+
+
+@receiver(pre_save, sender=Painting)
+def remember_painting_slug(sender, instance, **kwargs):
+    """Note the stored slug so a rename can drop the old page."""
+    if settings.PRERENDER_PAGES and instance.pk:
+        instance._prerendered_slug = (
+            Painting.objects.filter(pk=instance.pk)
+            .values_list('slug', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Painting)
+def prerender_painting(sender, instance, **kwargs):
+    old_slug = getattr(instance, '_prerendered_slug', None)
+    if old_slug and old_slug != instance.slug:
+        prerender.discard(prerender.painting_path(old_slug))
+    prerender_paintings(Painting.objects.filter(pk=instance.pk))
+
+
+@receiver(pre_delete, sender=Painting)
+def discard_painting_page(sender, instance, **kwargs):
+    # Scheduled while its related links still exist; its own page then
+    # renders as a 404, which keeps it removed.
+    prerender.discard(prerender.painting_path(instance.slug))
+    prerender_paintings(Painting.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def prerender_collection(sender, **kwargs):
+    """Category names and counts appear in the collection's filters."""
+    prerender.schedule(reverse('gallery:collection'))
@@ -0,0 +1,12 @@
+from django import template
+
+from ..fragments import render_painting_cards
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def painting_cards(paintings):
+    """Rendered (and cached) card HTML for each painting in `paintings`."""
+    return render_painting_cards(paintings)
@@ -0,0 +1,111 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from config import derivatives
+from ..placeholders import get_image_info
+
+
+register = template.Library()
+
+# Width of the <img src> fallback for browsers without srcset support
+FALLBACK_WIDTH = 960
+
+
+def _local_srcset(entry, extension):
+    return ', '.join(
+        f"{derivatives.variant_url(entry['hash'], width, extension)} {width}w"
+        for width in entry['widths']
+    )
+
+
+def _cloudinary_url(image, width):
+    return image.build_url(
+        width=width, crop='limit', fetch_format='auto', quality='auto'
+    )
+
+
+def _cloudinary_srcset(image):
+    return ', '.join(
+        f"{_cloudinary_url(image, width)} {width}w"
+        for width in derivatives.WIDTHS
+    )
+
+
+@register.simple_tag
+def srcset(image, format='webp'):
+    """``srcset`` for a static path or a CloudinaryField value.
+
+    Uses the local derivatives (config.derivatives) when they have been
+    built, else Cloudinary's resizing; a static image without
+    derivatives has no srcset.
+    """
+    if not image:
+        return ''
+    entry = derivatives.lookup(derivatives.source_key(image))
+    if entry is not None:
+        return _local_srcset(entry, format)
+    if isinstance(image, str):
+        return ''
+    return _cloudinary_srcset(image)
+
+
+@register.filter
+def image_info(painting, image):
+    """Placeholder and size of one of `painting`'s images, if known."""
+    return get_image_info(painting, image)
+
+
+@register.simple_tag
+def responsive_image(image, sizes='100vw', placeholder=None, **attrs):
+    """A ``<picture>`` with AVIF and WebP sources for `image`.
+
+    `image` is a static path or a CloudinaryField value; `attrs` (alt,
+    class, loading...) go on the ``<img>``. The ``<picture>`` is
+    ``display: contents`` so existing image styling is unaffected.
+    `placeholder` is the image's `image_info`: its blurred thumbnail is
+    shown as the background until the image loads, and its size is set
+    so the layout does not shift.
+    """
+    if not image:
+        return ''
+    attrs.setdefault('decoding', 'async')
+    if placeholder:
+        attrs.setdefault('width', placeholder['width'])
+        attrs.setdefault('height', placeholder['height'])
+        attrs['style'] = (
+            f"background: url({placeholder['placeholder']}) "
+            "center / cover no-repeat"
+        )
+    entry = derivatives.lookup(derivatives.source_key(image))
+    sources = []
+    if entry is not None:
+        sources = [
+            (media_type, _local_srcset(entry, extension))
+            for extension, media_type, _ in derivatives.FORMATS
+        ]
+        fallback = max(
+            [w for w in entry['widths'] if w <= FALLBACK_WIDTH]
+            or entry['widths'][:1]
+        )
+        attrs['src'] = derivatives.variant_url(entry['hash'], fallback, 'webp')
+        attrs.setdefault('width', entry['width'])
+        attrs.setdefault('height', entry['height'])
+    elif isinstance(image, str):
+        attrs['src'] = static(image)
+    else:
+        attrs['src'] = _cloudinary_url(image, FALLBACK_WIDTH)
+        attrs['srcset'] = _cloudinary_srcset(image)
+    if sources or 'srcset' in attrs:
+        attrs['sizes'] = sizes
+
+    return format_html(
+        '<picture class="contents">{}<img {}></picture>',
+        format_html_join(
+            '', '<source type="{}" srcset="{}" sizes="{}">',
+            ((media_type, value, sizes) for media_type, value in sources),
+        ),
+        format_html_join(
+            ' ', '{}="{}"', sorted(attrs.items()),
+        ),
+    )
@@ -1,3 +1,1167 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import cloudinary
+from cloudinary import CloudinaryResource
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from config import derivatives, prerender
+from orders.availability import with_held
+from orders.models import Reservation
+from . import popularity
+from .artists import bulk_create_paintings, invalidate_primary_artist
+from .categories import category_tree
+from .facets import get_facets
+from .fragments import CARD_CACHE_ALIAS, render_painting_cards
+from .importer import PaintingImporter, read_rows
+from .models import (
+    Artist, Category, Painting, PaintingImage, PaintingViewCount,
+    RelatedPainting,
+)
+from .pagination import (
+    PAINTINGS_PER_PAGE, InvalidCursor, paginate_paintings,
+)
+from .placeholders import get_image_info, image_info, record_image_info
+from .recommendations import refresh_related_paintings, stale_painting_ids
+from .search import search_paintings
+
+
+TEST_STORAGES = {**getattr(settings, "STORAGES", {})}
+TEST_STORAGES["staticfiles"] = {
+    "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+}
+
+
+def make_painting(index, **kwargs):
+    """Create a published painting whose age increases with `index`."""
+    defaults = {
+        "title": f"Painting {index}",
+        "slug": f"painting-{index}",
+        "price": Decimal("100.00"),
+        "date_created": timezone.now() - timedelta(days=index),
+    }
+    defaults.update(kwargs)
+    return Painting.objects.create(**defaults)
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # CacheMiddleware would otherwise serve pages from earlier tests
+        cache.clear()
+
+    def test_cursor_walks_every_painting_exactly_once(self):
+        created = [make_painting(i) for i in range(PAINTINGS_PER_PAGE * 2 + 3)]
+        resp = self.client.get(reverse("gallery:collection"))
+        self.assertEqual(resp.status_code, 200)
+        seen = [p.pk for p in resp.context["paintings"]]
+        cursor = resp.context["next_cursor"]
+        while cursor:
+            resp = self.client.get(
+                reverse("gallery:paintings_ajax"), {"cursor": cursor}
+            )
+            self.assertEqual(resp.status_code, 200)
+            seen.extend(p.pk for p in resp.context["paintings"])
+            cursor = resp.context["next_cursor"]
+        self.assertEqual(seen, [p.pk for p in created])
+
+    def test_date_ties_are_broken_by_id(self):
+        when = timezone.now()
+        for i in range(PAINTINGS_PER_PAGE + 1):
+            make_painting(i, date_created=when)
+        resp = self.client.get(reverse("gallery:paintings_ajax"))
+        cursor = resp.context["next_cursor"]
+        self.assertIsNotNone(cursor)
+        resp = self.client.get(
+            reverse("gallery:paintings_ajax"), {"cursor": cursor}
+        )
+        self.assertEqual(len(resp.context["paintings"]), 1)
+        self.assertIsNone(resp.context["next_cursor"])
+
+    def test_filters_apply_to_later_pages(self):
+        abstract = Category.objects.create(name="Abstract", slug="abstract")
+        for i in range(PAINTINGS_PER_PAGE + 2):
+            p = make_painting(i, status="sold" if i % 2 else "available")
+            p.categories.add(abstract)
+        params = {"category": "abstract", "status": "available"}
+        resp = self.client.get(reverse("gallery:paintings_ajax"), params)
+        paintings = resp.context["paintings"]
+        self.assertEqual(len(paintings), (PAINTINGS_PER_PAGE + 2) // 2)
+        self.assertTrue(all(p.status == "available" for p in paintings))
+        self.assertIsNone(resp.context["next_cursor"])
+
+    def test_invalid_cursor_is_rejected(self):
+        resp = self.client.get(
+            reverse("gallery:paintings_ajax"), {"cursor": "not-a-cursor"}
+        )
+        self.assertEqual(resp.status_code, 400)
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class PrimaryImageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(cloudinary.config(), "cloud_name", "test")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_image(self, painting, order):
+        return PaintingImage.objects.create(
+            painting=painting,
+            image=f"sample-{painting.pk}-{order}",
+            alt_text=f"View {order}",
+            display_order=order,
+        )
+
+    def test_primary_image_follows_add_reorder_and_delete(self):
+        painting = make_painting(1)
+        second = self.add_image(painting, 2)
+        painting.refresh_from_db()
+        self.assertEqual(painting.primary_image_id, second.pk)
+
+        first = self.add_image(painting, 1)
+        painting.refresh_from_db()
+        self.assertEqual(painting.primary_image_id, first.pk)
+
+        first.display_order = 3
+        first.save()
+        painting.refresh_from_db()
+        self.assertEqual(painting.primary_image_id, second.pk)
+
+        second.delete()
+        painting.refresh_from_db()
+        self.assertEqual(painting.primary_image_id, first.pk)
+
+        first.delete()
+        painting.refresh_from_db()
+        self.assertIsNone(painting.primary_image_id)
+
+    def test_full_grid_page_renders_in_one_query(self):
+        for i in range(PAINTINGS_PER_PAGE):
+            self.add_image(make_painting(i), 1)
+        with self.assertNumQueries(1):
+            resp = self.client.get(reverse("gallery:paintings_ajax"))
+        self.assertContains(resp, 'alt="View 1"', count=PAINTINGS_PER_PAGE)
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_title_matches_outrank_description_matches(self):
+        described = make_painting(
+            1, title="Morning", description="A quiet harbour at dawn"
+        )
+        titled = make_painting(2, title="Harbour Lights")
+        results = list(
+            search_paintings(Painting.objects.all(), "harbour")
+        )
+        self.assertEqual(results, [titled, described])
+        self.assertGreater(results[0].rank, results[1].rank)
+
+    def test_every_term_must_match(self):
+        make_painting(1, title="Blue", medium="Oil")
+        match = make_painting(2, title="Blue", medium="Acrylic")
+        results = search_paintings(Painting.objects.all(), "blue acrylic")
+        self.assertEqual(list(results), [match])
+
+    def test_search_endpoint_respects_filters_and_publication(self):
+        make_painting(1, title="Venus", status="sold")
+        make_painting(2, title="Venus Rising", is_published=False)
+        available = make_painting(3, title="Venus at Rest")
+        resp = self.client.get(
+            reverse("gallery:search"), {"q": "venus", "status": "available"}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(list(resp.context["paintings"]), [available])
+
+    def test_empty_query_renders_without_results(self):
+        resp = self.client.get(reverse("gallery:search"), {"q": "  "})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context["paintings"], [])
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.abstract = Category.objects.create(name="Abstract", slug="abstract")
+        make_painting(
+            1, medium="Oil", year=1995, price=Decimal("300.00")
+        ).categories.add(self.abstract)
+        make_painting(
+            2, medium="Oil", year=2021, price=Decimal("3000.00"), status="sold"
+        )
+        make_painting(3, medium="Ink", year=2024, is_published=False)
+
+    def counts(self, facet):
+        return {o["value"]: o["count"] for o in get_facets()[facet]}
+
+    def test_counts_cover_published_paintings_only(self):
+        self.assertEqual(self.counts("categories"), {"abstract": 1})
+        self.assertEqual(self.counts("statuses"), {"available": 1, "sold": 1})
+        self.assertEqual(self.counts("mediums"), {"Oil": 2})
+        self.assertEqual(self.counts("decades"), {"1990": 1, "2020": 1})
+        self.assertEqual(self.counts("prices"), {"250-500": 1, "2500-": 1})
+
+    def test_counts_are_cached_until_categories_change(self):
+        get_facets()
+        with self.assertNumQueries(0):
+            get_facets()
+        Painting.objects.get(slug="painting-2").categories.add(self.abstract)
+        self.assertEqual(self.counts("categories"), {"abstract": 2})
+
+    def test_collection_filters_by_decade_and_price(self):
+        resp = self.client.get(
+            reverse("gallery:collection"), {"decade": "1990", "price": "250-500"}
+        )
+        self.assertEqual(
+            [p.slug for p in resp.context["paintings"]], ["painting-1"]
+        )
+        self.assertContains(resp, "Abstract (1)")
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class CardFragmentCacheTests(TestCase):
+    def setUp(self):
+        caches[CARD_CACHE_ALIAS].clear()
+        self.painting = make_painting(1)
+
+    def version(self):
+        return Painting.objects.get(pk=self.painting.pk).updated_at
+
+    def test_cards_render_once_then_come_from_cache(self):
+        paintings = [self.painting]
+        with mock.patch(
+            "gallery.fragments.render_to_string", return_value="<card>"
+        ) as render:
+            self.assertEqual(render_painting_cards(paintings), ["<card>"])
+            render_painting_cards(paintings)
+        self.assertEqual(render.call_count, 1)
+
+    def test_save_invalidates_cached_card(self):
+        render_painting_cards([self.painting])
+        self.painting.title = "Renamed"
+        self.painting.save()
+        self.assertIn("Renamed", render_painting_cards([self.painting])[0])
+
+    def test_related_changes_bump_the_version(self):
+        artist = Artist.objects.create(name="Cecilia")
+        category = Category.objects.create(name="Abstract", slug="abstract")
+        Painting.objects.filter(pk=self.painting.pk).update(artist=artist)
+
+        before = self.version()
+        self.painting.categories.add(category)
+        self.assertGreater(self.version(), before)
+
+        before = self.version()
+        category.name = "Abstraction"
+        category.save()
+        self.assertGreater(self.version(), before)
+
+        before = self.version()
+        artist.name = "Cecilia K."
+        artist.save()
+        self.assertGreater(self.version(), before)
+
+        before = self.version()
+        PaintingImage.objects.create(
+            painting=self.painting, image="sample", alt_text="Detail"
+        )
+        self.assertGreater(self.version(), before)
+
+    def test_card_shows_a_painting_held_by_a_checkout_as_reserved(self):
+        cache.clear()
+        render_painting_cards([self.painting])
+        reservation = Reservation.objects.create(
+            product_title=self.painting.title,
+            product_sku=self.painting.sku,
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.assertIn("Reserved", render_painting_cards([self.painting])[0])
+        listed = with_held(Painting.objects.filter(pk=self.painting.pk))
+        self.assertIn("Reserved", render_painting_cards(listed)[0])
+
+        reservation.released_at = timezone.now()
+        reservation.save()
+        self.assertIn("Available", render_painting_cards([self.painting])[0])
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.art = Category.objects.create(name="Art", slug="art")
+        self.figurative = Category.objects.create(
+            name="Figurative", slug="figurative", parent=self.art
+        )
+        self.nudes = Category.objects.create(
+            name="Nudes", slug="nudes", parent=self.figurative
+        )
+        self.pop = Category.objects.create(name="Pop", slug="pop")
+
+    def test_paths_and_depths_follow_the_tree(self):
+        self.nudes.refresh_from_db()
+        self.assertEqual(
+            self.nudes.path,
+            f"{self.art.pk}/{self.figurative.pk}/{self.nudes.pk}/",
+        )
+        self.assertEqual(self.nudes.depth, 2)
+
+    def test_moving_a_category_rewrites_its_subtree(self):
+        self.figurative.parent = self.pop
+        self.figurative.save()
+        self.nudes.refresh_from_db()
+        self.assertEqual(
+            self.nudes.path,
+            f"{self.pop.pk}/{self.figurative.pk}/{self.nudes.pk}/",
+        )
+        self.assertEqual(self.nudes.depth, 2)
+
+    def test_cannot_move_a_category_under_its_descendant(self):
+        self.art.parent = self.nudes
+        with self.assertRaises(ValueError):
+            self.art.save()
+
+    def test_category_filter_includes_descendants_once(self):
+        painting = make_painting(1)
+        painting.categories.add(self.figurative, self.nudes)
+        make_painting(2).categories.add(self.pop)
+        resp = self.client.get(
+            reverse("gallery:collection"), {"category": "art"}
+        )
+        self.assertEqual(list(resp.context["paintings"]), [painting])
+        self.assertEqual(
+            resp.context["category_breadcrumbs"], [self.art]
+        )
+        counts = {o["value"]: o["count"] for o in get_facets()["categories"]}
+        self.assertEqual(counts["art"], 1)
+        self.assertEqual(counts["pop"], 1)
+
+    def test_breadcrumbs_and_menu_cost_one_query_each(self):
+        self.nudes.refresh_from_db()
+        with self.assertNumQueries(1):
+            crumbs = self.nudes.ancestors()
+        self.assertEqual(crumbs, [self.art, self.figurative, self.nudes])
+        with self.assertNumQueries(1):
+            menu = category_tree()
+        self.assertEqual(menu, [self.art, self.figurative, self.nudes, self.pop])
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class RelatedPaintingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.art = Category.objects.create(name="Art", slug="art")
+        self.seascapes = Category.objects.create(
+            name="Seascapes", slug="seascapes", parent=self.art
+        )
+        self.portraits = Category.objects.create(
+            name="Portraits", slug="portraits", parent=self.art
+        )
+        self.harbour = make_painting(1, medium="Oil", year=2021)
+        self.harbour.categories.add(self.seascapes)
+        self.cove = make_painting(2, medium="Oil", year=2023)
+        self.cove.categories.add(self.seascapes)
+        self.sitter = make_painting(3, medium="Ink", year=1990)
+        self.sitter.categories.add(self.portraits)
+
+    def related(self, painting):
+        return list(
+            RelatedPainting.objects.filter(painting=painting)
+            .values_list("related__slug", flat=True)
+        )
+
+    def test_most_similar_paintings_rank_first(self):
+        self.assertEqual(refresh_related_paintings(), 3)
+        self.assertEqual(
+            self.related(self.harbour), ["painting-2", "painting-3"]
+        )
+        scores = list(
+            self.harbour.recommendations.values_list("score", flat=True)
+        )
+        self.assertGreater(scores[0], scores[1])
+
+    def test_incremental_refresh_only_touches_affected_lists(self):
+        refresh_related_paintings()
+        self.assertEqual(stale_painting_ids(), set())
+
+        self.sitter.medium = "Oil"
+        self.sitter.save()
+        self.assertEqual(stale_painting_ids(), {self.sitter.pk})
+        refresh_related_paintings(stale_painting_ids())
+        self.assertEqual(stale_painting_ids(), set())
+
+        Painting.objects.filter(pk=self.cove.pk).update(is_published=False)
+        refresh_related_paintings([self.cove.pk])
+        self.assertEqual(self.related(self.harbour), ["painting-3"])
+        self.assertFalse(self.cove.recommendations.exists())
+
+    def test_painting_without_neighbours_is_not_rescored(self):
+        loner = make_painting(4, price=Decimal("9000"))
+        refresh_related_paintings()
+        self.assertFalse(loner.recommendations.exists())
+        self.assertEqual(stale_painting_ids(), set())
+
+        loner.medium = "Oil"
+        loner.save()
+        self.assertEqual(stale_painting_ids(), {loner.pk})
+        refresh_related_paintings(stale_painting_ids())
+        self.assertTrue(loner.recommendations.exists())
+        self.assertEqual(stale_painting_ids(), set())
+
+    def test_detail_page_shows_neighbours(self):
+        refresh_related_paintings()
+        resp = self.client.get(
+            reverse("gallery:painting_detail", args=[self.harbour.slug])
+        )
+        self.assertEqual(
+            resp.context["related_paintings"], [self.cove, self.sitter]
+        )
+        self.assertContains(resp, "You may also like")
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.painting = make_painting(1)
+
+    def revalidate(self, url, resp):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"])
+
+    def test_pages_are_revalidated_not_cached(self):
+        for url in (
+            reverse("gallery:collection"),
+            reverse("gallery:painting_detail", args=[self.painting.slug]),
+        ):
+            resp = self.client.get(url)
+            self.assertIn("no-cache", resp["Cache-Control"])
+            self.assertIn("max-age=0", resp["Cache-Control"])
+        self.painting.title = "Renamed"
+        self.painting.save()
+        # A plain reload, no cache clearing: the edit shows at once
+        for url in (
+            reverse("gallery:collection"),
+            reverse("gallery:painting_detail", args=[self.painting.slug]),
+        ):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertContains(resp, "Renamed")
+
+    def test_unchanged_collection_is_not_rerendered(self):
+        url = reverse("gallery:collection")
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        # The catalogue and the reservations
+        with self.assertNumQueries(2):
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b"")
+
+    def test_collection_etag_changes_with_reservations(self):
+        url = reverse("gallery:collection")
+        resp = self.client.get(url)
+        self.assertContains(resp, "Available")
+        Reservation.objects.create(
+            product_title=self.painting.title,
+            product_sku=self.painting.sku,
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        resp = self.revalidate(url, resp)
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "Reserved")
+
+    def test_reservations_show_on_the_next_grid_response(self):
+        urls = [reverse("gallery:collection"),
+                reverse("gallery:paintings_ajax")]
+        for url in urls:
+            self.assertContains(self.client.get(url), "Available")
+        reservation = Reservation.objects.create(
+            product_title=self.painting.title,
+            product_sku=self.painting.sku,
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        for url in urls:
+            self.assertContains(self.client.get(url), "Reserved")
+        reservation.released_at = timezone.now()
+        reservation.save()
+        for url in urls:
+            self.assertContains(self.client.get(url), "Available")
+
+    def test_collection_etag_changes_with_the_catalogue(self):
+        url = reverse("gallery:collection")
+        resp = self.client.get(url)
+        self.painting.title = "Renamed"
+        self.painting.save()
+        resp = self.revalidate(url, resp)
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "Renamed")
+
+    def test_painting_detail_honours_if_modified_since(self):
+        url = reverse("gallery:painting_detail", args=[self.painting.slug])
+        resp = self.client.get(url)
+        self.assertIn("Last-Modified", resp)
+        resp = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=resp["Last-Modified"]
+        )
+        self.assertEqual(resp.status_code, 304)
+
+    def test_signed_in_users_get_their_own_etag(self):
+        url = reverse("gallery:painting_detail", args=[self.painting.slug])
+        anonymous = self.client.get(url)
+        user = get_user_model().objects.create_user("viewer", password="pw")
+        self.client.force_login(user)
+        resp = self.revalidate(url, anonymous)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("Last-Modified", resp)
+
+
+@override_settings(
+    STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False, PRERENDER_PAGES=True
+)
+class PrerenderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.enterContext(override_settings(PRERENDER_ROOT=root))
+        self.painting = make_painting(1, title="Tidal Study")
+        self.detail = reverse("gallery:painting_detail", args=["painting-1"])
+
+    def test_only_changed_pages_are_rerendered(self):
+        rendered = prerender.prerender()
+        self.assertIn(self.detail, rendered)
+        self.assertTrue(prerender.page_file(self.detail).exists())
+
+        # Versionless pages (home, about) are always rebuilt
+        self.assertEqual(
+            prerender.prerender(),
+            [reverse("index"), reverse("about:about")],
+        )
+
+        Painting.objects.filter(pk=self.painting.pk).update(
+            updated_at=timezone.now()
+        )
+        rendered = prerender.prerender()
+        self.assertIn(self.detail, rendered)
+        self.assertIn(reverse("gallery:collection"), rendered)
+        self.assertNotIn(reverse("events:events"), rendered)
+
+    def test_anonymous_visitors_get_the_static_page(self):
+        prerender.prerender()
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.detail)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"Tidal Study", b"".join(resp.streaming_content))
+
+        # Filtered views and visitors with a session stay dynamic
+        resp = self.client.get(reverse("gallery:collection"), {"status": "sold"})
+        self.assertTrue(hasattr(resp, "context"))
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = "abc"
+        resp = self.client.get(self.detail)
+        self.assertEqual(resp.context["painting"], self.painting)
+
+    def test_saves_take_affected_pages_out_until_rerendered(self):
+        prerender.prerender()
+        self.painting.title = "Tidal Study II"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.painting.save()
+        # Nothing is rendered in the saving request
+        self.assertFalse(prerender.page_file(self.detail).exists())
+        resp = self.client.get(self.detail)
+        self.assertContains(resp, "Tidal Study II")
+
+        self.assertIn(self.detail, prerender.prerender())
+        self.assertIn(
+            "Tidal Study II", prerender.page_file(self.detail).read_text()
+        )
+
+        self.painting.is_published = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.painting.save()
+        prerender.prerender()
+        self.assertFalse(prerender.page_file(self.detail).exists())
+
+    def test_reservations_take_the_collection_out(self):
+        prerender.prerender()
+        collection = prerender.page_file(reverse("gallery:collection"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.create(
+                product_title=self.painting.title,
+                product_sku=self.painting.sku,
+                expires_at=timezone.now() + timedelta(hours=1),
+            )
+        self.assertFalse(collection.exists())
+        prerender.prerender()
+        self.assertIn("Reserved", collection.read_text())
+
+    def test_events_page_rendered_yesterday_is_not_served(self):
+        prerender.prerender()
+        events = reverse("events:events")
+        self.assertTrue(self.client.get(events).streaming)
+
+        yesterday = (timezone.now() - timedelta(days=1)).timestamp()
+        os.utime(prerender.page_file(events), (yesterday, yesterday))
+        resp = self.client.get(events)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.streaming)
+        self.assertIn(events, prerender.prerender())
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class CatalogueApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(cloudinary.config(), "cloud_name", "test")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = reverse("gallery:api_paintings")
+        artist = Artist.objects.create(name="Cecilia")
+        abstract = Category.objects.create(name="Abstract", slug="abstract")
+        self.paintings = []
+        for i in range(PAINTINGS_PER_PAGE + 2):
+            painting = make_painting(i, artist=artist)
+            painting.categories.add(abstract)
+            PaintingImage.objects.create(
+                painting=painting, image=f"sample-{i}", alt_text=f"View {i}"
+            )
+            self.paintings.append(painting)
+
+    def test_sparse_fieldset_is_one_narrow_query(self):
+        with self.assertNumQueries(1) as ctx:
+            resp = self.client.get(self.url, {"fields": "id,title"})
+        self.assertEqual(resp.status_code, 200)
+        first = resp.json()["results"][0]
+        self.assertEqual(set(first), {"id", "title"})
+        self.assertNotIn("description", ctx.captured_queries[0]["sql"])
+
+    def test_full_representation_prefetches_categories(self):
+        with self.assertNumQueries(2):
+            resp = self.client.get(self.url)
+        first = resp.json()["results"][0]
+        self.assertEqual(first["artist"], "Cecilia")
+        self.assertEqual(first["categories"], ["abstract"])
+        self.assertEqual(first["image"]["alt"], "View 0")
+
+    def test_cursor_walks_every_painting(self):
+        seen, url = [], self.url + "?fields=slug"
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(p["slug"] for p in data["results"])
+            url = data["next"]
+        self.assertEqual(seen, [p.slug for p in self.paintings])
+
+    def test_bulk_fetch_keeps_request_order(self):
+        first, second = self.paintings[:2]
+        hidden = make_painting(99, is_published=False)
+        resp = self.client.get(
+            self.url, {"ids": f"{second.pk},{hidden.pk},{first.pk}",
+                       "fields": "id"}
+        )
+        self.assertEqual(
+            resp.json()["results"], [{"id": second.pk}, {"id": first.pk}]
+        )
+        resp = self.client.get(self.url, {"slugs": first.slug})
+        self.assertEqual(resp.json()["results"][0]["id"], first.pk)
+
+    def test_bad_parameters_are_rejected(self):
+        for params in (
+            {"fields": "id,secret"},
+            {"ids": "1,x"},
+            {"cursor": "bogus"},
+            {"ids": ",".join(str(i) for i in range(101))},
+        ):
+            resp = self.client.get(self.url, params)
+            self.assertEqual(resp.status_code, 400, params)
+
+    def test_edits_show_on_the_next_response(self):
+        painting = self.paintings[0]
+        params = {"ids": painting.pk, "fields": "title"}
+        resp = self.client.get(self.url, params)
+        self.assertIn("no-cache", resp["Cache-Control"])
+        painting.title = "Renamed"
+        painting.save()
+        resp = self.client.get(self.url, params)
+        self.assertEqual(resp.json()["results"], [{"title": "Renamed"}])
+
+    def test_payload_is_smaller_than_the_html_grid(self):
+        html = self.client.get(reverse("gallery:paintings_ajax")).content
+        full = self.client.get(self.url).content
+        sparse = self.client.get(
+            self.url, {"fields": "id,title,url,price,image"}
+        ).content
+        self.assertLess(len(full), len(html))
+        self.assertLess(len(sparse), len(full))
+
+
+class PrimaryArtistCacheTests(TransactionTestCase):
+    # Runs outside a wrapping transaction: only committed state is cached
+    def setUp(self):
+        invalidate_primary_artist()
+        self.addCleanup(invalidate_primary_artist)
+        self.artist = Artist.objects.create(name="Cecilia")
+
+    def test_saves_resolve_the_primary_artist_once(self):
+        make_painting(1)
+        with self.assertNumQueries(1):
+            painting = make_painting(2)
+        self.assertEqual(painting.artist_id, self.artist.pk)
+
+    def test_saves_in_a_transaction_use_the_cache(self):
+        with transaction.atomic():
+            make_painting(1)
+            with self.assertNumQueries(1):
+                painting = make_painting(2)
+        self.assertEqual(painting.artist_id, self.artist.pk)
+
+    def test_transaction_writing_an_artist_bypasses_the_cache(self):
+        make_painting(1)
+        with transaction.atomic():
+            self.artist.is_primary = False
+            self.artist.save()
+            successor = Artist.objects.create(name="Guest", is_primary=True)
+            self.assertEqual(make_painting(2).artist_id, successor.pk)
+            self.assertEqual(make_painting(3).artist_id, successor.pk)
+            transaction.set_rollback(True)
+        self.assertEqual(make_painting(4).artist_id, self.artist.pk)
+
+    def test_primary_artist_change_is_picked_up(self):
+        make_painting(1)
+        self.artist.is_primary = False
+        self.artist.save()
+        successor = Artist.objects.create(name="Guest", is_primary=True)
+        self.assertEqual(make_painting(2).artist_id, successor.pk)
+        successor.is_primary = False
+        successor.save()
+        self.assertIsNone(make_painting(3).artist_id)
+
+    def test_bulk_create_assigns_the_artist_once_per_batch(self):
+        paintings = [
+            Painting(
+                title=f"Bulk {i}", slug=f"bulk-{i}", price=Decimal("1"),
+                date_created=timezone.now(),
+            )
+            for i in range(25)
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            bulk_create_paintings(paintings)
+        statements = [q["sql"].split()[0] for q in ctx.captured_queries]
+        self.assertEqual(statements.count("SELECT"), 1)
+        self.assertEqual(statements.count("INSERT"), 1)
+        self.assertEqual(
+            set(Painting.objects.values_list("artist_id", flat=True)),
+            {self.artist.pk},
+        )
+
+
+class ImportPaintingsTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.media = os.path.join(self.tmp, "media")
+        for name in ("a.jpg", "b.jpg", "c.jpg"):
+            with open(os.path.join(self.tmp, name), "wb") as fh:
+                fh.write(b"image " + name.encode())
+        self.storage = FileSystemStorage(location=self.media)
+        Category.objects.create(name="Abstract", slug="abstract")
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as fh:
+            fh.write(content)
+        return path
+
+    def run_import(self, path, **kwargs):
+        importer = PaintingImporter(
+            self.storage, image_root=self.tmp,
+            state_path=f"{path}.state", batch_size=2, **kwargs
+        )
+        return importer.run(read_rows(path))
+
+    def test_csv_import_creates_images_and_category_links(self):
+        path = self.write("rows.csv", (
+            "title,price,categories,images,year\n"
+            "Dawn,120.00,abstract|Seascape,a.jpg|b.jpg,2021\n"
+            "Dusk,80,,c.jpg,\n"
+            "Noon,95,Abstract,,\n"
+        ))
+        stats = self.run_import(path)
+        self.assertEqual((stats["created"], stats["failed"]), (3, 0))
+        dawn = Painting.objects.get(slug="dawn")
+        self.assertEqual(dawn.year, 2021)
+        self.assertEqual(
+            set(dawn.categories.values_list("slug", flat=True)),
+            {"abstract", "seascape"},
+        )
+        images = list(dawn.images.order_by("display_order"))
+        self.assertEqual(len(images), 2)
+        self.assertEqual(dawn.primary_image_id, images[0].pk)
+        self.assertTrue(self.storage.exists("paintings/a.jpg"))
+        self.assertIsNone(Painting.objects.get(slug="noon").primary_image)
+        self.assertEqual(
+            Painting.objects.get(slug="noon").categories.get().slug,
+            "abstract",
+        )
+
+    def test_jsonl_import_reports_bad_rows(self):
+        path = self.write("rows.jsonl", "\n".join([
+            '{"title": "One", "price": "10", "images": ["a.jpg"]}',
+            '{"title": "", "price": "10"}',
+            '{"title": "Three", "price": "lots"}',
+            '{"title": "Four", "price": "5", "status": "lost"}',
+        ]))
+        stats = self.run_import(path)
+        self.assertEqual((stats["created"], stats["failed"]), (1, 3))
+        self.assertEqual(
+            [error.split(":")[0] for error in stats["errors"]],
+            ["row 2", "row 3", "row 4"],
+        )
+
+    def test_resume_retries_failed_rows_without_reuploading(self):
+        path = self.write("rows.csv", (
+            "title,price,images\n"
+            "Dawn,1,a.jpg\n"
+            "Dusk,1,missing.jpg\n"
+        ))
+        stats = self.run_import(path)
+        self.assertEqual((stats["created"], stats["failed"]), (1, 1))
+        self.assertIn("missing.jpg", stats["errors"][0])
+
+        self.write("missing.jpg", "late image")
+        with mock.patch.object(
+            self.storage, "save", wraps=self.storage.save
+        ) as save:
+            stats = self.run_import(path)
+        self.assertEqual(
+            (stats["created"], stats["skipped"], stats["failed"]), (1, 1, 0)
+        )
+        # Only the image that failed before is uploaded
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(
+            sorted(Painting.objects.values_list("slug", flat=True)),
+            ["dawn", "dusk"],
+        )
+
+    def test_taken_slugs_are_reported_as_failures(self):
+        make_painting(1, slug="dawn")
+        path = self.write("rows.csv", (
+            "title,price,slug\n"
+            "Dawn,1,dawn\n"
+            "Dusk,1,dusk\n"
+            "Dusk again,1,dusk\n"
+        ))
+        stats = self.run_import(path)
+        self.assertEqual(
+            (stats["created"], stats["skipped"], stats["failed"]), (1, 0, 2)
+        )
+        self.assertEqual(
+            stats["errors"],
+            ["row 2: slug 'dawn' is taken", "row 4: slug 'dusk' is taken"],
+        )
+
+    def test_resume_after_losing_the_state_does_not_duplicate_rows(self):
+        path = self.write("rows.csv", (
+            "title,price\n"
+            "Dawn,1\n"
+            "Dusk,1\n"
+            "Noon,1\n"
+        ))
+        self.run_import(path)
+        # As if the run died after committing, before saving its progress
+        with open(f"{path}.state") as fh:
+            state = json.load(fh)
+        with open(f"{path}.state", "w") as fh:
+            json.dump({**state, "done": []}, fh)
+
+        stats = self.run_import(path)
+        self.assertEqual((stats["created"], stats["skipped"]), (0, 3))
+        self.assertEqual(Painting.objects.count(), 3)
+
+    def test_command_prints_progress_and_summary(self):
+        path = self.write("rows.csv", "title,price,images\nDawn,1,a.jpg\n")
+        storages = {
+            **TEST_STORAGES,
+            "default": {
+                "BACKEND": "django.core.files.storage.FileSystemStorage",
+                "OPTIONS": {"location": self.media},
+            },
+        }
+        out = io.StringIO()
+        with override_settings(STORAGES=storages):
+            call_command("import_paintings", path, stdout=out)
+        self.assertIn(
+            "1 created, 0 already imported, 0 failed", out.getvalue()
+        )
+        self.assertTrue(os.path.exists(f"{path}.import-state.json"))
+        self.assertEqual(Painting.objects.get().images.count(), 1)
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        overrides = override_settings(DERIVATIVE_ROOT=tmp)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        derivatives.clear_lookup_cache()
+        self.addCleanup(derivatives.clear_lookup_cache)
+        patcher = mock.patch.object(cloudinary.config(), "cloud_name", "test")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def image_bytes(self, size=(1500, 100)):
+        data = io.BytesIO()
+        Image.new("RGB", size, "orange").save(data, "PNG")
+        return data.getvalue()
+
+    def render(self, source):
+        return Template(
+            "{% load image_tags %}"
+            "{% responsive_image image sizes='50vw' alt='Art' %}"
+        ).render(Context({"image": source}))
+
+    def test_variants_are_width_bucketed_and_content_addressed(self):
+        data = self.image_bytes()
+        entry = derivatives.build("cloudinary:a", data)
+        self.assertEqual(entry["widths"], [320, 640, 960, 1280, 1500])
+        for width in entry["widths"]:
+            for extension in ("avif", "webp"):
+                path = derivatives.variants_root() / derivatives.variant_name(
+                    entry["hash"], width, extension
+                )
+                self.assertTrue(path.exists(), path)
+        with Image.open(derivatives.variants_root() / derivatives.variant_name(
+            entry["hash"], 640, "webp"
+        )) as variant:
+            self.assertEqual(variant.size, (640, 43))
+
+        # The same bytes under another key reuse the files
+        files = sorted(derivatives.variants_root().rglob("*.*"))
+        other = derivatives.build("cloudinary:b", data)
+        self.assertEqual(other["hash"], entry["hash"])
+        self.assertEqual(sorted(derivatives.variants_root().rglob("*.*")),
+                         files)
+
+    def test_small_images_are_not_upscaled(self):
+        entry = derivatives.build("cloudinary:a", self.image_bytes((500, 50)))
+        self.assertEqual(entry["widths"], [320, 500])
+
+    def test_tag_uses_local_variants_once_built(self):
+        resource = CloudinaryResource("paintings/dawn", format="jpg")
+        html = self.render(resource)
+        self.assertIn("res.cloudinary.com", html)
+        self.assertIn("w_640", html)
+
+        derivatives.build_cloudinary(resource, data=self.image_bytes())
+        html = self.render(resource)
+        self.assertNotIn("cloudinary", html)
+        self.assertIn('<source type="image/avif"', html)
+        self.assertIn("-640.webp 640w", html)
+        self.assertIn('width="1500"', html)
+        self.assertIn('height="100"', html)
+        self.assertIn('sizes="50vw"', html)
+
+    def test_static_images(self):
+        self.assertIn(
+            'src="/static/images/hero.webp"', self.render("images/hero.webp")
+        )
+        entry = derivatives.build_static("images/hero.webp")
+        # Unchanged content is not rebuilt
+        with mock.patch.object(derivatives, "build") as build:
+            derivatives.build_static("images/hero.webp")
+        build.assert_not_called()
+        self.assertIn(
+            f"/derivatives/{entry['hash'][:2]}/{entry['hash']}-320.avif",
+            self.render("images/hero.webp"),
+        )
+
+    def test_variants_are_served_as_immutable(self):
+        entry = derivatives.build("cloudinary:a", self.image_bytes())
+        url = derivatives.variant_url(entry["hash"], 320, "avif")
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "image/avif")
+        self.assertIn("immutable", resp["Cache-Control"])
+        self.assertEqual(self.client.get(url + "x").status_code, 404)
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class PlaceholderTests(TestCase):
+    def setUp(self):
+        caches[CARD_CACHE_ALIAS].clear()
+        patcher = mock.patch.object(cloudinary.config(), "cloud_name", "test")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def png(self, size=(800, 600)):
+        data = io.BytesIO()
+        Image.new("RGB", size, "navy").save(data, "PNG")
+        return data.getvalue()
+
+    def test_info_is_tiny_and_keeps_the_intrinsic_size(self):
+        info = image_info(self.png())
+        self.assertEqual((info["width"], info["height"]), (800, 600))
+        self.assertTrue(
+            info["placeholder"].startswith("data:image/webp;base64,")
+        )
+        self.assertLess(len(info["placeholder"]), 400)
+
+    def test_card_inlines_the_placeholder(self):
+        painting = make_painting(1, cover_image="paintings/dawn")
+        record_image_info(painting.pk, painting.cover_image,
+                          image_info(self.png()))
+        painting.refresh_from_db()
+        self.assertEqual(
+            get_image_info(painting, painting.cover_image)["width"], 800
+        )
+        card = render_painting_cards([painting])[0]
+        self.assertIn('width="800"', card)
+        self.assertIn('height="600"', card)
+        self.assertIn("background: url(data:image/webp;base64,", card)
+
+    def test_import_records_placeholders(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        with open(os.path.join(tmp, "dawn.png"), "wb") as fh:
+            fh.write(self.png((300, 400)))
+        with open(os.path.join(tmp, "rows.csv"), "w") as fh:
+            fh.write("title,price,images\nDawn,1,dawn.png\n")
+        importer = PaintingImporter(
+            FileSystemStorage(location=os.path.join(tmp, "media")),
+            image_root=tmp,
+        )
+        importer.run(read_rows(os.path.join(tmp, "rows.csv")))
+        painting = Painting.objects.select_related("primary_image").get()
+        info = get_image_info(painting, painting.primary_image.image)
+        self.assertEqual((info["width"], info["height"]), (300, 400))
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class PopularityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.multiple(
+            popularity, FLUSH_EVENTS=1000, FLUSH_SECONDS=3600
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        caches[popularity.THROTTLE_CACHE_ALIAS].clear()
+        popularity.flush()
+        self.addCleanup(popularity.flush)
+        self.paintings = [make_painting(i) for i in range(4)]
+
+    def views(self):
+        return dict(PaintingViewCount.objects.values_list("painting", "views"))
+
+    def test_views_are_buffered_and_flushed_in_one_statement(self):
+        a, b = self.paintings[:2]
+        for painting in (a, a, b):
+            popularity.record_view(painting.pk)
+        self.assertEqual(self.views(), {})
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(popularity.flush(), 3)
+        statements = [q["sql"].split()[0] for q in ctx.captured_queries]
+        # The counters, then the totals copied to the paintings
+        self.assertEqual(
+            [s for s in statements if s in ("INSERT", "UPDATE")],
+            ["INSERT", "UPDATE"],
+        )
+        self.assertEqual(self.views(), {a.pk: 2, b.pk: 1})
+        a.refresh_from_db()
+        self.assertEqual(a.views, 2)
+
+        popularity.record_view(a.pk)
+        # A view of a painting deleted meanwhile is dropped
+        popularity.record_view(999999)
+        popularity.flush()
+        self.assertEqual(self.views(), {a.pk: 3, b.pk: 1})
+
+    def test_flush_is_due_after_enough_events(self):
+        with mock.patch.object(popularity, "FLUSH_EVENTS", 3):
+            for _ in range(2):
+                popularity.record_view(self.paintings[0].pk)
+            self.assertEqual(self.views(), {})
+            popularity.record_view(self.paintings[0].pk)
+        self.assertEqual(self.views(), {self.paintings[0].pk: 3})
+
+    def test_beacon_records_a_view(self):
+        url = reverse("gallery:painting_view", args=[self.paintings[0].pk])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(self.client.post(url).status_code, 204)
+        popularity.flush()
+        self.assertEqual(self.views(), {self.paintings[0].pk: 1})
+
+    def test_beacon_counts_a_client_once_per_window(self):
+        first, second = self.paintings[:2]
+        for _ in range(5):
+            self.client.post(
+                reverse("gallery:painting_view", args=[first.pk])
+            )
+        self.client.post(reverse("gallery:painting_view", args=[second.pk]))
+        # Another address is another client
+        self.client.post(
+            reverse("gallery:painting_view", args=[first.pk]),
+            REMOTE_ADDR="10.0.0.2",
+        )
+        popularity.flush()
+        self.assertEqual(self.views(), {first.pk: 2, second.pk: 1})
+
+    def test_popular_sort_reads_the_painting_column(self):
+        with CaptureQueriesContext(connection) as ctx:
+            paginate_paintings(Painting.objects.all(), sort="popular")
+        sql = ctx.captured_queries[0]["sql"]
+        self.assertNotIn("JOIN", sql)
+        self.assertIn('"views" DESC', sql)
+
+    def test_most_viewed_ordering_pages_through_every_painting(self):
+        first, second, third, unseen = self.paintings
+        for painting, count in ((first, 1), (second, 5), (third, 1)):
+            for _ in range(count):
+                popularity.record_view(painting.pk)
+        popularity.flush()
+
+        seen, cursor = [], None
+        while True:
+            paintings, cursor = paginate_paintings(
+                Painting.objects.all(), cursor=cursor, page_size=1,
+                sort="popular",
+            )
+            seen.extend(paintings)
+            if not cursor:
+                break
+        # Ties are broken by id, newest first
+        self.assertEqual(seen, [second, third, first, unseen])
+
+        resp = self.client.get(
+            reverse("gallery:collection"), {"sort": "popular"}
+        )
+        self.assertEqual(resp.context["paintings"][0], second)
+        self.assertEqual(resp.context["selected_sort"], "popular")
+
+    def test_cursor_must_match_the_sort(self):
+        _, cursor = paginate_paintings(Painting.objects.all(), page_size=1)
+        with self.assertRaises(InvalidCursor):
+            paginate_paintings(
+                Painting.objects.all(), cursor=cursor, sort="popular"
+            )
@@ -1,4 +1,5 @@
 from django.urls import path
+from . import api
 from . import views
 
 app_name = 'gallery'
@@ -7,6 +8,11 @@ urlpatterns = [
     path('', views.gallery_collection, name='collection'),
     path('ajax/paintings/', views.gallery_paintings_ajax,
          name='paintings_ajax'),
+    path('search/', views.painting_search, name='search'),
+    path('api/paintings/', api.PaintingListView.as_view(),
+         name='api_paintings'),
+    path('painting/<int:pk>/view/', views.record_painting_view,
+         name='painting_view'),
     path(
         'painting/<slug:slug>/',
         views.painting_detail,
@@ -1,68 +1,206 @@
+from django.db.models import Count, Max
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, DetailView  # noqa: F401
-from .models import Painting, Category, Artist  # noqa: F401
-
-
-def gallery_collection(request):
-    """Display all published paintings in the gallery."""
+from config.conditional import conditional_page
+from orders.availability import holds_version, with_held
+from .categories import in_category_tree
+from .facets import decade_filter, get_facets, price_bucket_filter
+from .models import Painting, Category, Artist, RelatedPainting  # noqa: F401
+from .models import PaintingViewCount
+from .pagination import (
+    DEFAULT_SORT, SORTS, InvalidCursor, paginate_paintings,
+)
+from .popularity import client_key, first_view, record_view
+from .search import SEARCH_RESULTS_LIMIT, search_paintings
+
+
+def filtered_paintings(request):
+    """Published paintings narrowed by the collection page facets."""
+    # Cards only need the artist and the resolved primary image, both
+    # joined in, so a page renders in a single query.
     paintings = (
         Painting.objects.filter(is_published=True)
-        .prefetch_related('images', 'categories', 'artist')
-        .order_by('-date_created')
+        .select_related('artist', 'primary_image')
     )
 
-    # Get filter parameters
     category_slug = request.GET.get('category')
     status_filter = request.GET.get('status')
+    medium = request.GET.get('medium')
+    decade = decade_filter(request.GET.get('decade'))
+    price = price_bucket_filter(request.GET.get('price'))
 
     if category_slug:
-        paintings = paintings.filter(categories__slug=category_slug)
+        # Include paintings filed under any descendant category
+        paintings = paintings.filter(in_category_tree(category_slug))
 
     if status_filter:
         paintings = paintings.filter(status=status_filter)
 
+    if medium:
+        paintings = paintings.filter(medium=medium)
+
+    if decade is not None:
+        paintings = paintings.filter(decade)
+
+    if price is not None:
+        paintings = paintings.filter(price)
+
+    return paintings
+
+
+def _sort(request):
+    sort = request.GET.get('sort')
+    return sort if sort in SORTS else DEFAULT_SORT
+
+
+def _collection_version(request):
+    """One aggregate over the catalogue plus the (cached) facets.
+
+    Any painting edit bumps the latest `updated_at` and deletions drop the
+    count; category changes surface through the facet labels and counts.
+    Cards badge paintings held by a checkout, so reservations count too
+    (`holds_version`). Sorted by popularity, the last view count flush
+    also matters. No Last-Modified is sent, as a deletion does not move
+    the timestamp.
+    """
+    catalogue = Painting.objects.aggregate(
+        latest=Max('updated_at'), count=Count('id')
+    )
+    token = (
+        catalogue['latest'], catalogue['count'], get_facets(),
+        holds_version(),
+    )
+    if _sort(request) == 'popular':
+        token += (PaintingViewCount.objects.aggregate(
+            flushed=Max('updated_at')
+        )['flushed'],)
+    return None, token
+
+
+@conditional_page(_collection_version)
+def gallery_collection(request):
+    """Display the first page of published paintings in the gallery."""
+    try:
+        paintings, next_cursor = paginate_paintings(
+            # Read what checkouts hold in the same query, for the badges
+            with_held(filtered_paintings(request)),
+            cursor=request.GET.get('cursor'),
+            sort=_sort(request),
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
+
+    category_slug = request.GET.get('category')
+    selected_category = (
+        Category.objects.filter(slug=category_slug).first()
+        if category_slug else None
+    )
+
     context = {
         'paintings': paintings,
-        'categories': Category.objects.all(),
-        'selected_category': category_slug,
-        'selected_status': status_filter,
+        'next_cursor': next_cursor,
+        'facets': get_facets(),
+        'category_breadcrumbs': (
+            selected_category.ancestors() if selected_category else []
+        ),
+        'selected_category': request.GET.get('category'),
+        'selected_status': request.GET.get('status'),
+        'selected_medium': request.GET.get('medium'),
+        'selected_decade': request.GET.get('decade'),
+        'selected_price': request.GET.get('price'),
+        'selected_sort': _sort(request),
     }
 
     return render(request, 'gallery/collection.html', context)
 
 
+# Fetched by scripts after the page loads, so no validators; the grid
+# must not come from the page cache, its badges follow reservations
+@never_cache
 def gallery_paintings_ajax(request):
-    """AJAX endpoint that returns just the paintings grid HTML."""
-    paintings = (
-        Painting.objects.filter(is_published=True)
-        .prefetch_related('images', 'categories', 'artist')
-        .order_by('-date_created')
-    )
+    """AJAX endpoint that returns one page of the paintings grid HTML.
 
-    # Get filter parameters
-    category_slug = request.GET.get('category')
-    status_filter = request.GET.get('status')
+    Pass the `cursor` from the previous page's sentinel to fetch the next
+    page; the rendered grid carries the cursor for the page after that.
+    """
+    try:
+        paintings, next_cursor = paginate_paintings(
+            # Read what checkouts hold in the same query, for the badges
+            with_held(filtered_paintings(request)),
+            cursor=request.GET.get('cursor'),
+            sort=_sort(request),
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
 
-    if category_slug:
-        paintings = paintings.filter(categories__slug=category_slug)
+    context = {
+        'paintings': paintings,
+        'next_cursor': next_cursor,
+    }
 
-    if status_filter:
-        paintings = paintings.filter(status=status_filter)
+    return render(request, 'gallery/_paintings_grid.html', context)
+
+
+def painting_search(request):
+    """Rank published paintings against the `q` search query.
+
+    The `category` and `status` filters narrow results the same way they
+    do on the collection page.
+    """
+    query = request.GET.get('q', '').strip()
+    paintings = []
+    if query:
+        paintings = list(
+            search_paintings(filtered_paintings(request), query)
+            [:SEARCH_RESULTS_LIMIT]
+        )
 
     context = {
+        'query': query,
         'paintings': paintings,
     }
 
-    return render(request, 'gallery/_paintings_grid.html', context)
+    return render(request, 'gallery/search.html', context)
+
 
+@csrf_exempt
+@require_POST
+def record_painting_view(request, pk):
+    """Beacon sent by the detail page, so cached pages count views too.
 
+    Buffered (see gallery.popularity); unknown ids are dropped on flush.
+    Repeats from the same client within the throttle window are ignored.
+    """
+    if first_view(pk, client_key(request)):
+        record_view(pk)
+    return HttpResponse(status=204)
+
+
+def _painting_detail_version(request, slug):
+    """The painting's own version plus that of its related-paintings strip."""
+    version = Painting.objects.filter(slug=slug).aggregate(
+        updated_at=Max('updated_at'),
+        related_changed=Max('recommendations__related__updated_at'),
+        related_computed=Max('recommendations__computed_at'),
+    )
+    if version['updated_at'] is None:
+        return None
+    timestamps = [value for value in version.values() if value is not None]
+    return max(timestamps), tuple(version.values())
+
+
+@conditional_page(_painting_detail_version)
 def painting_detail(request, slug):
     """Display a single painting with all its images."""
     try:
         painting = get_object_or_404(
-            Painting.objects.prefetch_related(
-                'images', 'categories', 'artist'
-            ),
+            Painting.objects.select_related(
+                'artist', 'primary_image'
+            ).prefetch_related('images', 'categories'),
             slug=slug,
         )
 
@@ -70,9 +208,20 @@ def painting_detail(request, slug):
         from django.contrib.contenttypes.models import ContentType
         painting_content_type = ContentType.objects.get_for_model(Painting)
 
+        # One indexed lookup; neighbours are refreshed offline by
+        # `manage.py refresh_related_paintings`.
+        related_paintings = [
+            row.related for row in RelatedPainting.objects.filter(
+                painting=painting, related__is_published=True
+            ).select_related(
+                'related__artist', 'related__primary_image'
+            ).order_by('rank')
+        ]
+
         context = {
             'painting': painting,
             'painting_content_type_id': painting_content_type.id,
+            'related_paintings': related_paintings,
         }
 
         return render(request, 'gallery/painting_detail.html', context)
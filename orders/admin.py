@@ -122,9 +122,9 @@ PaymentRecordAdmin.actions = [issue_refund]
 class ReservationAdmin(admin.ModelAdmin):
     list_display = (
         "user", "product_title", "quantity",
-        "expires_at", "created_at"
+        "expires_at", "released_at", "created_at"
     )
-    list_filter = ("expires_at",)
+    list_filter = ("expires_at", "released_at")
 
 
 @admin.register(models.Address)
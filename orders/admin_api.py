@@ -1,7 +1,8 @@
+import stripe
 from rest_framework import permissions, views, status
 from rest_framework.response import Response
-from django.conf import settings
 
+from . import stripe_client
 from .models import PaymentRecord
 
 
@@ -35,9 +36,6 @@ class RefundPaymentView(views.APIView):
             )
 
         try:
-            import stripe
-
-            stripe.api_key = getattr(settings, "STRIPE_SECRET_KEY", None)
             # Use model helper to perform an idempotent refund. Accept an
             # optional Idempotency-Key header.
             idempotency_key = request.META.get("HTTP_IDEMPOTENCY_KEY") or None
@@ -47,8 +45,23 @@ class RefundPaymentView(views.APIView):
                 {"refunded": True, "response": resp},
                 status=status.HTTP_200_OK
             )
+        except stripe.APIConnectionError as exc:
+            # Stripe unreachable, or the circuit is open
+            return Response(
+                {"detail": str(exc)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
         except Exception as exc:
             return Response(
                 {"detail": str(exc)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class StripeMetricsView(views.APIView):
+    """Latency and outcome counts of Stripe calls in this process."""
+
+    permission_classes = [IsStaff]
+
+    def get(self, request):
+        return Response(stripe_client.stats())
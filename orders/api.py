@@ -1,9 +1,17 @@
+import stripe
 from rest_framework import status, views
 from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from django.contrib.contenttypes.models import ContentType
-
-from .models import Order, PaymentRecord, Cart, CartItem
+from django.db import transaction
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+
+from .cart_count import remember_cart_count
+from .availability import sellable
+from .carts import add_item, get_or_create_cart, items_changed
+from .models import Order, PaymentRecord, CartItem
+from .reservations import cancel_order
 from .serializers import OrderCreateSerializer
 
 
@@ -59,6 +67,11 @@ class StartPaymentView(views.APIView):
             return Response(
                 {"detail": "Order not found"}, status=status.HTTP_404_NOT_FOUND
             )
+        if order.status == Order.STATUS_CANCELLED:
+            return Response(
+                {"detail": "Order is cancelled"},
+                status=status.HTTP_409_CONFLICT
+            )
         # Check for an idempotency key from the client to deduplicate
         # start-payment requests
         idempotency_key = request.META.get("HTTP_IDEMPOTENCY_KEY") or None
@@ -68,7 +81,7 @@ class StartPaymentView(views.APIView):
         if idempotency_key:
             existing = PaymentRecord.objects.filter(
                 order=order, idempotency_key=idempotency_key
-            ).first()
+            ).exclude(status=PaymentRecord.STATUS_FAILED).first()
             if existing:
                 return Response({
                     "payment_id": existing.pk,
@@ -90,11 +103,21 @@ class StartPaymentView(views.APIView):
 
         # Stripe expects amount in cents and lowercase currency code
         currency_code = (order.currency or "EUR").lower()
-        client_secret = payments.create_stripe_payment_intent(
-            amount=int(order.total * 100),
-            currency=currency_code,
-            metadata={"order_id": order.pk}
-        )
+        try:
+            client_secret = payments.create_stripe_payment_intent(
+                amount=int(order.total * 100),
+                currency=currency_code,
+                metadata={"order_id": order.pk}
+            )
+        except stripe.StripeError:
+            # Fail the payment and release the order's stock rather than
+            # hold it until the reservations expire
+            cancel_order(order)
+            return Response(
+                {"detail": "Payment provider unavailable; the order was "
+                           "cancelled, please check out again"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
 
         # store the client_secret for later idempotent calls
         payment.provider_client_secret = client_secret
@@ -110,9 +133,6 @@ class AddToCartView(views.APIView):
     """Add an item to the shopping cart."""
 
     def post(self, request):
-        # Get or create cart for user/session
-        cart = self._get_or_create_cart(request)
-
         # Get product info from request
         content_type_id = request.data.get('content_type_id')
         object_id = request.data.get('object_id')
@@ -172,58 +192,49 @@ class AddToCartView(views.APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Add or update cart item
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            content_type_id=content_type_id,
-            object_id=object_id,
-            defaults={
-                'product_title': product_title,
-                'product_sku': product_sku,
-                'unit_price': product_price,
-                'quantity': quantity
-            }
-        )
-
-        if not created:
-            # Update quantity if item already exists
-            cart_item.quantity += quantity
-            cart_item.save()
+        # None when the product's stock is not tracked (orders.availability)
+        available = sellable([product_sku]).get(product_sku)
+        if available is not None and quantity > available:
+            return Response(
+                {"detail": "Item is not available for purchase"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
+        # Get or create cart for user/session, then add the item or
+        # increase its quantity in one statement (orders.carts)
+        cart = get_or_create_cart(request)
+        with transaction.atomic():
+            item_id, item_quantity, unit_price = add_item(
+                cart, content_type.pk, product.pk, quantity,
+                product_title=product_title,
+                product_sku=product_sku,
+                unit_price=product_price,
+            )
+            if available is not None and item_quantity > available:
+                # Together with what the cart already has
+                transaction.set_rollback(True)
+                return Response(
+                    {"detail": f"Only {available} of this item available"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            total_items, total_price = cart.totals()
+        remember_cart_count(request, total_items)
         return Response({
-            "cart_item_id": cart_item.pk,
-            "quantity": cart_item.quantity,
-            "total_items": cart.total_items,  # type: ignore
-            "total_price": str(cart.total_price)  # type: ignore
+            "cart_item_id": item_id,
+            "quantity": item_quantity,
+            "unit_price": str(unit_price),
+            "total_items": total_items,
+            "total_price": str(total_price)
         })
 
-    def _get_or_create_cart(self, request):
-        """Get or create cart for the current user/session."""
-        if request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(
-                user=request.user,
-                defaults={}
-            )
-        else:
-            # For anonymous users, use session
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.create()
-                session_key = request.session.session_key
-
-            cart, created = Cart.objects.get_or_create(
-                session_key=session_key,
-                defaults={}
-            )
-        return cart
-
 
+@method_decorator(never_cache, name="dispatch")
 class CartView(views.APIView):
     """View and manage shopping cart contents."""
 
     def get(self, request):
         """Get cart contents."""
-        cart = self._get_cart(request)
+        cart = request.cart
         if not cart:
             return Response({
                 "items": [],
@@ -231,6 +242,7 @@ class CartView(views.APIView):
                 "total_price": "0.00"
             })
 
+        # The items come prefetched (orders.carts), totals included
         items = []
         for cart_item in cart.items.all():  # type: ignore
             items.append({
@@ -244,28 +256,14 @@ class CartView(views.APIView):
                 "object_id": cart_item.object_id
             })
 
+        total_items, total_price = cart.totals()
+        remember_cart_count(request, total_items)
         return Response({
             "items": items,
-            "total_items": cart.total_items,
-            "total_price": str(cart.total_price)
+            "total_items": total_items,
+            "total_price": str(total_price)
         })
 
-    def _get_cart(self, request):
-        """Get cart for the current user/session."""
-        if request.user.is_authenticated:
-            try:
-                return Cart.objects.get(user=request.user)
-            except Cart.DoesNotExist:
-                return None
-        else:
-            session_key = request.session.session_key
-            if session_key:
-                try:
-                    return Cart.objects.get(session_key=session_key)
-                except Cart.DoesNotExist:
-                    return None
-        return None
-
 
 class UpdateCartItemView(views.APIView):
     """Update quantity of an item in the cart."""
@@ -280,8 +278,8 @@ class UpdateCartItemView(views.APIView):
             )
 
         # Check if user owns this cart item
-        cart = self._get_cart(request)
-        if not cart or cart_item.cart != cart:
+        cart = request.cart
+        if not cart or cart_item.cart_id != cart.pk:
             return Response(
                 {"detail": "Not authorized to modify this cart item"},
                 status=status.HTTP_403_FORBIDDEN
@@ -297,39 +295,29 @@ class UpdateCartItemView(views.APIView):
         if quantity == 0:
             # Remove item if quantity is 0
             cart_item.delete()
+            items_changed(cart)
+            total_items, total_price = cart.totals()
+            remember_cart_count(request, total_items)
             return Response({
                 "removed": True,
-                "total_items": cart.total_items,
-                "total_price": str(cart.total_price)
+                "total_items": total_items,
+                "total_price": str(total_price)
             })
 
         cart_item.quantity = quantity
         cart_item.save()
+        items_changed(cart)
 
+        total_items, total_price = cart.totals()
+        remember_cart_count(request, total_items)
         return Response({
             "cart_item_id": cart_item.pk,
             "quantity": cart_item.quantity,
             "total_price": str(cart_item.total_price),
-            "cart_total_items": cart.total_items,
-            "cart_total_price": str(cart.total_price)
+            "cart_total_items": total_items,
+            "cart_total_price": str(total_price)
         })
 
-    def _get_cart(self, request):
-        """Get cart for the current user/session."""
-        if request.user.is_authenticated:
-            try:
-                return Cart.objects.get(user=request.user)
-            except Cart.DoesNotExist:
-                return None
-        else:
-            session_key = request.session.session_key
-            if session_key:
-                try:
-                    return Cart.objects.get(session_key=session_key)
-                except Cart.DoesNotExist:
-                    return None
-        return None
-
 
 class RemoveFromCartView(views.APIView):
     """Remove an item from the cart."""
@@ -344,33 +332,20 @@ class RemoveFromCartView(views.APIView):
             )
 
         # Check if user owns this cart item
-        cart = self._get_cart(request)
-        if not cart or cart_item.cart != cart:
+        cart = request.cart
+        if not cart or cart_item.cart_id != cart.pk:
             return Response(
                 {"detail": "Not authorized to modify this cart item"},
                 status=status.HTTP_403_FORBIDDEN
             )
 
         cart_item.delete()
+        items_changed(cart)
 
+        total_items, total_price = cart.totals()
+        remember_cart_count(request, total_items)
         return Response({
             "removed": True,
-            "total_items": cart.total_items,
-            "total_price": str(cart.total_price)
+            "total_items": total_items,
+            "total_price": str(total_price)
         })
-
-    def _get_cart(self, request):
-        """Get cart for the current user/session."""
-        if request.user.is_authenticated:
-            try:
-                return Cart.objects.get(user=request.user)
-            except Cart.DoesNotExist:
-                return None
-        else:
-            session_key = request.session.session_key
-            if session_key:
-                try:
-                    return Cart.objects.get(session_key=session_key)
-                except Cart.DoesNotExist:
-                    return None
-        return None
@@ -0,0 +1,180 @@
+"""How many of each SKU can still be sold.
+
+A SKU is sellable as far as its stock goes, less what live checkout
+reservations (`Reservation`, released neither by payment nor by the
+expiry sweep) hold:
+
+- a `StockItem` has its ``stock``, or, when one-of-a-kind, one unit
+  while its status is ``available``;
+- a painting (SKU ``painting-<id>``, see `Painting.sku`) is always
+  one-of-a-kind.
+
+`sellable` answers for a list of SKUs with at most one query per kind of
+product, the reservations summed per SKU in a grouped subquery. SKUs no
+product carries are not tracked and come back as ``None``.
+
+Add-to-cart and the gallery badges read the answers through a short
+cache (`CACHE_SECONDS`); checkout reads the database, under its row
+locks. Saving or deleting a reservation, stock item or painting drops
+the cached answers for its SKU (see orders.signals); bulk writes call
+`invalidate` themselves, which also takes the pre-rendered collection
+page, whose cards badge held paintings, out of service until it is
+rendered again (config.prerender).
+Listings can instead read the reservations in their own query
+(`with_held`); their conditional GET validators fold in
+`holds_version`.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (
+    CharField, Count, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value,
+)
+from django.db.models.functions import Cast, Coalesce, Concat
+from django.urls import reverse
+from django.utils import timezone
+
+from config import prerender
+from gallery.models import PAINTING_SKU_PREFIX, Painting, StockItem
+from .models import Reservation
+
+
+CACHE_PREFIX = "availability:v1"
+CACHE_SECONDS = 30
+
+
+def _key(sku):
+    return f"{CACHE_PREFIX}:{sku}"
+
+
+def painting_id(sku):
+    """The id of the painting sold under `sku`, or ``None``."""
+    if not sku.startswith(PAINTING_SKU_PREFIX):
+        return None
+    pk = sku[len(PAINTING_SKU_PREFIX):]
+    return int(pk) if pk.isdigit() else None
+
+
+def _held(sku, now):
+    """The quantity live reservations hold of `sku` (an expression)."""
+    held = (
+        Reservation.objects.filter(
+            product_sku=sku, released_at__isnull=True, expires_at__gt=now
+        )
+        .order_by()
+        .values("product_sku")
+        .annotate(total=Sum("quantity"))
+        .values("total")
+    )
+    return Coalesce(Subquery(held, output_field=IntegerField()), 0)
+
+
+def _painting_sku(pk):
+    return Concat(
+        Value(PAINTING_SKU_PREFIX),
+        Cast(pk, CharField()),
+        output_field=CharField(),
+    )
+
+
+def with_held(paintings):
+    """Annotate paintings with the quantity reservations hold as ``held``.
+
+    Lets a listing read availability in its own query (see
+    gallery.fragments).
+    """
+    return paintings.annotate(
+        held=_held(_painting_sku(OuterRef("pk")), timezone.now())
+    )
+
+
+def holds_version():
+    """A token that moves whenever what reservations hold may have.
+
+    New reservations move the latest ``created_at``, released ones the
+    latest ``released_at``, and deleted or lapsed ones (not yet swept)
+    the count of live holds.
+    """
+    holds = Reservation.objects.aggregate(
+        created=Max("created_at"),
+        released=Max("released_at"),
+        live=Count("pk", filter=Q(
+            released_at__isnull=True, expires_at__gt=timezone.now()
+        )),
+    )
+    return holds["created"], holds["released"], holds["live"]
+
+
+def _query(skus):
+    now = timezone.now()
+    supply, held = {}, {}
+    paintings = {painting_id(sku): sku for sku in skus}
+    paintings.pop(None, None)
+    stock_skus = set(skus) - set(paintings.values())
+    if stock_skus:
+        rows = (
+            StockItem.objects.filter(sku__in=stock_skus)
+            .annotate(held=_held(OuterRef("sku"), now))
+            .values_list("sku", "is_unique", "status", "stock", "held")
+        )
+        for sku, is_unique, status, stock, reserved in rows:
+            if is_unique:
+                stock = int(status == StockItem.STATUS_AVAILABLE)
+            supply[sku] = supply.get(sku, 0) + stock
+            held[sku] = reserved
+
+    if paintings:
+        rows = (
+            with_held(Painting.objects.filter(pk__in=paintings))
+            .values_list("pk", "status", "held")
+        )
+        for pk, status, reserved in rows:
+            supply[paintings[pk]] = int(status == "available")
+            held[paintings[pk]] = reserved
+
+    return {
+        sku: max(supply[sku] - held[sku], 0) if sku in supply else None
+        for sku in skus
+    }
+
+
+def sellable(skus, use_cache=True):
+    """Map each of `skus` to the quantity that can be sold, or ``None``.
+
+    With `use_cache` false the database is read, e.g. under the row
+    locks of checkout.
+    """
+    skus = list(dict.fromkeys(sku for sku in skus if sku))
+    if not use_cache:
+        return _query(skus)
+    cached = cache.get_many([_key(sku) for sku in skus])
+    found = {
+        sku: cached[_key(sku)] for sku in skus if _key(sku) in cached
+    }
+    missing = [sku for sku in skus if sku not in found]
+    if missing:
+        fresh = _query(missing)
+        cache.set_many(
+            {_key(sku): value for sku, value in fresh.items()},
+            CACHE_SECONDS,
+        )
+        found.update(fresh)
+    return found
+
+
+def invalidate(skus):
+    """Drop the cached availability of `skus`.
+
+    Dropped again once the current transaction commits, so a read made
+    before the commit is not cached for long.
+    """
+    skus = {sku for sku in skus if sku}
+    if not skus:
+        return
+
+    keys = [_key(sku) for sku in skus]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+    if any(painting_id(sku) for sku in skus):
+        prerender.schedule(reverse("gallery:collection"))
+
@@ -0,0 +1,72 @@
+"""The cart badge count, kept in a signed cookie.
+
+Every page shows the number of items in the cart. Rather than look the
+cart up for each page, the count is stored in the ``cart_count`` cookie
+whenever a cart endpoint changes the cart (`remember_cart_count`), and
+`CartCountMiddleware` writes it to the response. The cookie is readable
+by the page script, so the badge is drawn straight from it, which also
+works on cached and pre-rendered pages.
+
+The signature is salted with the session key. Logging in or out rotates
+the key, and the cookie is dropped then too (see orders.signals), so a
+count never outlives the cart it was computed for. When there is no
+valid cookie, ``/orders/cart/count/`` computes the count once and sets
+it.
+"""
+
+from django.conf import settings
+
+
+COOKIE_NAME = "cart_count"
+SALT = "orders.cart_count"
+
+_FORGET = object()
+
+
+def _salt(request):
+    return f"{SALT}:{request.session.session_key or ''}"
+
+
+def read_cart_count(request):
+    """The count from a valid cookie, or ``None``."""
+    value = request.get_signed_cookie(
+        COOKIE_NAME, default=None, salt=_salt(request)
+    )
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def remember_cart_count(request, count):
+    """Have the response carry `count` as the cart count."""
+    # DRF wraps the request; the middleware sees the Django one
+    getattr(request, "_request", request).cart_count = count
+
+
+def forget_cart_count(request):
+    """Have the response drop the cart count cookie."""
+    getattr(request, "_request", request).cart_count = _FORGET
+
+
+class CartCountMiddleware:
+    """Write the count set by `remember_cart_count` to the cookie."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        count = getattr(request, "cart_count", None)
+        if count is _FORGET:
+            response.delete_cookie(COOKIE_NAME, samesite="Lax")
+        elif count is not None:
+            response.set_signed_cookie(
+                COOKIE_NAME,
+                str(count),
+                salt=_salt(request),
+                max_age=settings.SESSION_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                samesite="Lax",
+            )
+        return response
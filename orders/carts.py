@@ -0,0 +1,238 @@
+"""The visitor's cart, looked up once per request.
+
+`CartMiddleware` sets ``request.cart`` to a lazy object, the way
+``request.user`` is set: the cart of the logged-in user, or of the
+anonymous session, is only queried when a view first uses it, and at
+most once per request. It comes with its items and their products
+prefetched, so listing the cart and summing it (`Cart.totals`) need no
+further queries. ``request.cart`` is falsy when the visitor has no cart.
+
+A view that changes the items afterwards calls `items_changed` so the
+totals are read from the database again. `add_item` adds a product with
+a single upsert, so concurrent adds to the same line are never lost.
+
+Logging in gives the session a new key, so an anonymous cart is also
+remembered in the session data (`CART_SESSION_KEY`);
+`merge_session_cart` uses it to fold that cart into the user's.
+
+Anonymous carts left behind are deleted by `prune_carts`
+(``manage.py prune_carts``).
+"""
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from .models import CENTS, Cart, CartItem
+
+
+CART_PREFETCH = ("items__product_object",)
+CART_SESSION_KEY = "orders_cart_id"
+
+
+def _django_request(request):
+    # DRF wraps the request; the cache lives on the Django one
+    return getattr(request, "_request", request)
+
+
+def _find_cart(request):
+    carts = Cart.objects.prefetch_related(*CART_PREFETCH)
+    if request.user.is_authenticated:
+        return carts.filter(user=request.user).first()
+    session_key = request.session.session_key
+    if not session_key:
+        return None
+    cart = carts.filter(session_key=session_key).first()
+    if cart is not None:
+        # Carts from before the id was kept in the session
+        request.session.setdefault(CART_SESSION_KEY, cart.pk)
+    return cart
+
+
+def get_cart(request):
+    """The visitor's cart, or ``None``; queried once per request."""
+    request = _django_request(request)
+    if not hasattr(request, "_cached_cart"):
+        request._cached_cart = _find_cart(request)
+    return request._cached_cart
+
+
+def get_or_create_cart(request):
+    """The visitor's cart, created (with a session if need be) if missing.
+
+    Unlike ``request.cart`` the items are not prefetched, unless the cart
+    was already resolved.
+    """
+    request = _django_request(request)
+    cart = getattr(request, "_cached_cart", None)
+    if cart is not None:
+        return cart
+    if request.user.is_authenticated:
+        cart, _ = Cart.objects.get_or_create(user=request.user)
+    else:
+        if not request.session.session_key:
+            request.session.create()
+        cart, _ = Cart.objects.get_or_create(
+            session_key=request.session.session_key
+        )
+        request.session[CART_SESSION_KEY] = cart.pk
+    request._cached_cart = cart
+    request.cart = cart
+    return cart
+
+
+def add_item(cart, content_type_id, object_id, quantity, **snapshot):
+    """Add `quantity` of a product to `cart` in one statement.
+
+    An insert that adds to the quantity of the product's line when the
+    cart already has one, so concurrent adds are never lost. `snapshot`
+    holds the line's ``product_title``, ``product_sku`` and
+    ``unit_price``, used for a new line only. Returns the line's
+    ``(id, quantity, unit_price)``.
+    """
+    fields = {
+        "cart_id": cart.pk,
+        "content_type_id": content_type_id,
+        "object_id": object_id,
+        "product_title": snapshot["product_title"],
+        "product_sku": snapshot.get("product_sku") or "",
+        "unit_price": snapshot["unit_price"],
+        "quantity": quantity,
+        "created_at": timezone.now(),
+    }
+    fields["updated_at"] = fields["created_at"]
+    opts = CartItem._meta
+    params = [
+        opts.get_field(name).get_db_prep_save(value, connection)
+        for name, value in fields.items()
+    ]
+    columns = ", ".join(
+        connection.ops.quote_name(opts.get_field(name).column)
+        for name in fields
+    )
+    table = connection.ops.quote_name(opts.db_table)
+    sql = (
+        f"INSERT INTO {table} ({columns}) "
+        f"VALUES ({', '.join(['%s'] * len(params))}) "
+        f"ON CONFLICT (cart_id, content_type_id, object_id) DO UPDATE SET "
+        f"quantity = {table}.quantity + excluded.quantity, "
+        f"updated_at = excluded.updated_at "
+        f"RETURNING id, quantity, unit_price"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        item_id, total, unit_price = cursor.fetchone()
+    items_changed(cart)
+    unit_price = opts.get_field("unit_price").to_python(unit_price)
+    return item_id, total, unit_price.quantize(CENTS)
+
+
+def merge_session_cart(request, user):
+    """Fold the session's anonymous cart into `user`'s cart.
+
+    Runs in a constant number of queries: without a user cart the
+    session cart is handed to the user, otherwise its lines are added to
+    the user's with one upsert, summing the quantities of products in
+    both, and the session cart is deleted.
+    """
+    cart_id = request.session.pop(CART_SESSION_KEY, None)
+    if cart_id is None:
+        return
+    with transaction.atomic():
+        session_cart = Cart.objects.filter(pk=cart_id, user__isnull=True)
+        user_cart = Cart.objects.filter(user=user).first()
+        if user_cart is None:
+            session_cart.update(user=user, session_key=None)
+        else:
+            _move_items(cart_id, user_cart.pk)
+            session_cart.delete()
+    request = _django_request(request)
+    request.__dict__.pop("_cached_cart", None)
+    request.cart = SimpleLazyObject(lambda: get_cart(request))
+
+
+def _move_items(from_cart_id, to_cart_id):
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    columns = (
+        "content_type_id, object_id, product_title, product_sku, "
+        "unit_price, quantity, created_at"
+    )
+    sql = (
+        f"INSERT INTO {table} (cart_id, {columns}, updated_at) "
+        f"SELECT %s, {columns}, %s FROM {table} WHERE cart_id = %s "
+        f"ON CONFLICT (cart_id, content_type_id, object_id) DO UPDATE SET "
+        f"quantity = {table}.quantity + excluded.quantity, "
+        f"updated_at = excluded.updated_at"
+    )
+    now = CartItem._meta.get_field("updated_at").get_db_prep_save(
+        timezone.now(), connection
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [to_cart_id, now, from_cart_id])
+
+
+def prune_carts(before, batch_size=500):
+    """Delete anonymous carts unused since `before`, in batches.
+
+    A cart counts as used when it or one of its items was updated. The
+    carts are walked in ``(updated_at, id)`` order, a batch at a time,
+    and each batch is deleted in its own short transaction; carts in use
+    by a request at that moment (row locked) are skipped, and the DELETEs
+    themselves check again that each cart is unused (and empty, for the
+    cart row). Yields the ``(carts, items)`` deleted by each batch.
+    """
+    recent_items = CartItem.objects.filter(
+        cart=OuterRef("pk"), updated_at__gte=before
+    )
+    abandoned = Cart.objects.filter(
+        user__isnull=True, updated_at__lt=before
+    ).exclude(Exists(recent_items))
+    after = Q()
+    while True:
+        keys = list(
+            abandoned.filter(after).order_by("updated_at", "id")
+            .values_list("updated_at", "id")[:batch_size]
+        )
+        if not keys:
+            return
+        last_updated, last_id = keys[-1]
+        after = Q(updated_at__gt=last_updated) | Q(
+            updated_at=last_updated, id__gt=last_id
+        )
+        with transaction.atomic():
+            # Checked again under the lock: a cart may have been used
+            # since the batch was read
+            ids = list(
+                abandoned.filter(pk__in=[pk for _, pk in keys])
+                .select_for_update(skip_locked=True)
+                .values_list("pk", flat=True)
+            )
+            # Adding to an existing line updates only the item, which the
+            # cart lock does not block, so each DELETE repeats the checks:
+            # items go only while their cart is still abandoned, and a
+            # cart only once it is empty
+            unused = abandoned.filter(pk__in=ids)
+            items, _ = CartItem.objects.filter(cart__in=unused).delete()
+            carts = unused.exclude(
+                Exists(CartItem.objects.filter(cart=OuterRef("pk")))
+            ).delete()[1].get(Cart._meta.label, 0)
+        yield carts, items
+
+
+def items_changed(cart):
+    """Drop the prefetched items of `cart` after changing them."""
+    if "items" in getattr(cart, "_prefetched_objects_cache", {}):
+        # Clears the prefetched relation without a query
+        cart.refresh_from_db(fields=["items"])
+
+
+class CartMiddleware:
+    """Set ``request.cart`` to the visitor's cart, resolved lazily."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cart = SimpleLazyObject(lambda: get_cart(request))
+        return self.get_response(request)
@@ -0,0 +1,61 @@
+"""Delete abandoned anonymous carts (see orders.carts.prune_carts).
+
+Usage: python manage.py prune_carts [--days N] [--batch-size 500]
+           [--pause 0.1]
+
+By default carts unused for longer than a session lasts
+(SESSION_COOKIE_AGE) are deleted, as no visitor can reach them any more.
+Each batch is its own short transaction, so this is safe to run every
+few minutes alongside live traffic.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.carts import prune_carts
+
+
+class Command(BaseCommand):
+    help = "Delete anonymous carts that have not been used for a while"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float,
+            default=settings.SESSION_COOKIE_AGE / 86400,
+            help="Delete carts unused for this many days "
+                 "(default: the session lifetime)",
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--pause', type=float, default=0.1,
+            help="Seconds to wait between batches",
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        before = timezone.now() - timedelta(days=options['days'])
+        started = batch_started = time.monotonic()
+        total_carts = total_items = 0
+        for number, (carts, items) in enumerate(
+            prune_carts(before, options['batch_size']), start=1
+        ):
+            total_carts += carts
+            total_items += items
+            self.stdout.write(
+                f"Batch {number}: {carts} carts, {items} items deleted "
+                f"in {time.monotonic() - batch_started:.2f}s"
+            )
+            time.sleep(options['pause'])
+            batch_started = time.monotonic()
+
+        elapsed = time.monotonic() - started
+        rate = total_carts / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{total_carts} carts and {total_items} items deleted "
+            f"in {elapsed:.1f}s ({rate:.0f} carts/s)"
+        ))
@@ -0,0 +1,38 @@
+"""Release expired stock reservations (see orders.reservations).
+
+Usage: python manage.py release_reservations [--batch-size 500]
+
+Run it every few minutes (e.g. from cron) so items from abandoned
+checkouts become available again soon after their reservation expires.
+Items an unpaid order left reserved without a reservation are released
+too; items reserved by hand are not touched.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.reservations import release_expired, release_unreferenced
+
+
+class Command(BaseCommand):
+    help = "Release expired reservations and their reserved stock items"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        now = timezone.now()
+        reservations = items = 0
+        for released, freed in release_expired(options['batch_size'], now):
+            reservations += released
+            items += freed
+            self.stdout.write(
+                f"Released {released} reservations, {freed} items"
+            )
+        items += release_unreferenced(now)
+        self.stdout.write(self.style.SUCCESS(
+            f"{reservations} reservations released, "
+            f"{items} items available again"
+        ))
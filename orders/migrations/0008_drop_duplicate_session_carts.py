@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-16 23:17
+
+from django.db import migrations, models
+
+
+def drop_duplicate_session_carts(apps, schema_editor):
+    """Keep only the most recently updated cart of each session."""
+    Cart = apps.get_model('orders', 'Cart')
+    duplicated = (
+        Cart.objects.exclude(session_key=None).values('session_key')
+        .annotate(carts=models.Count('id')).filter(carts__gt=1)
+        .values_list('session_key', flat=True)
+    )
+    for session_key in list(duplicated):
+        carts = Cart.objects.filter(session_key=session_key)
+        newest = carts.order_by('-updated_at', '-id').first()
+        carts.exclude(pk=newest.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_cart_cartitem_cart_cart_user_or_session_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            drop_duplicate_session_carts, migrations.RunPython.noop
+        ),
+    ]
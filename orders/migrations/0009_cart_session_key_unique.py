@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-16 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_drop_duplicate_session_carts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='session_key',
+            field=models.CharField(blank=True, help_text='For anonymous users', max_length=40, null=True, unique=True),
+        ),
+    ]
@@ -3,13 +3,21 @@ Models for the orders app.
 """
 # pylint: disable=no-member
 
+from decimal import Decimal
+
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models import F, Sum
 from django.utils import timezone
 
 
+CENTS = Decimal("0.01")
+# How long checkout holds reserved stock
+RESERVATION_HOURS = 4
+
+
 class Address(models.Model):
     """Model for shipping or billing addresses associated with an order."""
     SHIPPING = "shipping"
@@ -217,27 +225,21 @@ class PaymentRecord(models.Model):
                 "Refunds only implemented for stripe in this helper"
             )
 
-        # Local import to avoid hard dependency at module import time
-        import stripe  # pylint: disable=import-outside-toplevel
-        # pylint: disable-next=redefined-outer-name,reimported
         # pylint: disable-next=import-outside-toplevel
-        from django.conf import settings
-
-        stripe.api_key = getattr(settings, "STRIPE_SECRET_KEY", None)
+        from .stripe_client import get_client
 
         # Prepare refund params
         refund_kwargs = {"charge": self.provider_payment_id}
         if amount is not None:
-            refund_kwargs["amount"] = str(int(amount * 100))
+            refund_kwargs["amount"] = int(amount * 100)
 
         # Use idempotency key via header if provided
         stripe_request_opts = {}
         if idempotency_key:
             stripe_request_opts = {"idempotency_key": idempotency_key}
 
-        resp = stripe.Refund.create(
-            **refund_kwargs,
-            **stripe_request_opts
+        resp = get_client().v1.refunds.create(
+            params=refund_kwargs, options=stripe_request_opts
         )
 
         # Attempt to extract a refund id from response
@@ -261,9 +263,11 @@ class PaymentRecord(models.Model):
 
 class Reservation(models.Model):
     """Model for item reservations during checkout."""
-    # Reservations lock items for a user during checkout
+    # Reservations lock items for a user (or guest) during checkout
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
         on_delete=models.CASCADE,
         related_name="reservations"
     )
@@ -290,11 +294,30 @@ class Reservation(models.Model):
     product_sku = models.CharField(max_length=64, blank=True)
     quantity = models.PositiveIntegerField(default=1)
     expires_at = models.DateTimeField()
+    # Set once the reservation no longer holds stock: it expired and was
+    # swept (orders.reservations), or its order was paid
+    released_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Expiry sweep (see orders.reservations)
+            models.Index(
+                fields=['expires_at', 'id'],
+                condition=models.Q(released_at__isnull=True),
+                name='reservation_pending_idx',
+            ),
+            # Stock held per SKU
+            models.Index(
+                fields=['product_sku', 'expires_at'],
+                condition=models.Q(released_at__isnull=True),
+                name='reservation_sku_idx',
+            ),
+        ]
+
     @classmethod
     def create_reservation(cls, user, product_title, product_sku,
-                           quantity=1, hours=4, **kwargs):
+                           quantity=1, hours=RESERVATION_HOURS, **kwargs):
         # pylint: disable=too-many-arguments,too-many-positional-arguments
         """Create a new reservation with default expiration."""
         expires = timezone.now() + timezone.timedelta(hours=hours)
@@ -309,7 +332,7 @@ class Reservation(models.Model):
 
     def is_active(self):
         """Check if the reservation is still active."""
-        return timezone.now() < self.expires_at
+        return self.released_at is None and timezone.now() < self.expires_at
 
 
 class ProcessedEvent(models.Model):
@@ -336,6 +359,7 @@ class Cart(models.Model):
         max_length=40,
         null=True,
         blank=True,
+        unique=True,
         help_text="For anonymous users"
     )
     created_at = models.DateTimeField(auto_now_add=True)
@@ -351,23 +375,57 @@ class Cart(models.Model):
                 name="cart_user_or_session"
             )
         ]
+        indexes = [
+            # Pruning abandoned anonymous carts (see orders.carts)
+            models.Index(
+                fields=['updated_at', 'id'],
+                condition=models.Q(user__isnull=True),
+                name='cart_anonymous_updated_idx',
+            ),
+        ]
 
     def __str__(self):
         if self.user:
             return f"Cart for {self.user.username}"
         return f"Cart for session {self.session_key}"
 
+    def totals(self):
+        """Return ``(total_items, total_price)`` for the cart.
+
+        Summed from the items when they have been prefetched, otherwise
+        with a single aggregate query.
+        """
+        prefetched = getattr(self, "_prefetched_objects_cache", {})
+        if "items" in prefetched:
+            items = prefetched["items"]
+            return (
+                sum(item.quantity for item in items),
+                sum((item.total_price for item in items), Decimal("0"))
+                .quantize(CENTS),
+            )
+        totals = self.items.aggregate(  # type: ignore
+            total_items=Sum("quantity"),
+            total_price=Sum(
+                F("unit_price") * F("quantity"),
+                output_field=models.DecimalField(
+                    max_digits=12, decimal_places=2
+                ),
+            ),
+        )
+        return (
+            totals["total_items"] or 0,
+            (totals["total_price"] or Decimal("0")).quantize(CENTS),
+        )
+
     @property
     def total_items(self):
         """Get total number of items in cart."""
-        return sum(item.quantity for item in self.items.all())  # type: ignore
+        return self.totals()[0]
 
     @property
     def total_price(self):
         """Get total price of all items in cart."""
-        return sum(
-            item.total_price for item in self.items.all()  # type: ignore
-        )
+        return self.totals()[1]
 
 
 class CartItem(models.Model):
@@ -2,6 +2,8 @@ import logging
 
 from django.conf import settings
 
+from .stripe_client import get_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,37 +15,24 @@ def create_stripe_payment_intent(
     """Create a Stripe PaymentIntent and return the client_secret.
 
     amount is in cents.
-    This function expects `stripe` to be installed and
-    `settings.STRIPE_SECRET_KEY` to be set.
-    In the absence of stripe (or in tests) it will return a fake client secret.
+    Goes through the shared client (orders.stripe_client); a failure
+    raises `stripe.StripeError` (`APIConnectionError` when Stripe cannot
+    be reached or the circuit is open) for the caller to report.
     """
-    try:
-        import stripe
-
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        intent = stripe.PaymentIntent.create(
-            amount=amount,
-            currency=currency,
-            metadata=metadata or {}
-        )
-        return intent.client_secret or "test_client_secret"
-    except Exception as exc:
-        logger.exception(
-            "Stripe not available or failed to create intent: %s", exc)
-        # Fallback for local development / tests
-        return "test_client_secret"
+    intent = get_client().v1.payment_intents.create(params={
+        "amount": amount,
+        "currency": currency,
+        "metadata": metadata or {},
+    })
+    return intent.client_secret
 
 
 def verify_stripe_event(payload: bytes, sig_header: str) -> dict | None:
     """Verify and parse a Stripe webhook event.
     Returns the event dict or None on failure."""
     try:
-        import stripe
-
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        event = stripe.Webhook.construct_event(
+        return get_client().construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET)
-        return event
     except Exception:
         logger.exception("Failed to verify stripe webhook event")
         return None
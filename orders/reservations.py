@@ -0,0 +1,133 @@
+"""Releasing expired stock reservations.
+
+Creating an order reserves its stock items for `RESERVATION_HOURS`
+(orders.serializers): a `Reservation` per item and, for one-of-a-kind
+items, the `StockItem` status flipped to ``reserved``. Once a
+reservation expires unpaid it is released here, so the item can be
+sold again.
+
+``manage.py release_reservations`` walks the unreleased, expired
+reservations through the ``reservation_pending_idx`` partial index a
+batch at a time, so released rows are never read again. Each batch
+returns its reserved items to ``available`` with one conditional
+UPDATE, skipping items still held by another live reservation, and
+marks the batch released, then drops the cached availability of the
+batch's SKUs (orders.availability). Items left ``reserved`` without any
+reservation by an unpaid order (one placed before reservations were
+recorded) are released once they have been reserved for
+`RESERVATION_HOURS`; items reserved by hand, on no order, or sold on a
+paid order are left alone. Those rows are locked as they are read and
+skipped if another run holds them, and only the rows read are updated.
+
+`cancel_order` releases an order's reservations at once, e.g. when its
+payment cannot be started, rather than leave them to expire.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from gallery.models import StockItem
+from .availability import invalidate
+from .models import (
+    RESERVATION_HOURS, Order, OrderItem, PaymentRecord, Reservation,
+)
+
+
+def _release(reservations, skus, now):
+    """Release `reservations`, of `skus`, and the items only they hold.
+
+    Returns how many ``(reservations, items)`` were released.
+    """
+    still_held = Reservation.objects.filter(
+        product_sku=OuterRef("sku"),
+        released_at__isnull=True,
+        expires_at__gt=now,
+    ).exclude(pk__in=reservations.values("pk"))
+    items = StockItem.objects.filter(
+        sku__in=skus,
+        is_unique=True,
+        status=StockItem.STATUS_RESERVED,
+    ).exclude(Exists(still_held)).update(
+        status=StockItem.STATUS_AVAILABLE, updated_at=now
+    )
+    released = reservations.update(released_at=now)
+    invalidate(skus)
+    return released, items
+
+
+def release_expired(batch_size=500, now=None):
+    """Release reservations expired by `now`, in batches.
+
+    Yields the ``(reservations, items)`` released by each batch.
+    """
+    now = now or timezone.now()
+    expired = Reservation.objects.filter(
+        released_at__isnull=True, expires_at__lte=now
+    )
+    while True:
+        with transaction.atomic():
+            batch = list(
+                expired.order_by("expires_at", "id")
+                .select_for_update(skip_locked=True)
+                .values_list("id", "product_sku")[:batch_size]
+            )
+            if not batch:
+                return
+            released, items = _release(
+                Reservation.objects.filter(pk__in=[pk for pk, _ in batch]),
+                {sku for _, sku in batch if sku},
+                now,
+            )
+        yield released, items
+
+
+def cancel_order(order, now=None):
+    """Cancel unpaid `order`, failing its pending payments and releasing
+    its reservations; returns the ``(reservations, items)`` released."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        order.status = Order.STATUS_CANCELLED
+        order.save(update_fields=["status", "updated_at"])
+        order.payments.filter(status=PaymentRecord.STATUS_PENDING).update(
+            status=PaymentRecord.STATUS_FAILED
+        )
+        held = order.reservations.filter(released_at__isnull=True)
+        return _release(
+            held, set(held.exclude(product_sku="").values_list(
+                "product_sku", flat=True
+            )), now,
+        )
+
+
+def release_unreferenced(now=None):
+    """Release items reserved by unpaid orders that no reservation holds;
+    returns how many."""
+    now = now or timezone.now()
+    held = Reservation.objects.filter(
+        product_sku=OuterRef("sku"), released_at__isnull=True
+    )
+    ordered = OrderItem.objects.filter(product_sku=OuterRef("sku"))
+    paid = PaymentRecord.objects.filter(
+        order=OuterRef("order"), status=PaymentRecord.STATUS_SUCCEEDED
+    )
+    stale = StockItem.objects.filter(
+        Exists(ordered),
+        is_unique=True,
+        status=StockItem.STATUS_RESERVED,
+        updated_at__lt=now - timedelta(hours=RESERVATION_HOURS),
+    ).exclude(Exists(ordered.filter(Exists(paid)))).exclude(Exists(held))
+    with transaction.atomic():
+        rows = list(
+            stale.select_for_update(skip_locked=True)
+            .values_list("pk", "sku")
+        )
+        if not rows:
+            return 0
+        released = StockItem.objects.filter(
+            pk__in=[pk for pk, _ in rows]
+        ).update(status=StockItem.STATUS_AVAILABLE, updated_at=now)
+        invalidate({sku for _, sku in rows if sku})
+    return released
@@ -1,8 +1,13 @@
+from datetime import timedelta
 from decimal import Decimal
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import Order, OrderItem, Address
+from .availability import invalidate, painting_id, sellable
+from .models import (
+    RESERVATION_HOURS, Address, Order, OrderItem, Reservation,
+)
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
@@ -105,16 +110,23 @@ class OrderCreateSerializer(serializers.ModelSerializer):
 
             # Reserve single-item StockItems if applicable and snapshot
             # product status
-            from gallery.models import StockItem
+            from gallery.models import Painting, StockItem
 
             # collect SKUs from request
             skus = [it.get("product_sku")
                     for it in items_data if it.get("product_sku")]
-            sku_map = {}
+            sku_map, painting_map = {}, {}
             if skus:
                 products = list(
                     StockItem.objects.select_for_update().filter(sku__in=skus))
                 sku_map = {p.sku: p for p in products}
+                paintings = list(
+                    Painting.objects.select_for_update().filter(
+                        pk__in=[painting_id(sku) for sku in skus]
+                    )
+                )
+                painting_map = {p.sku: p for p in paintings}
+                self._check_availability(items_data, skus)
 
             order = Order.objects.create(**validated_data)
             if shipping:
@@ -124,22 +136,74 @@ class OrderCreateSerializer(serializers.ModelSerializer):
                 Address.objects.create(
                     order=order, address_type=Address.BILLING, **billing)
 
+            # Held until paid, or released by the expiry sweep
+            # (orders.reservations)
+            reservations = []
+            expires_at = timezone.now() + timedelta(hours=RESERVATION_HOURS)
             for it in items_data:
                 sku = it.get("product_sku")
                 prod_status = None
-                if sku:
+                if sku in painting_map:
+                    # Held by the reservation alone; the painting is
+                    # marked sold once paid (orders.webhooks)
+                    prod_status = painting_map[sku].status
+                    reservations.append(Reservation(
+                        user=validated_data.get("user"),
+                        order=order,
+                        product_title=it.get("product_title", ""),
+                        product_sku=sku,
+                        quantity=int(it.get("quantity", 1)),
+                        expires_at=expires_at,
+                    ))
+                elif sku:
                     p = sku_map.get(sku)
                     if p:
                         qty = int(it.get("quantity", 1))
+                        held = True
                         # If single-item painting treat reservation as status
                         # flip only when qty == 1
                         if getattr(p, 'is_unique', False):
-                            if qty == 1 and p.status == 'available':
+                            held = qty == 1 and p.status == 'available'
+                            if held:
                                 p.status = 'reserved'
                                 p.save()
                         # snapshot after any potential change
                         prod_status = p.status
+                        if held:
+                            reservations.append(Reservation(
+                                user=validated_data.get("user"),
+                                order=order,
+                                product_title=it.get("product_title", ""),
+                                product_sku=sku,
+                                quantity=qty,
+                                expires_at=expires_at,
+                            ))
                 OrderItem.objects.create(
                     order=order, product_status=prod_status, **it)
+            Reservation.objects.bulk_create(reservations)
+            # bulk_create sends no post_save
+            invalidate(r.product_sku for r in reservations)
 
         return order
+
+    def _check_availability(self, items_data, skus):
+        """Reject lines asking for more than can be sold.
+
+        Read under the row locks taken by `create`, so two checkouts
+        cannot both take the last unit.
+        """
+        wanted = {}
+        for it in items_data:
+            sku = it.get("product_sku")
+            if sku:
+                wanted[sku] = wanted.get(sku, 0) + int(it.get("quantity", 1))
+        available = sellable(skus, use_cache=False)
+        errors = {}
+        for i, it in enumerate(items_data):
+            sku = it.get("product_sku")
+            if available.get(sku) is not None and (
+                wanted[sku] > available[sku]
+            ):
+                errors[i] = f"Only {available[sku]} of this item available"
+        if errors:
+            raise serializers.ValidationError({"items": errors})
@@ -0,0 +1,45 @@
+"""Carry the visitor's cart over logins, and keep availability fresh.
+
+The anonymous cart is merged into the user's (orders.carts) and the cart
+badge cookie (orders.cart_count) is dropped. Changes to reservations,
+stock items and paintings drop their cached availability
+(orders.availability).
+"""
+
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from gallery.models import Painting, StockItem
+from .availability import invalidate
+from .cart_count import forget_cart_count
+from .carts import merge_session_cart
+from .models import Reservation
+
+
+@receiver(user_logged_in)
+@receiver(user_logged_out)
+def reset_cart_count(sender, request, **kwargs):
+    # The visitor now has another cart
+    if request is not None:
+        forget_cart_count(request)
+
+
+@receiver(user_logged_in)
+def merge_cart(sender, request, user, **kwargs):
+    if request is not None:
+        merge_session_cart(request, user)
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+def reservation_changed(sender, instance, **kwargs):
+    invalidate([instance.product_sku])
+
+
+@receiver(post_save, sender=StockItem)
+@receiver(post_delete, sender=StockItem)
+@receiver(post_save, sender=Painting)
+@receiver(post_delete, sender=Painting)
+def stock_changed(sender, instance, **kwargs):
+    invalidate([instance.sku])
@@ -0,0 +1,271 @@
+"""The one Stripe client every payment call goes through.
+
+`get_client` returns a `stripe.StripeClient`, built once per process from
+the settings, instead of each caller setting the global ``stripe.api_key``
+and using Stripe's default HTTP client (no timeout to speak of):
+
+- connections are kept alive in one pool of `POOL_SIZE`, shared by the
+  worker's threads;
+- every attempt is bounded by `CONNECT_TIMEOUT` and `READ_TIMEOUT`;
+- connection errors, timeouts and 5xx answers are retried up to
+  `MAX_RETRIES` times, after a randomised ("full jitter") backoff, so
+  workers that failed together do not retry together. Stripe adds an
+  idempotency key to every POST when retries are on, so a retried
+  payment is never made twice. The worst case (three slow attempts)
+  stays under gunicorn's 30 second worker timeout;
+- after `BREAKER_THRESHOLD` calls in a row fail that way, the circuit
+  opens: calls fail at once with `stripe.APIConnectionError` for
+  `BREAKER_COOLDOWN` seconds, rather than tie up workers waiting on an
+  outage, and then one call is let through to test the water.
+
+Each attempt's latency and outcome are kept in `metrics`; staff can read
+them, with the state of the circuit (`stats`), at
+``/orders/stripe/metrics/``. `STRIPE_API_BASE` points
+the client elsewhere, e.g. at a local fake Stripe in tests.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 2
+READ_TIMEOUT = 6
+MAX_RETRIES = 2
+BACKOFF_SECONDS = 0.25
+BACKOFF_MAX_SECONDS = 2
+POOL_SIZE = 10
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+# Latencies kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+class CircuitBreaker:
+    """Fail fast after `threshold` failures in a row, for `cooldown`s."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD,
+                 cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or (
+                time.monotonic() - self._opened_at >= self.cooldown
+            ):
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        """Whether a call may go out now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or (
+                time.monotonic() - self._opened_at < self.cooldown
+            ):
+                return False
+            # Let a single call through to see if Stripe is back
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                if self._opened_at is None or self._trial:
+                    logger.warning(
+                        "Stripe circuit opened after %d failures",
+                        self._failures,
+                    )
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+
+class LatencyMetrics:
+    """Counts and latencies of the requests made to Stripe."""
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=samples)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+            self.counts = {
+                "calls": 0,
+                "attempts": 0,
+                "connection_errors": 0,
+                "server_errors": 0,
+                "short_circuited": 0,
+            }
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def record_attempt(self, seconds, status=None):
+        """Record one HTTP attempt; `status` is ``None`` when it failed."""
+        with self._lock:
+            self.counts["attempts"] += 1
+            self._latencies.append(seconds)
+            if status is None:
+                self.counts["connection_errors"] += 1
+            elif status >= 500:
+                self.counts["server_errors"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            data = dict(self.counts)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            index = min(len(latencies) - 1, int(len(latencies) * p))
+            return round(latencies[index] * 1000, 1)
+
+        data["latency_ms"] = {
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": percentile(1),
+        }
+        return data
+
+
+class PooledHTTPClient(stripe.RequestsClient):
+    """Stripe's requests-based client with the policies described above."""
+
+    def __init__(self, breaker, metrics, timeout, pool_size, backoff,
+                 **kwargs):
+        session = requests.Session()
+        # Retries are left to Stripe's loop, which knows what is safe
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=0
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        super().__init__(timeout=timeout, session=session, **kwargs)
+        self.breaker = breaker
+        self.metrics = metrics
+        self.backoff = backoff
+
+    def request_with_retries(self, method, url, headers, post_data=None,
+                             max_network_retries=None, *, _usage=None):
+        if not self.breaker.allow():
+            self.metrics.count("short_circuited")
+            raise stripe.APIConnectionError(
+                "Stripe is unavailable (circuit open); not calling it",
+                should_retry=False,
+            )
+        self.metrics.count("calls")
+        try:
+            response = super().request_with_retries(
+                method, url, headers, post_data, max_network_retries,
+                _usage=_usage,
+            )
+        except stripe.APIConnectionError:
+            self.breaker.record_failure()
+            raise
+        if response[1] >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def request(self, method, url, headers, post_data=None):
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, headers, post_data)
+        except stripe.APIConnectionError:
+            self.metrics.record_attempt(time.perf_counter() - start)
+            raise
+        self.metrics.record_attempt(
+            time.perf_counter() - start, response[1]
+        )
+        return response
+
+    def _sleep_time_seconds(self, num_retries, response=None):
+        base, cap = self.backoff
+        return random.uniform(0, min(cap, base * 2 ** (num_retries - 1)))
+
+    def close(self):
+        self._session.close()
+
+
+metrics = LatencyMetrics()
+breaker = CircuitBreaker()
+
+_lock = threading.Lock()
+_state = {"client": None, "http_client": None}
+
+
+def get_client():
+    """The process-wide `stripe.StripeClient`."""
+    with _lock:
+        if _state["client"] is None:
+            api_key = getattr(settings, "STRIPE_SECRET_KEY", None)
+            if not api_key:
+                raise ImproperlyConfigured("STRIPE_SECRET_KEY is not set")
+            http_client = PooledHTTPClient(
+                breaker,
+                metrics,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                pool_size=POOL_SIZE,
+                backoff=(BACKOFF_SECONDS, BACKOFF_MAX_SECONDS),
+            )
+            _state["client"] = stripe.StripeClient(
+                api_key,
+                base_addresses={"api": settings.STRIPE_API_BASE},
+                max_network_retries=MAX_RETRIES,
+                http_client=http_client,
+            )
+            _state["http_client"] = http_client
+        return _state["client"]
+
+
+def stats():
+    """The metrics so far, with the state of the circuit."""
+    return {**metrics.snapshot(), "circuit": breaker.state}
+
+
+def reset_client():
+    """Drop the client and its connections; the next call builds one."""
+    with _lock:
+        if _state["http_client"] is not None:
+            _state["http_client"].close()
+        _state.update(client=None, http_client=None)
+
+
+@receiver(setting_changed)
+def _stripe_setting_changed(setting, **kwargs):
+    if setting.startswith("STRIPE_"):
+        reset_client()
@@ -1,17 +1,42 @@
-from django.test import TestCase, override_settings
+import io
+import json
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import cloudinary
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import (
+    Client, RequestFactory, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.utils import timezone
 from decimal import Decimal
-import sys
-import types
 from unittest import mock
 
 from rest_framework.test import APIClient
+import stripe
 import threading
 
-from .models import Order, OrderItem, Reservation, PaymentRecord
-from . import payments
+from gallery.models import Painting, StockItem
+from .availability import sellable
+from .cart_count import COOKIE_NAME
+from .carts import (
+    CART_SESSION_KEY, CartMiddleware, add_item, get_cart, merge_session_cart,
+)
+from .models import (
+    Cart, CartItem, Order, OrderItem, Reservation, PaymentRecord,
+)
+from . import payments, stripe_client
 
 
 User = get_user_model()
@@ -44,47 +69,251 @@ class OrdersModelTests(TestCase):
         self.assertTrue(delta.total_seconds() <= 4 * 3600 + 60)
 
 
-class PaymentsHelperTests(TestCase):
-    @override_settings(STRIPE_SECRET_KEY="sk_test_dummy")
-    def test_create_stripe_payment_intent_fallback_and_real_flow(self):
-        # First, verify fallback behavior when stripe is not available or fails
-        # Temporarily ensure no real stripe module is used by inserting a
-        # dummy module that raises
-        real_stripe = sys.modules.get("stripe")
-        try:
-            # Create a fake stripe module whose PaymentIntent.create returns
-            # a fake client_secret
-            fake_stripe = types.SimpleNamespace()
-            payment_intent_ns = types.SimpleNamespace()
-
-            def fake_create(*args, **kwargs):
-                return types.SimpleNamespace(
-                    client_secret="fake_cs_123"
+class FakeStripe:
+    """A local stand-in for the Stripe API.
+
+    Answers each request with the next of `responses` (``(status, body,
+    delay)``, body ``None`` for a default success), or succeeds, and
+    keeps the requests it received. Retrievals (GET) have no default.
+    """
+
+    DEFAULTS = {
+        "/v1/payment_intents": {
+            "id": "pi_1", "object": "payment_intent",
+            "client_secret": "pi_1_secret_1",
+        },
+        "/v1/refunds": {
+            "id": "re_1", "object": "refund", "status": "succeeded",
+        },
+    }
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                fake.requests.append({
+                    "path": self.path,
+                    "headers": dict(self.headers),
+                    "form": parse_qs(self.rfile.read(length).decode()),
+                    "client": self.client_address,
+                })
+                status, body, delay = (
+                    fake.responses.pop(0) if fake.responses
+                    else (200, None, 0)
                 )
-            payment_intent_ns.create = fake_create
-            fake_stripe.PaymentIntent = payment_intent_ns
-
-            class MockStripeModule:
-                class PaymentIntent:
-                    @staticmethod
-                    def create(*args, **kwargs):
-                        return types.SimpleNamespace(client_secret="fake_cs_123")  # noqa
-
-            sys.modules["stripe"] = types.ModuleType("stripe")
-            setattr(
-                sys.modules["stripe"],
-                "PaymentIntent",
-                MockStripeModule.PaymentIntent
-            )
-            payments.create_stripe_payment_intent(amount=100, currency="eur")
-        finally:
-            if real_stripe is not None:
-                sys.modules["stripe"] = real_stripe
-            else:
-                del sys.modules["stripe"]
-
-    def test_issue_refund_idempotent_model_helper(self):
-        # Create order and payment record
+                time.sleep(delay)
+                data = json.dumps(body or fake.DEFAULTS[self.path]).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # The client gave up waiting
+                    pass
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def fail(self, times, status=500, delay=0):
+        error = {"error": {"type": "api_error", "message": "Unavailable"}}
+        self.responses += [(status, error, delay)] * times
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StripeClientTests(TestCase):
+    def setUp(self):
+        self.stripe = FakeStripe()
+        self.addCleanup(self.stripe.close)
+        # Changing the settings rebuilds the client
+        stripe_settings = override_settings(
+            STRIPE_SECRET_KEY="sk_test_fake", STRIPE_API_BASE=self.stripe.url
+        )
+        stripe_settings.enable()
+        self.addCleanup(stripe_settings.disable)
+        breaker = stripe_client.CircuitBreaker(threshold=2, cooldown=60)
+        for name, value in [("BACKOFF_SECONDS", 0), ("breaker", breaker)]:
+            patch = mock.patch.object(stripe_client, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        stripe_client.metrics.reset()
+
+    def test_calls_share_one_kept_alive_connection(self):
+        secret = payments.create_stripe_payment_intent(
+            amount=1000, currency="eur", metadata={"order_id": 7}
+        )
+        self.assertEqual(secret, "pi_1_secret_1")
+        payments.create_stripe_payment_intent(amount=500, currency="eur")
+
+        first, second = self.stripe.requests
+        self.assertEqual(first["form"]["amount"], ["1000"])
+        self.assertEqual(first["form"]["metadata[order_id]"], ["7"])
+        self.assertEqual(
+            first["headers"]["Authorization"], "Bearer sk_test_fake"
+        )
+        self.assertEqual(first["client"], second["client"])
+        stats = stripe_client.stats()
+        self.assertEqual((stats["calls"], stats["attempts"]), (2, 2))
+        self.assertIsNotNone(stats["latency_ms"]["p95"])
+
+    def test_server_errors_are_retried_with_one_idempotency_key(self):
+        self.stripe.fail(2)
+        payments.create_stripe_payment_intent(amount=1000, currency="eur")
+        keys = {
+            request["headers"]["Idempotency-Key"]
+            for request in self.stripe.requests
+        }
+        self.assertEqual(len(self.stripe.requests), 3)
+        self.assertEqual(len(keys), 1)
+        stats = stripe_client.stats()
+        self.assertEqual((stats["calls"], stats["server_errors"]), (1, 2))
+        self.assertEqual(stats["circuit"], "closed")
+
+    @mock.patch.object(stripe_client, "MAX_RETRIES", 0)
+    @mock.patch.object(stripe_client, "READ_TIMEOUT", 0.2)
+    def test_slow_answers_time_out(self):
+        self.stripe.responses.append((200, None, 1))
+        with self.assertRaises(stripe.APIConnectionError):
+            payments.create_stripe_payment_intent(amount=1000)
+        self.assertEqual(stripe_client.stats()["connection_errors"], 1)
+
+    @mock.patch.object(stripe_client, "MAX_RETRIES", 0)
+    def test_circuit_opens_after_repeated_failures(self):
+        self.stripe.fail(2)
+        for _ in range(2):
+            with self.assertRaises(stripe.APIError):
+                payments.create_stripe_payment_intent(amount=1000)
+        with self.assertRaises(stripe.APIConnectionError):
+            payments.create_stripe_payment_intent(amount=1000)
+        # Failed fast, without calling Stripe
+        self.assertEqual(len(self.stripe.requests), 2)
+        stats = stripe_client.stats()
+        self.assertEqual(stats["short_circuited"], 1)
+        self.assertEqual(stats["circuit"], "open")
+
+    def _painting(self):
+        cache.clear()
+        return Painting.objects.create(
+            title="Painting", slug="painting", price=Decimal("10.00"),
+            date_created=timezone.now(),
+        )
+
+    def test_start_payment_outage_releases_the_order(self):
+        painting = self._painting()
+        order = Order.objects.create(total=Decimal("10.00"))
+        Reservation.objects.create(
+            order=order, product_title="Painting", product_sku=painting.sku,
+            expires_at=timezone.now() + timedelta(hours=4),
+        )
+        self.assertEqual(sellable([painting.sku]), {painting.sku: 0})
+        self.stripe.fail(3)
+        resp = APIClient().post(
+            reverse("orders:orders-start-payment", args=[order.pk]),
+            HTTP_IDEMPOTENCY_KEY="start-1",
+        )
+        self.assertEqual(resp.status_code, 503)
+        payment = PaymentRecord.objects.get()
+        self.assertEqual(payment.status, PaymentRecord.STATUS_FAILED)
+        self.assertIsNone(payment.provider_client_secret)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_CANCELLED)
+        self.assertEqual(sellable([painting.sku]), {painting.sku: 1})
+
+        # The cancelled order cannot be paid for any more
+        resp = APIClient().post(
+            reverse("orders:orders-start-payment", args=[order.pk]),
+            HTTP_IDEMPOTENCY_KEY="start-1",
+        )
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(len(self.stripe.requests), 3)
+
+    def test_checkout_outage_releases_the_order_and_keeps_the_cart(self):
+        painting = self._painting()
+        resp = self.client.post(
+            reverse("orders:orders-add-to-cart"),
+            data={
+                "content_type_id":
+                    ContentType.objects.get_for_model(Painting).pk,
+                "object_id": painting.pk, "quantity": 1,
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.stripe.fail(3)
+        resp = self.client.post(reverse("orders:checkout"), {
+            "guest_email": "g@x.com",
+            "same-address": "on",
+            "shipping_full_name": "G",
+            "shipping_line1": "1 Road",
+            "shipping_city": "Town",
+            "shipping_postal_code": "1000",
+            "shipping_country": "SI",
+        }, secure=True)
+        self.assertRedirects(
+            resp, reverse("orders:checkout"), fetch_redirect_response=False
+        )
+        order = Order.objects.get()
+        self.assertEqual(order.status, Order.STATUS_CANCELLED)
+        self.assertEqual(
+            order.payments.get().status, PaymentRecord.STATUS_FAILED
+        )
+        self.assertIsNotNone(order.reservations.get().released_at)
+        self.assertEqual(sellable([painting.sku]), {painting.sku: 1})
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_payment_complete_reads_the_intent(self):
+        order = Order.objects.create(total=Decimal("10.00"))
+        payment = PaymentRecord.objects.create(
+            order=order, provider="stripe", amount=order.total,
+        )
+        self.stripe.responses.append((200, {
+            "id": "pi_1", "object": "payment_intent", "status": "succeeded",
+            "metadata": {"order_id": str(order.pk)},
+        }, 0))
+        resp = self.client.get(
+            reverse("orders:payment-complete"), {"payment_intent": "pi_1"},
+            secure=True,
+        )
+        self.assertRedirects(
+            resp, reverse("orders:order_success", args=[order.pk]),
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(self.stripe.requests[0]["path"],
+                         "/v1/payment_intents/pi_1")
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentRecord.STATUS_SUCCEEDED)
+        self.assertEqual(payment.provider_payment_id, "pi_1")
+
+    def test_payment_complete_reports_an_outage(self):
+        self.stripe.fail(3)
+        resp = self.client.get(
+            reverse("orders:payment-complete"), {"payment_intent": "pi_1"},
+            secure=True,
+        )
+        self.assertRedirects(
+            resp, reverse("orders:checkout"), fetch_redirect_response=False
+        )
+        messages = [str(m) for m in resp.wsgi_request._messages]
+        self.assertIn("payment provider", messages[0])
+
+    def test_issue_refund_is_idempotent(self):
         order = Order.objects.create(total=Decimal("40.00"))
         pr = PaymentRecord.objects.create(
             order=order,
@@ -94,27 +323,29 @@ class PaymentsHelperTests(TestCase):
             currency="EUR",
             status=PaymentRecord.STATUS_SUCCEEDED
         )
-        # Patch stripe.Refund.create and ensure it's called only once
-        # across two helper invocations
-        calls = []
+        resp1 = pr.issue_refund(amount=Decimal("12.50"))
+        pr.refresh_from_db()
+        self.assertEqual(pr.provider_refund_id, "re_1")
+        self.assertEqual(pr.status, PaymentRecord.STATUS_REFUNDED)
+        self.assertEqual(self.stripe.requests[0]["form"], {
+            "charge": ["ch_999"], "amount": ["1250"],
+        })
+        # The stored response is returned; Stripe is not called again
+        resp2 = pr.issue_refund()
+        self.assertEqual(len(self.stripe.requests), 1)
+        self.assertEqual(resp1, resp2)
 
-        def fake_refund(**k):
-            calls.append(k)
-            return {"id": "re_999", "status": "succeeded"}
-        with mock.patch(
-            "stripe.Refund.create", fake_refund
-        ):
-            # First call should create a refund and populate provider_refund_id
-            resp1 = pr.issue_refund()
-            pr.refresh_from_db()
-            self.assertEqual(pr.provider_refund_id, "re_999")
-            self.assertEqual(pr.status, PaymentRecord.STATUS_REFUNDED)
-            self.assertEqual(len(calls), 1)
-            # Second call should be idempotent and not call
-            # stripe.Refund.create again
-            resp2 = pr.issue_refund()
-            self.assertEqual(len(calls), 1)
-            self.assertEqual(resp1, resp2)
+    def test_metrics_are_for_staff_only(self):
+        url = reverse("orders:orders-stripe-metrics")
+        client = APIClient()
+        self.assertEqual(client.get(url).status_code, 403)
+        client.force_authenticate(User.objects.create_user(
+            username="staff", password="x", is_staff=True
+        ))
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["circuit"], "closed")
+        self.assertIn("p50", resp.json()["latency_ms"])
 
 
 class ApiAndWebhookTests(TestCase):
@@ -196,7 +427,7 @@ class ApiAndWebhookTests(TestCase):
     @mock.patch("orders.payments.create_stripe_payment_intent", return_value="cs_test_123")  # noqa
     def test_start_payment_view_creates_payment_record(self, _mock_intent):
         order = Order.objects.create(total=Decimal("20.00"))
-        url = reverse("orders-start-payment", args=[order.pk])
+        url = reverse("orders:orders-start-payment", args=[order.pk])
         resp = self.client.post(url)
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
@@ -208,7 +439,7 @@ class ApiAndWebhookTests(TestCase):
 
     def test_start_payment_idempotency_returns_same_payment_and_client_secret(self):  # noqa
         order = Order.objects.create(total=Decimal("50.00"))
-        url = reverse("orders-start-payment", args=[order.pk])
+        url = reverse("orders:orders-start-payment", args=[order.pk])
         # send Idempotency-Key via header; mock the provider helper
         # to return a known client_secret
         with mock.patch("orders.payments.create_stripe_payment_intent", return_value="cs_idempotent_123"):  # noqa
@@ -250,7 +481,6 @@ class ApiAndWebhookTests(TestCase):
 
     def test_stock_decrements_on_webhook_success_and_flags_shortage(self):
         # prepare stock items
-        from gallery.models import StockItem
         # item A has 5 in stock, item B has 1 in stock
         StockItem.objects.create(title="Item A", sku="SKU-A", stock=5)
         StockItem.objects.create(title="Item B", sku="SKU-B", stock=1)
@@ -302,7 +532,6 @@ class ApiAndWebhookTests(TestCase):
 
     def test_concurrent_webhook_decrements_do_not_oversell(self):
         # Simulate two separate orders trying to buy the last unit of a SKU at the same time.  # noqa
-        from gallery.models import StockItem
         # SKU-C has 1 in stock
         StockItem.objects.create(title="Item C", sku="SKU-C", stock=1)
         # Two orders each requesting 1 of SKU-C
@@ -369,7 +598,6 @@ class ApiAndWebhookTests(TestCase):
         self.assertLessEqual(sold, initial)
 
     def test_order_create_reserves_single_item_and_snapshots_status(self):
-        from gallery.models import StockItem
         # single unique painting (stock=1) - mark as unique so reservation uses status transitions  # noqa
         p = StockItem.objects.create(title="Unique", sku="ONE-1", stock=1, is_unique=True)  # noqa
         url = reverse("orders-create")
@@ -410,13 +638,12 @@ class ApiAndWebhookTests(TestCase):
         pr = PaymentRecord.objects.create(order=order, provider="stripe", provider_payment_id="ch_123", amount=Decimal("30.00"), currency="EUR", status=PaymentRecord.STATUS_SUCCEEDED)  # noqa
         staff = User.objects.create_user(username="staff", password="pass", is_staff=True)  # noqa
         self.client.force_authenticate(user=staff)  # type: ignore
-        # Patch stripe.Refund.create to return a dummy response
-        fake_resp = {"id": "re_123", "status": "succeeded"}
-        fake_stripe = types.SimpleNamespace()
-        fake_stripe.Refund = types.SimpleNamespace(create=lambda **k: fake_resp)  # noqa
-        sys.modules["stripe"] = fake_stripe  # type: ignore
-        url = reverse("orders-refund", args=[pr.pk])
-        resp = self.client.post(url)
+        # Patch the Stripe client to return a dummy refund
+        client = mock.Mock()
+        client.v1.refunds.create.return_value = {"id": "re_123", "status": "succeeded"}  # noqa
+        url = reverse("orders:orders-refund", args=[pr.pk])
+        with mock.patch("orders.stripe_client.get_client", return_value=client):  # noqa
+            resp = self.client.post(url)
         self.assertEqual(resp.status_code, 200)
         pr.refresh_from_db()
         self.assertEqual(pr.status, PaymentRecord.STATUS_REFUNDED)
@@ -428,24 +655,35 @@ class ApiAndWebhookTests(TestCase):
         pr = PaymentRecord.objects.create(order=order, provider="stripe", provider_payment_id="ch_123", amount=Decimal("30.00"), currency="EUR", status=PaymentRecord.STATUS_SUCCEEDED)  # noqa
         staff = User.objects.create_user(username="staff2", password="pass", is_staff=True)  # noqa
         self.client.force_authenticate(user=staff)  # type: ignore
-        # Patch stripe.Refund.create to return a dummy response and count calls
-        call_count = {"n": 0}
-
-        def fake_refund(**k):
-            call_count["n"] += 1
-            return {"id": "re_abc", "status": "succeeded"}
-        with mock.patch("stripe.Refund.create", fake_refund):
-            url = reverse("orders-refund", args=[pr.pk])
+        # Patch the Stripe client to return a dummy refund and count calls
+        client = mock.Mock()
+        client.v1.refunds.create.return_value = {"id": "re_abc", "status": "succeeded"}  # noqa
+        with mock.patch("orders.stripe_client.get_client", return_value=client):  # noqa
+            url = reverse("orders:orders-refund", args=[pr.pk])
             headers = {"HTTP_IDEMPOTENCY_KEY": "idem-123"}
             resp1 = self.client.post(url, headers=headers)
             self.assertEqual(resp1.status_code, 200)
             resp2 = self.client.post(url, headers=headers)
             self.assertEqual(resp2.status_code, 200)
         # Only one provider refund call should have been made
-        self.assertEqual(call_count["n"], 1)
+        self.assertEqual(client.v1.refunds.create.call_count, 1)
         pr.refresh_from_db()
         self.assertEqual(pr.provider_refund_id, "re_abc")
 
+    def test_refund_reports_an_unreachable_stripe(self):
+        order = Order.objects.create(total=Decimal("30.00"))
+        pr = PaymentRecord.objects.create(order=order, provider="stripe", provider_payment_id="ch_123", amount=Decimal("30.00"), currency="EUR", status=PaymentRecord.STATUS_SUCCEEDED)  # noqa
+        staff = User.objects.create_user(username="staff3", password="pass", is_staff=True)  # noqa
+        self.client.force_authenticate(user=staff)  # type: ignore
+        client = mock.Mock()
+        client.v1.refunds.create.side_effect = stripe.APIConnectionError("down")  # noqa
+        with mock.patch("orders.stripe_client.get_client", return_value=client):  # noqa
+            resp = self.client.post(reverse("orders:orders-refund", args=[pr.pk]))  # noqa
+        self.assertEqual(resp.status_code, 503)
+        pr.refresh_from_db()
+        self.assertEqual(pr.status, PaymentRecord.STATUS_SUCCEEDED)
+        self.assertIsNone(pr.provider_refund_id)
+
 
 class MiddlewareTests(TestCase):
     def test_non_json_post_to_orders_create_returns_415(self):
@@ -476,3 +714,681 @@ class MiddlewareTests(TestCase):
         with self.settings(ORDERS_JSON_ONLY_VIEWS=["orders-create"]):
             resp = self.client.post(url, data={"guest_email": "x@x.com"})
         self.assertEqual(resp.status_code, 415)
+
+
+TEST_STORAGES = {**getattr(settings, "STORAGES", {})}
+TEST_STORAGES["staticfiles"] = {
+    "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+}
+
+# Queries each cart endpoint may run, whatever the number of items: the
+# session, the user, the cart with its items and their products, and the
+# endpoint's own work
+CART_QUERY_BUDGETS = {
+    "orders:orders-cart": 5,
+    # Includes reading the painting's availability (orders.availability)
+    "orders:orders-add-to-cart": 9,
+    "orders:orders-update-cart-item": 8,
+    "orders:orders-remove-from-cart": 8,
+    "orders:cart_page": 5,
+}
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class CartQueryBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(cloudinary.config(), "cloud_name", "test")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username="shopper", password="x")
+        self.client.force_login(self.user)
+        self.content_type = ContentType.objects.get_for_model(Painting)
+
+    def _paintings(self, count):
+        start = Painting.objects.count()
+        return [
+            Painting.objects.create(
+                title=f"Painting {i}", slug=f"painting-{i}",
+                price=Decimal("10.00"), date_created=timezone.now(),
+            )
+            for i in range(start, start + count)
+        ]
+
+    def _fill_cart(self, count):
+        """A cart holding `count` paintings, two of each."""
+        cart = Cart.objects.create(user=self.user)
+        for painting in self._paintings(count):
+            CartItem.objects.create(
+                cart=cart, content_type=self.content_type,
+                object_id=painting.pk, product_title=painting.title,
+                unit_price=painting.price, quantity=2,
+            )
+        return cart
+
+    def _count_queries(self, name, items, method="get", **data):
+        CartItem.objects.all().delete()
+        Cart.objects.all().delete()
+        Painting.objects.all().delete()
+        cart = self._fill_cart(items)
+        item = cart.items.first()
+        args = [item.pk] if "cart-item" in name or "remove" in name else []
+        with CaptureQueriesContext(connection) as queries:
+            resp = getattr(self.client, method)(
+                reverse(name, args=args), data=data,
+                content_type="application/json",
+            )
+        self.assertLess(resp.status_code, 400, resp.content)
+        return len(queries), resp
+
+    def test_totals_are_one_aggregate(self):
+        cart = self._fill_cart(3)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.totals(), (6, Decimal("60.00")))
+        cart.items.all().delete()
+        self.assertEqual(cart.totals(), (0, Decimal("0.00")))
+
+    def test_cart_endpoints_run_a_fixed_number_of_queries(self):
+        requests = [
+            ("orders:orders-cart", "get", {}),
+            ("orders:orders-update-cart-item", "patch", {"quantity": 3}),
+            ("orders:orders-remove-from-cart", "delete", {}),
+            ("orders:cart_page", "get", {}),
+        ]
+        for name, method, data in requests:
+            with self.subTest(name):
+                few, _ = self._count_queries(name, 1, method, **data)
+                many, _ = self._count_queries(name, 5, method, **data)
+                self.assertEqual(few, many)
+                self.assertLessEqual(many, CART_QUERY_BUDGETS[name])
+
+    def test_add_to_cart_returns_the_cart_totals(self):
+        cart = self._fill_cart(2)
+        painting = self._paintings(1)[0]
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.post(
+                reverse("orders:orders-add-to-cart"),
+                data={"content_type_id": self.content_type.pk,
+                      "object_id": painting.pk, "quantity": 1},
+                content_type="application/json",
+            )
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertEqual(resp.json()["total_items"], 5)
+        self.assertEqual(resp.json()["total_price"], "50.00")
+        self.assertLessEqual(
+            len(queries), CART_QUERY_BUDGETS["orders:orders-add-to-cart"]
+        )
+        self.assertEqual(cart.totals(), (5, Decimal("50.00")))
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class CartCountCookieTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.painting = Painting.objects.create(
+            title="Painting", slug="painting", price=Decimal("10.00"),
+            date_created=timezone.now(),
+        )
+        self.content_type = ContentType.objects.get_for_model(Painting)
+
+    def _add(self, quantity):
+        return self.client.post(
+            reverse("orders:orders-add-to-cart"),
+            data={"content_type_id": self.content_type.pk,
+                  "object_id": self.painting.pk, "quantity": quantity},
+            content_type="application/json",
+        )
+
+    def test_cart_changes_set_the_cookie_and_count_needs_no_queries(self):
+        resp = self._add(1)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertTrue(
+            resp.cookies[COOKIE_NAME].value.startswith("1:")
+        )
+        with self.assertNumQueries(0):
+            resp = self.client.get(reverse("orders:cart_count"))
+        self.assertEqual(resp.json(), {"count": 1})
+
+        item = CartItem.objects.get()
+        resp = self.client.delete(
+            reverse("orders:orders-remove-from-cart", args=[item.pk])
+        )
+        self.assertTrue(
+            resp.cookies[COOKIE_NAME].value.startswith("0:")
+        )
+
+    def test_count_without_a_valid_cookie_is_computed_once(self):
+        self._add(1)
+        self.client.cookies[COOKIE_NAME] = "99:forged"
+        resp = self.client.get(reverse("orders:cart_count"))
+        self.assertEqual(resp.json(), {"count": 1})
+        self.assertTrue(
+            resp.cookies[COOKIE_NAME].value.startswith("1:")
+        )
+        with self.assertNumQueries(0):
+            self.client.get(reverse("orders:cart_count"))
+
+    def test_logging_in_drops_the_cookie(self):
+        self._add(1)
+        user = User.objects.create_user(username="shopper", password="x")
+        CartItem.objects.create(
+            cart=Cart.objects.create(user=user),
+            product_object=self.painting, product_title="Painting",
+            unit_price=self.painting.price, quantity=3,
+        )
+        resp = self.client.post(
+            reverse("account_login"), {"login": "shopper", "password": "x"}
+        )
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.client.cookies[COOKIE_NAME].value, "")
+        # The user's cart, the session cart merged in
+        resp = self.client.get(reverse("orders:cart_count"))
+        self.assertEqual(resp.json(), {"count": 4})
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class RequestCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username="shopper", password="x")
+
+    def _request(self, user=None, session_key=None):
+        request = self.factory.get("/")
+        request.user = user or AnonymousUser()
+        request.session = SessionStore(session_key)
+        CartMiddleware(lambda r: None)(request)
+        return request
+
+    def test_cart_is_resolved_once_with_items_and_products(self):
+        cart = Cart.objects.create(user=self.user)
+        painting = Painting.objects.create(
+            title="Painting", slug="painting", price=Decimal("10.00"),
+            date_created=timezone.now(),
+        )
+        CartItem.objects.create(
+            cart=cart, product_object=painting, product_title="Painting",
+            unit_price=painting.price, quantity=2,
+        )
+        request = self._request(self.user)
+        # The cart, its items and the paintings
+        with self.assertNumQueries(3):
+            self.assertEqual(request.cart.pk, cart.pk)
+            self.assertEqual(get_cart(request).pk, cart.pk)
+            items = list(request.cart.items.all())
+            self.assertEqual(items[0].product_object, painting)
+            self.assertEqual(request.cart.totals(), (2, Decimal("20.00")))
+
+    def test_anonymous_cart_is_found_by_session(self):
+        session = SessionStore()
+        session.create()
+        cart = Cart.objects.create(session_key=session.session_key)
+        self.assertEqual(self._request(None, session.session_key).cart, cart)
+        request = self._request()
+        with self.assertNumQueries(0):
+            self.assertFalse(request.cart)
+
+    def test_session_key_is_unique(self):
+        Cart.objects.create(session_key="abc")
+        with self.assertRaises(IntegrityError):
+            Cart.objects.create(session_key="abc")
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class AddToCartUpsertTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="shopper", password="x")
+        self.painting = Painting.objects.create(
+            title="Painting", slug="painting", price=Decimal("10.00"),
+            date_created=timezone.now(),
+        )
+        self.data = {
+            "content_type_id": ContentType.objects.get_for_model(Painting).pk,
+            "object_id": self.painting.pk,
+            "quantity": 1,
+        }
+
+    def _client(self):
+        client = Client()
+        client.force_login(self.user)
+        return client
+
+    def test_add_returns_the_line_and_cart_totals(self):
+        client = self._client()
+        url = reverse("orders:orders-add-to-cart")
+        resp = client.post(url, self.data, content_type="application/json")
+        item = CartItem.objects.get()
+        self.assertEqual(resp.json(), {
+            "cart_item_id": item.pk,
+            "quantity": 1,
+            "unit_price": "10.00",
+            "total_items": 1,
+            "total_price": "10.00",
+        })
+
+    def test_adding_the_painting_again_is_rejected(self):
+        client = self._client()
+        url = reverse("orders:orders-add-to-cart")
+        client.post(url, self.data, content_type="application/json")
+        resp = client.post(url, self.data, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            resp.json(), {"detail": "Only 1 of this item available"}
+        )
+        # The upsert was rolled back
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+
+    def test_parallel_adds_are_not_lost(self):
+        prints = StockItem.objects.create(
+            title="Prints", sku="PRINT", stock=100
+        )
+        cart = Cart.objects.create(user=self.user)
+        content_type = ContentType.objects.get_for_model(StockItem)
+        workers = 8
+        barrier = threading.Barrier(workers)
+        added = []
+
+        def add():
+            barrier.wait()
+            try:
+                add_item(
+                    cart, content_type.pk, prints.pk, 1,
+                    product_title="Prints", product_sku="PRINT",
+                    unit_price=Decimal("5.00"),
+                )
+                added.append(1)
+            except DatabaseError:
+                # SQLite's in-memory test database fails writers that
+                # meet a table lock; count those out
+                pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertGreater(len(added), 0)
+        if connection.vendor != "sqlite":
+            self.assertEqual(len(added), workers)
+        # One line, and every upsert that succeeded is counted on it
+        self.assertEqual(CartItem.objects.get().quantity, len(added))
+
+    def test_parallel_adds_sell_the_painting_once(self):
+        Cart.objects.create(user=self.user)
+        clients = [self._client() for _ in range(8)]
+        barrier = threading.Barrier(len(clients))
+        statuses = []
+
+        def add(client):
+            # SQLite's in-memory test database fails writers that meet a
+            # table lock; count those requests out rather than crash
+            client.raise_request_exception = False
+            barrier.wait()
+            try:
+                resp = client.post(
+                    reverse("orders:orders-add-to-cart"), self.data,
+                    content_type="application/json",
+                )
+                statuses.append(resp.status_code)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=add, args=(client,)) for client in clients
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every add reaches the upsert, but only the first fits the one
+        # painting; the others are rolled back
+        self.assertEqual(statuses.count(200), 1)
+        if connection.vendor != "sqlite":
+            self.assertEqual(statuses.count(400), len(clients) - 1)
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class SessionCartMergeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="shopper", password="x")
+        self.content_type = ContentType.objects.get_for_model(Painting)
+        self.paintings = [
+            Painting.objects.create(
+                title=f"Painting {i}", slug=f"painting-{i}",
+                price=Decimal("10.00"), date_created=timezone.now(),
+            )
+            for i in range(6)
+        ]
+
+    def _add(self, painting, quantity):
+        resp = self.client.post(
+            reverse("orders:orders-add-to-cart"),
+            data={"content_type_id": self.content_type.pk,
+                  "object_id": painting.pk, "quantity": quantity},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200, resp.content)
+
+    def _log_in(self):
+        resp = self.client.post(
+            reverse("account_login"), {"login": "shopper", "password": "x"}
+        )
+        self.assertEqual(resp.status_code, 302)
+
+    def _quantities(self, cart):
+        return dict(cart.items.values_list("object_id", "quantity"))
+
+    def test_login_merges_the_session_cart_into_the_user_cart(self):
+        first, second = self.paintings[:2]
+        user_cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(
+            cart=user_cart, product_object=first, product_title=first.title,
+            unit_price=first.price, quantity=1,
+        )
+        self._add(first, 1)
+        self._add(second, 1)
+        self._log_in()
+        self.assertEqual(Cart.objects.get(), user_cart)
+        self.assertEqual(
+            self._quantities(user_cart), {first.pk: 2, second.pk: 1}
+        )
+        resp = self.client.get(reverse("orders:cart_count"))
+        self.assertEqual(resp.json(), {"count": 3})
+
+    def test_session_cart_is_handed_over_without_a_user_cart(self):
+        self._add(self.paintings[0], 1)
+        session_cart = Cart.objects.get()
+        self._log_in()
+        session_cart.refresh_from_db()
+        self.assertEqual(session_cart.user, self.user)
+        self.assertIsNone(session_cart.session_key)
+
+    def _merge_queries(self, items):
+        CartItem.objects.all().delete()
+        Cart.objects.all().delete()
+        user_cart = Cart.objects.create(user=self.user)
+        session_cart = Cart.objects.create(session_key=f"session-{items}")
+        for painting in self.paintings[:items]:
+            for cart in (user_cart, session_cart):
+                CartItem.objects.create(
+                    cart=cart, product_object=painting,
+                    product_title=painting.title, unit_price=painting.price,
+                    quantity=1,
+                )
+        request = RequestFactory().get("/")
+        request.session = SessionStore()
+        request.session[CART_SESSION_KEY] = session_cart.pk
+        with CaptureQueriesContext(connection) as queries:
+            merge_session_cart(request, self.user)
+        self.assertEqual(
+            self._quantities(user_cart),
+            {painting.pk: 2 for painting in self.paintings[:items]},
+        )
+        self.assertFalse(Cart.objects.filter(pk=session_cart.pk).exists())
+        return len(queries)
+
+    def test_merge_runs_a_constant_number_of_queries(self):
+        self.assertEqual(self._merge_queries(1), self._merge_queries(6))
+
+
+class PruneCartsTests(TestCase):
+    def _cart(self, days_idle, item_days_idle=None, **fields):
+        if not fields:
+            fields["session_key"] = f"session-{Cart.objects.count()}"
+        cart = Cart.objects.create(**fields)
+        when = timezone.now() - timedelta(days=days_idle)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=when)
+        if item_days_idle is not None:
+            item = CartItem.objects.create(
+                cart=cart, content_type=ContentType.objects.get_for_model(
+                    Painting
+                ),
+                object_id=1, product_title="Painting",
+                unit_price=Decimal("10.00"),
+            )
+            CartItem.objects.filter(pk=item.pk).update(
+                updated_at=timezone.now() - timedelta(days=item_days_idle)
+            )
+        return cart
+
+    def test_prunes_only_abandoned_anonymous_carts(self):
+        abandoned = [self._cart(20, item_days_idle=20) for _ in range(5)]
+        kept = [
+            self._cart(1),
+            # Its item was changed recently
+            self._cart(20, item_days_idle=1),
+            self._cart(20, user=User.objects.create_user("shopper")),
+        ]
+        out = io.StringIO()
+        call_command(
+            "prune_carts", days=14, batch_size=2, pause=0, stdout=out
+        )
+        self.assertQuerySetEqual(
+            Cart.objects.order_by("pk"), kept, ordered=True
+        )
+        self.assertEqual(CartItem.objects.count(), 1)
+        self.assertIn("Batch 3: 1 carts, 1 items deleted", out.getvalue())
+        self.assertIn("5 carts and 5 items deleted", out.getvalue())
+        self.assertFalse(
+            Cart.objects.filter(pk__in=[c.pk for c in abandoned]).exists()
+        )
+
+
+class ReleaseReservationsTests(TestCase):
+    def setUp(self):
+        self.StockItem = StockItem
+        self.item = StockItem.objects.create(
+            title="Unique", sku="ONE-1", stock=1, is_unique=True
+        )
+
+    def _order(self, sku="ONE-1"):
+        resp = APIClient().post(
+            reverse("orders:orders-create"),
+            {"guest_email": "g@x.com", "items": [{
+                "product_title": "Unique", "product_sku": sku,
+                "unit_price": "100.00", "quantity": 1,
+            }], "shipping_address": {
+                "full_name": "G", "line1": "1 Road", "city": "Town",
+                "postal_code": "1000", "country": "SI",
+            }},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 201, resp.content)
+        return Order.objects.latest("pk")
+
+    def _expire(self, order):
+        Reservation.objects.filter(order=order).update(
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+
+    def _release(self):
+        out = io.StringIO()
+        call_command("release_reservations", batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def test_order_reserves_until_expiry_then_item_is_released(self):
+        order = self._order()
+        reservation = Reservation.objects.get(order=order)
+        self.assertIsNone(reservation.user)
+        self.assertTrue(reservation.is_active())
+        self._release()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, self.StockItem.STATUS_RESERVED)
+
+        self._expire(order)
+        out = self._release()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, self.StockItem.STATUS_AVAILABLE)
+        reservation.refresh_from_db()
+        self.assertIsNotNone(reservation.released_at)
+        self.assertIn("1 reservations released, 1 items", out)
+
+    def test_item_held_by_a_live_reservation_stays_reserved(self):
+        self._expire(self._order())
+        # Another checkout holds the item
+        Reservation.create_reservation(None, "Unique", "ONE-1")
+        self._release()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, self.StockItem.STATUS_RESERVED)
+
+    def test_reserved_items_of_unpaid_orders_are_released(self):
+        # An order placed before reservations were recorded
+        Reservation.objects.filter(order=self._order()).delete()
+        self.StockItem.objects.filter(pk=self.item.pk).update(
+            updated_at=timezone.now() - timedelta(days=1),
+        )
+        fresh = self.StockItem.objects.create(
+            title="Fresh", sku="ONE-2", stock=1, is_unique=True,
+        )
+        Reservation.objects.filter(order=self._order("ONE-2")).delete()
+        self.assertIn("1 items available again", self._release())
+        self.item.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual(self.item.status, self.StockItem.STATUS_AVAILABLE)
+        self.assertEqual(fresh.status, self.StockItem.STATUS_RESERVED)
+
+    def test_items_reserved_by_hand_or_paid_for_stay_reserved(self):
+        paid = self.StockItem.objects.create(
+            title="Paid", sku="ONE-2", stock=1, is_unique=True,
+        )
+        order = self._order("ONE-2")
+        Reservation.objects.filter(order=order).delete()
+        PaymentRecord.objects.create(
+            order=order, provider="stripe", amount=Decimal("100.00"),
+            status=PaymentRecord.STATUS_SUCCEEDED,
+        )
+        self.StockItem.objects.update(
+            status=self.StockItem.STATUS_RESERVED,
+            updated_at=timezone.now() - timedelta(days=1),
+        )
+        self.assertIn("0 items available again", self._release())
+        self.item.refresh_from_db()
+        paid.refresh_from_db()
+        self.assertEqual(self.item.status, self.StockItem.STATUS_RESERVED)
+        self.assertEqual(paid.status, self.StockItem.STATUS_RESERVED)
+
+
+@override_settings(STORAGES=TEST_STORAGES, SECURE_SSL_REDIRECT=False)
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.StockItem = StockItem
+        StockItem.objects.create(title="Prints", sku="PRINT", stock=5)
+        StockItem.objects.create(
+            title="Unique", sku="ONE-1", stock=1, is_unique=True
+        )
+        self.painting = Painting.objects.create(
+            title="Painting", slug="painting", price=Decimal("10.00"),
+            date_created=timezone.now(),
+        )
+
+    def _reserve(self, sku, quantity=1, **fields):
+        fields.setdefault("expires_at", timezone.now() + timedelta(hours=1))
+        return Reservation.objects.create(
+            product_title="Held", product_sku=sku, quantity=quantity,
+            **fields
+        )
+
+    def _order(self, sku, quantity=1):
+        return APIClient().post(
+            reverse("orders:orders-create"),
+            {"guest_email": "g@x.com", "items": [{
+                "product_title": "Item", "product_sku": sku,
+                "unit_price": "10.00", "quantity": quantity,
+            }], "shipping_address": {
+                "full_name": "G", "line1": "1 Road", "city": "Town",
+                "postal_code": "1000", "country": "SI",
+            }},
+            format="json",
+        )
+
+    def test_sellable_subtracts_live_reservations(self):
+        sku = self.painting.sku
+        self._reserve("PRINT", 2)
+        self._reserve("PRINT", 1, released_at=timezone.now())
+        self._reserve(
+            "PRINT", 1, expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        with self.assertNumQueries(2):
+            available = sellable(["PRINT", "ONE-1", sku, "UNKNOWN"])
+        self.assertEqual(
+            available, {"PRINT": 3, "ONE-1": 1, sku: 1, "UNKNOWN": None}
+        )
+
+        self._reserve(sku)
+        self.StockItem.objects.filter(sku="ONE-1").update(
+            status=self.StockItem.STATUS_RESERVED
+        )
+        self.assertEqual(
+            sellable(["ONE-1", sku], use_cache=False), {"ONE-1": 0, sku: 0}
+        )
+
+    def test_answers_are_cached_until_a_reservation_changes(self):
+        self.assertEqual(sellable(["PRINT"]), {"PRINT": 5})
+        with self.assertNumQueries(0):
+            self.assertEqual(sellable(["PRINT"]), {"PRINT": 5})
+        reservation = self._reserve("PRINT", 4)
+        self.assertEqual(sellable(["PRINT"]), {"PRINT": 1})
+        reservation.delete()
+        self.assertEqual(sellable(["PRINT"]), {"PRINT": 5})
+
+    def test_held_painting_cannot_be_added_to_the_cart(self):
+        self._reserve(self.painting.sku)
+        resp = self.client.post(
+            reverse("orders:orders-add-to-cart"),
+            data={
+                "content_type_id":
+                    ContentType.objects.get_for_model(Painting).pk,
+                "object_id": self.painting.pk, "quantity": 1,
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_checkout_rejects_more_than_is_available(self):
+        self._reserve("PRINT", 4)
+        resp = self._order("PRINT", 2)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            resp.json(), {"items": {"0": "Only 1 of this item available"}}
+        )
+        self.assertFalse(Order.objects.exists())
+
+    def test_painting_is_held_by_checkout_and_sold_on_payment(self):
+        sku = self.painting.sku
+        self.assertEqual(self._order(sku).status_code, 201)
+        self.assertEqual(sellable([sku]), {sku: 0})
+        self.assertEqual(self._order(sku).status_code, 400)
+
+        order = Order.objects.get()
+        fake_event = {
+            "id": "evt_painting",
+            "type": "payment_intent.succeeded",
+            "data": {"object": {
+                "id": "pi_painting", "metadata": {"order_id": order.pk},
+            }},
+        }
+        with mock.patch(
+            "orders.webhooks.verify_stripe_event", return_value=fake_event
+        ):
+            self.client.post(
+                reverse("orders:orders-webhook"), data=b"{}",
+                content_type="application/json",
+                HTTP_STRIPE_SIGNATURE="sig",
+            )
+        self.painting.refresh_from_db()
+        self.assertEqual(self.painting.status, "sold")
+        order.refresh_from_db()
+        self.assertFalse(order.stock_shortage)
+        self.assertFalse(
+            Reservation.objects.filter(released_at__isnull=True).exists()
+        )
+        self.assertEqual(sellable([sku]), {sku: 0})
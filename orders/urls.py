@@ -5,7 +5,7 @@ from rest_framework.schemas import get_schema_view
 from . import api
 from . import views
 from .webhooks import stripe_webhook
-from .admin_api import RefundPaymentView
+from .admin_api import RefundPaymentView, StripeMetricsView
 
 
 app_name = 'orders'
@@ -31,6 +31,11 @@ urlpatterns = [
         RefundPaymentView.as_view(),
         name="orders-refund",
     ),
+    path(
+        "stripe/metrics/",
+        StripeMetricsView.as_view(),
+        name="orders-stripe-metrics",
+    ),
     # Cart API endpoints
     path("cart/view/", api.CartView.as_view(), name="orders-cart"),
     path("cart/add/", api.AddToCartView.as_view(), name="orders-add-to-cart"),
@@ -4,9 +4,15 @@ Keep this file tidy: group and alphabetize imports, add simple placeholders
 and implement real views as features are developed.
 """
 
+import logging
+
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
-from .models import Cart, Order
+from django.views.decorators.cache import never_cache
+from .cart_count import read_cart_count, remember_cart_count
+from .models import Order
+
+logger = logging.getLogger(__name__)
 
 
 def index(request):
@@ -14,74 +20,47 @@ def index(request):
     return HttpResponse("Orders app is running.")
 
 
+@never_cache
 def get_cart_count(request):
-    """API endpoint to get cart item count."""
-    # Get cart for user/session
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            count = cart.total_items
-        except Cart.DoesNotExist:
-            count = 0
-    else:
-        session_key = request.session.session_key
-        if session_key:
-            try:
-                cart = Cart.objects.get(session_key=session_key)
-                count = cart.total_items
-            except Cart.DoesNotExist:
-                count = 0
-        else:
-            count = 0
+    """API endpoint to get cart item count.
+
+    Answered from the cart count cookie when it is valid (no queries);
+    otherwise the count is computed and the cookie set (orders.cart_count).
+    """
+    count = read_cart_count(request)
+    if count is not None:
+        return JsonResponse({'count': count})
 
+    cart = request.cart
+    count = cart.total_items if cart else 0
+
+    remember_cart_count(request, count)
     return JsonResponse({'count': count})
 
 
+@never_cache
 def cart_view(request):
     """Display the shopping cart contents."""
-    # Get cart for user/session
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            cart = None
-    else:
-        session_key = request.session.session_key
-        if session_key:
-            try:
-                cart = Cart.objects.get(session_key=session_key)
-            except Cart.DoesNotExist:
-                cart = None
-        else:
-            cart = None
+    # Resolved by orders.carts.CartMiddleware, items and products included
+    cart = request.cart
+
+    total_items, total_price = cart.totals() if cart else (0, 0)
 
     context = {
         'cart': cart,
         'cart_items': cart.items.all() if cart else [],  # type: ignore
-        'total_items': cart.total_items if cart else 0,
-        'total_price': cart.total_price if cart else 0,
+        'total_items': total_items,
+        'total_price': total_price,
     }
 
     return render(request, 'orders/cart.html', context)
 
 
+@never_cache
 def checkout_view(request):
     """Display checkout form for completing the order."""
-    # Get cart for user/session
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-        except Cart.DoesNotExist:
-            cart = None
-    else:
-        session_key = request.session.session_key
-        if session_key:
-            try:
-                cart = Cart.objects.get(session_key=session_key)
-            except Cart.DoesNotExist:
-                cart = None
-        else:
-            cart = None
+    # Resolved by orders.carts.CartMiddleware, items and products included
+    cart = request.cart
 
     # Check for payment completion
     client_secret = request.GET.get('payment_intent_client_secret')
@@ -102,18 +81,19 @@ def checkout_view(request):
             return redirect('orders:checkout')
 
     # Redirect to cart if empty
-    if not cart or not cart.items.exists():  # type: ignore
+    if not cart or not cart.items.all():  # type: ignore
         from django.shortcuts import redirect
         return redirect('orders:cart_page')
 
     if request.method == 'POST':
         return _process_checkout(request, cart)
 
+    total_items, total_price = cart.totals()
     context = {
         'cart': cart,
         'cart_items': cart.items.all(),  # type: ignore
-        'total_items': cart.total_items,
-        'total_price': cart.total_price,
+        'total_items': total_items,
+        'total_price': total_price,
     }
 
     return render(request, 'orders/checkout.html', context)
@@ -123,7 +103,8 @@ def payment_complete_view(request):
     """Handle payment completion from Stripe."""
     from django.shortcuts import redirect
     from django.contrib import messages
-    from . import payments
+    from .stripe_client import get_client
+    import stripe
 
     # Get payment intent from URL parameters
     payment_intent_id = request.GET.get('payment_intent')
@@ -135,9 +116,16 @@ def payment_complete_view(request):
 
     try:
         # Retrieve payment intent from Stripe
-        payment_intent = payments.stripe.PaymentIntent.retrieve(
+        payment_intent = get_client().v1.payment_intents.retrieve(
             payment_intent_id)
+    except stripe.StripeError:
+        logger.warning("Could not retrieve payment intent %s",
+                       payment_intent_id, exc_info=True)
+        messages.error(request, 'We could not confirm your payment with '
+                       'our payment provider. Please try again shortly.')
+        return redirect('orders:checkout')
 
+    try:
         # Find the order using metadata
         order_id = payment_intent.metadata.get('order_id')
         if not order_id:
@@ -149,7 +137,7 @@ def payment_complete_view(request):
 
         if payment_intent.status == 'succeeded':
             # Payment successful
-            payment_record.status = payment_record.STATUS_COMPLETED
+            payment_record.status = payment_record.STATUS_SUCCEEDED
             payment_record.provider_payment_id = payment_intent_id
             payment_record.save()
 
@@ -208,7 +196,8 @@ def _process_checkout(request, cart):
     from django.shortcuts import redirect
     from .serializers import OrderCreateSerializer
     from . import payments
-    import stripe  # noqa: F401
+    from .reservations import cancel_order
+    import stripe
 
     # Extract form data
     guest_email = request.POST.get('guest_email')
@@ -314,17 +303,26 @@ def _process_checkout(request, cart):
         )
 
         # Create Stripe payment intent
-        client_secret = payments.create_stripe_payment_intent(
-            amount=int(order.total * 100),
-            currency=order.currency.lower(),
-            metadata={"order_id": order.pk}
-        )
+        try:
+            client_secret = payments.create_stripe_payment_intent(
+                amount=int(order.total * 100),
+                currency=order.currency.lower(),
+                metadata={"order_id": order.pk}
+            )
+        except stripe.StripeError:
+            # Don't leave the order holding stock until it expires; the
+            # cart is kept so the customer can simply try again
+            cancel_order(order)
+            messages.error(request, 'Our payment provider is unavailable. '
+                           'Please try again in a moment.')
+            return redirect('orders:checkout')
 
         payment.provider_client_secret = client_secret
         payment.save()
 
         # Clear cart after successful order creation
         cart.items.all().delete()  # type: ignore
+        remember_cart_count(request, 0)
 
         # Redirect to payment processing page with client_secret
         from django.urls import reverse
@@ -1,10 +1,12 @@
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
+from .availability import invalidate, painting_id
 from .payments import verify_stripe_event
-from .models import PaymentRecord, Order, ProcessedEvent
+from .models import PaymentRecord, Order, ProcessedEvent, Reservation
 from django.db import transaction
-from gallery.models import StockItem
+from django.utils import timezone
+from gallery.models import Painting, StockItem
 from django.core.mail import send_mail
 from django.conf import settings
 
@@ -71,7 +73,23 @@ def stripe_webhook(request):
                             )
                         )
                         prod_map = {p.sku: p for p in products}
+                        paintings = Painting.objects.select_for_update(
+                        ).filter(
+                            pk__in=[painting_id(sku) for sku in sku_map]
+                        )
+                        painting_map = {p.sku: p for p in paintings}
                         for sku, qty in sku_map.items():
+                            painting = painting_map.get(sku)
+                            if painting:
+                                # One-of-a-kind: sold, unless sold already
+                                if qty == 1 and painting.status in (
+                                    'available', 'reserved'
+                                ):
+                                    painting.status = 'sold'
+                                    painting.save()
+                                else:
+                                    shortage = True
+                                continue
                             stock_item = prod_map.get(sku)
                             if not stock_item:
                                 shortage = True
@@ -106,6 +124,14 @@ def stripe_webhook(request):
                                 else:
                                     shortage = True
 
+                # The stock is taken now; stop holding it
+                released = Reservation.objects.filter(
+                    order=order, released_at__isnull=True
+                )
+                skus = list(released.values_list("product_sku", flat=True))
+                released.update(released_at=timezone.now())
+                invalidate(skus)
+
                 if shortage:
                     # Mark order as having stock shortage.
                     # This indicates insufficient stock for